@@ -9,6 +9,7 @@ Python version: 3.4
 from datetime import datetime
 
 import ons_twitter.data_import as data_import
+from ons_twitter.robots import load_robot_registry
 
 
 """
@@ -48,7 +49,10 @@ for file_name in files:
                                      chunk_size=10000)
 
 # insert all files from the output folder. Note that the first argument can be a file as well,
-# in which case the function imports that file only
+# in which case the function imports that file only. Tweets of robots in special_csv are not imported.
 data_import.import_files(output_folder,
                          mongo_connection=twitter_mongo,
-                         mongo_address=mongo_address)
\ No newline at end of file
+                         mongo_address=mongo_address,
+                         detect_robots=True,
+                         robot_registry=load_robot_registry(),
+                         metrics_file="data/output/import_metrics.json")
\ No newline at end of file
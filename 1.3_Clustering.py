@@ -25,7 +25,8 @@ user_no = cl.cluster_all(twitter_data,
                          mongo_address,
                          parallel=True,
                          debug=False,
-                         num_cores=-1)
+                         num_cores=-1,
+                         metrics_file="data/output/cluster_metrics.json")
 
 # print information at the end
 print("\n  ****\nFinished clustering at: ", datetime.now(),
@@ -1,6 +1,10 @@
 """
-Description:    Flag the dominant cluster of each user. The dominant cluster is the most populous
-                residential cluster for each user.
+Description:    Validate the dominant cluster flags. The dominant cluster is the most populous
+                residential cluster for each user. These are flagged during clustering (1.3),
+                so this step is optional: it recomputes the dominant clusters with an aggregation
+                and reports users whose flags disagree. Set FIX_MISMATCHES to reflag these users.
+                If clusters were written in normalised form, set clusters_connection to read them
+                from the clusters collection instead of the tweets.
 Author:         Bence Komarniczky
 Date:           02/06/2015
 Python version: 3.4
@@ -11,38 +15,95 @@ from datetime import datetime
 import pymongo
 from joblib import Parallel, delayed
 
+from ons_twitter.chunk_versions import bump_versions
 
-# establish mongo connection
-db = pymongo.MongoClient("192.168.0.99:30000")["twitter"]["tweets"]
 
+# specify mongodb databases
+twitter_data = ("192.168.0.99:30000", "twitter", "tweets")
 
-def find_and_update_dominant_clusters(chunk_id):
+# clusters collection if clusters were written in normalised form (see cluster_all), otherwise None
+# eg: clusters_connection = ("192.168.0.99:30000", "twitter", "clusters")
+clusters_connection = None
+
+# reflag users with wrong dominant flags
+FIX_MISMATCHES = False
+
+
+def validate_dominant_clusters(chunk_id):
     print("Starting chunk id %3.d at %s" % (chunk_id, str(datetime.now())))
-    # get the count for each dominant cluster
-    by_cluster = db.aggregate([{"$match": {"chunk_id": chunk_id, "cluster.type": "cluster",
-                                           "cluster.address": {"$ne": "NA"},
-                                           "cluster.address.classification.abbreviated": "R"}},
-                               {"$group": {"_id": "$user_id", "cluster_count": {"$max": "$cluster.count"}
-                                           }}])
-
-    by_cluster_list = list(by_cluster)
-
-    bulk = db.initialize_unordered_bulk_op()
-
-    # search for these dominant clusters to retrieve whole documents
-    for dominant_cluster in by_cluster_list:
-        bulk.find({"chunk_id": chunk_id,
-                   "user_id": dominant_cluster["_id"],
-                   "cluster.address.classification.abbreviated": "R",
-                   "cluster.count": dominant_cluster["cluster_count"]}
-                  ).update({"$set": {"cluster.dominant": 1}})
-
-    print("Starting inserts for chunk: %3.d at %s number of dominant clusters: %4.d" % (chunk_id,
-                                                                                        str(datetime.now()),
-                                                                                        len(by_cluster_list)))
-    # execute updates
-    bulk.execute()
-    print("Finished inserts for chunk: %3.d at %s" % (chunk_id, str(datetime.now())))
-
-# do updates in parallel
-Parallel(n_jobs=-1)(delayed(find_and_update_dominant_clusters)(chunk_id) for chunk_id in range(1000))
+    tweets = pymongo.MongoClient(twitter_data[0])[twitter_data[1]][twitter_data[2]]
+
+    # clusters are either embedded in the tweets or one document each in the clusters collection
+    if clusters_connection is None:
+        clusters = tweets
+        prefix = "cluster."
+        cluster_id_field = "$cluster.cluster_id"
+        remove_flag = {"$unset": {"cluster.dominant": ""}}
+    else:
+        clusters = pymongo.MongoClient(clusters_connection[0])[clusters_connection[1]][clusters_connection[2]]
+        prefix = ""
+        cluster_id_field = "$_id"
+        remove_flag = {"$set": {"dominant": 0}}
+
+    # get the count of every residential cluster of each user
+    by_user = clusters.aggregate([{"$match": {"chunk_id": chunk_id, prefix + "type": "cluster",
+                                              prefix + "address": {"$ne": "NA"},
+                                              prefix + "address.classification.abbreviated": "R"}},
+                                  {"$group": {"_id": cluster_id_field,
+                                              "user_id": {"$first": "$user_id"},
+                                              "cluster_count": {"$first": "$" + prefix + "count"}}},
+                                  {"$group": {"_id": "$user_id", "cluster_counts": {"$push": "$cluster_count"}}}])
+
+    # largest count of each user and the number of clusters with it, all of them are dominant
+    expected = {}
+    for residential_clusters in by_user:
+        largest_count = max(residential_clusters["cluster_counts"])
+        expected[residential_clusters["_id"]] = (largest_count,
+                                                 residential_clusters["cluster_counts"].count(largest_count))
+
+    # get the clusters flagged during clustering
+    flagged = clusters.aggregate([{"$match": {"chunk_id": chunk_id, prefix + "dominant": 1}},
+                                  {"$group": {"_id": cluster_id_field,
+                                              "user_id": {"$first": "$user_id"},
+                                              "cluster_count": {"$first": "$" + prefix + "count"},
+                                              "type": {"$first": "$" + prefix + "address.classification.abbreviated"}
+                                              }}])
+
+    flagged_clusters = {}
+    mismatched_users = set()
+    for flagged_cluster in flagged:
+        user_id = flagged_cluster["user_id"]
+        flagged_clusters[user_id] = flagged_clusters.get(user_id, 0) + 1
+        if flagged_cluster["type"] != "R" or expected.get(user_id, (None,))[0] != flagged_cluster["cluster_count"]:
+            mismatched_users.add(user_id)
+
+    # users with a residential cluster but not all of the tied clusters flagged
+    for user_id, (largest_count, number_of_dominant) in expected.items():
+        if flagged_clusters.get(user_id, 0) != number_of_dominant:
+            mismatched_users.add(user_id)
+
+    print("Finished chunk: %3.d at %s dominant users: %4.d mismatched users: %4.d" % (chunk_id,
+                                                                                       str(datetime.now()),
+                                                                                       len(expected),
+                                                                                       len(mismatched_users)))
+
+    if FIX_MISMATCHES and len(mismatched_users) > 0:
+        # cluster documents keep dominant: 0, embedded clusters have no flag
+        bulk = clusters.initialize_ordered_bulk_op()
+        for user_id in mismatched_users:
+            bulk.find({"chunk_id": chunk_id, "user_id": user_id}).update(remove_flag)
+            if user_id in expected:
+                bulk.find({"chunk_id": chunk_id,
+                           "user_id": user_id,
+                           prefix + "type": "cluster",
+                           prefix + "address.classification.abbreviated": "R",
+                           prefix + "count": expected[user_id][0]}
+                          ).update({"$set": {prefix + "dominant": 1}})
+        bulk.execute()
+        bump_versions(tweets, [chunk_id], "dominant flagging")
+
+    return len(mismatched_users)
+
+# validate in parallel
+mismatches = Parallel(n_jobs=-1)(delayed(validate_dominant_clusters)(chunk_id) for chunk_id in range(1000))
+print("Users with mismatched dominant flags: %d" % sum(mismatches))
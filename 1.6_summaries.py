@@ -0,0 +1,62 @@
+"""
+Description:    Write the user_summary and cluster_summary collections after clustering and derive the
+                summary statistics of in_development from them. Run after 1.5_flag_dominant.py.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+from csv import writer
+from datetime import datetime
+
+import ons_twitter.summaries as summaries
+from ons_twitter.supporting_functions import create_folder
+
+
+# specify mongodb databases
+twitter_data = ("192.168.0.99:30000", "twitter", "tweets")
+user_summary = ("192.168.0.99:30000", "twitter", "user_summary")
+cluster_summary = ("192.168.0.99:30000", "twitter", "cluster_summary")
+
+# clusters collection if clusters were written in normalised form (see cluster_all), otherwise None
+# eg: clusters_connection = ("192.168.0.99:30000", "twitter", "clusters")
+clusters_connection = None
+
+# folder for the statistics
+output_folder = "data/output/"
+
+
+def write_distribution(distribution, file_name, header):
+    """
+    Write a dictionary of {key: count} to csv, sorted by key.
+    """
+    with open(output_folder + file_name, 'w', newline="\n") as out_file:
+        out_csv = writer(out_file, delimiter=",")
+        out_csv.writerow(header)
+        for key in sorted(distribution, key=str):
+            out_csv.writerow([key, distribution[key]])
+
+
+# build the summary tables, one aggregation per chunk
+summaries.summarise_all(twitter_data,
+                        user_summary,
+                        cluster_summary,
+                        clusters_connection=clusters_connection)
+
+# statistics from the small tables
+start_time = datetime.now()
+create_folder(output_folder)
+
+write_distribution(summaries.address_type_counts(cluster_summary),
+                   "summary.csv", ["_id", "count_by_group"])
+write_distribution(summaries.cluster_size_distribution(cluster_summary),
+                   "cluster_distribution.csv", ["size", "count"])
+write_distribution(summaries.cluster_size_distribution(cluster_summary, dominant_only=True),
+                   "dominant_distribution.csv", ["size", "count"])
+write_distribution(summaries.residential_months_distribution(cluster_summary),
+                   "months_distribution.csv", ["months", "Users with months"])
+write_distribution(summaries.residential_cluster_counts(user_summary),
+                   "residential_counts.csv", ["residential_clusters", "users"])
+write_distribution(summaries.user_cluster_types(user_summary),
+                   "user_types.csv", ["type", "users"])
+
+print("Statistics written to %s in %s" % (output_folder, datetime.now() - start_time))
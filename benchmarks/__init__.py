@@ -0,0 +1,5 @@
+"""
+Description:    Benchmarks of the clustering functions on synthetic users, see cluster_benchmark.py.
+Date:           19/10/2026
+Python version: 3.4
+"""
@@ -0,0 +1,262 @@
+"""
+Description:    Clustering benchmark on synthetic users with heavy-tailed tweet counts, see synthetic_users.py.
+                For every user it times the original dense clustering (distance_matrix, then create_one_cluster
+                until all tweets are used), cluster_labels with every neighbour search and cluster_one_user end to
+                end. Peak memory of each is measured with tracemalloc in a second run, so the timings are not
+                slowed down by tracing. Cluster labels of all implementations must agree.
+                Run from the root of the repository: python -m benchmarks.cluster_benchmark
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import tracemalloc
+from csv import writer
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+
+import ons_twitter.cluster as cl
+from ons_twitter.supporting_functions import create_folder
+from benchmarks.synthetic_users import synthetic_users
+
+# users above this size are not clustered with the dense methods, their distance matrix does not fit into memory
+DENSE_LIMIT = 5000
+
+# buckets of users by number of tweets for the summary
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000)
+
+
+def _measure(function,
+             measure_memory=True):
+    """
+    Run function and time it. If measure_memory then it is run again with tracemalloc for its peak memory.
+
+    :return:    Tuple of (result, seconds, peak memory in bytes or None)
+    :rtype      tuple
+    """
+
+    start_time = perf_counter()
+    result = function()
+    seconds = perf_counter() - start_time
+
+    peak_memory = None
+    if measure_memory:
+        tracemalloc.start()
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result, seconds, peak_memory
+
+
+def create_one_cluster_labels(tweets,
+                              distances,
+                              eps=20):
+    """
+    Cluster label of every tweet, by calling create_one_cluster until all tweets are used, as cluster_one_user
+    used to do. Clusters are numbered in the order they are found, which is the order of their first tweet.
+
+    :param tweets:      _id, user_id, coordinates tuples
+    :param distances:   Output of distance_matrix.
+    :param eps:         Distance parameter for DBScan algorithm.
+    :return:            Cluster label of each tweet.
+
+    :type tweets        list[list]
+    :type distances     np.ndarray
+    :type eps           int | float
+    :rtype              np.ndarray
+    """
+
+    positions = dict((tweet[0], position) for position, tweet in enumerate(tweets))
+    labels = np.empty(len(tweets), dtype="int64")
+    remaining_mask = [list(range(len(tweets))), np.arange(len(tweets), dtype=np.uint32)]
+
+    label = 0
+    while True:
+        new_cluster, remaining_mask = cl.create_one_cluster(tweets, remaining_mask, distances, eps=eps)
+        if new_cluster is None:
+            break
+        labels[[positions[tweet[0]] for tweet in new_cluster]] = label
+        label += 1
+
+    return labels
+
+
+def cluster_one_user_labels(user_id,
+                            tweets,
+                            eps=20,
+                            neighbour_method="grid"):
+    """
+    Cluster label of every tweet from the update instructions of cluster_one_user. Addresses are not looked up.
+
+    :return:    Cluster label of each tweet.
+    :rtype      np.ndarray
+    """
+
+    positions = dict((tweet[0], position) for position, tweet in enumerate(tweets))
+    labels = np.empty(len(tweets), dtype="int64")
+
+    mongo_updates = cl.cluster_one_user(user_id, {user_id: tweets}, None, eps=eps, neighbour_method=neighbour_method,
+                                        pending_addresses=[])
+    for label, cluster in enumerate(mongo_updates):
+        labels[[positions[tweet_info[0]] for tweet_info in cluster]] = label
+
+    return labels
+
+
+def benchmark_user(user_id,
+                   tweets,
+                   eps=20,
+                   dense_limit=DENSE_LIMIT,
+                   measure_memory=True):
+    """
+    Time all clustering implementations on one user and compare their labels.
+
+    :param user_id:         Twitter user_id.
+    :param tweets:          Tweets of the user.
+    :param eps:             Distance parameter for DBScan algorithm.
+    :param dense_limit:     Largest user clustered with the dense methods.
+    :param measure_memory:  If true then peak memory is measured as well.
+    :return:                Tuple of (list of result rows, True if all labels agree)
+
+    :type user_id           int
+    :type tweets            list[list]
+    :type eps               int | float
+    :type dense_limit       int
+    :type measure_memory    bool
+    :rtype                  tuple[list[dict], bool]
+    """
+
+    rows = []
+    all_labels = []
+
+    def add_row(stage, method, seconds, peak_memory, labels):
+        rows.append({"user_id": user_id,
+                     "tweets": len(tweets),
+                     "stage": stage,
+                     "method": method,
+                     "seconds": seconds,
+                     "peak_memory_mb": None if peak_memory is None else peak_memory / 2 ** 20,
+                     "clusters": None if labels is None else int(labels.max()) + 1})
+        if labels is not None:
+            all_labels.append(labels)
+
+    methods = ["grid"] + (["kdtree"] if cl.cKDTree is not None else [])
+
+    # original clustering with the full distance matrix
+    if len(tweets) <= dense_limit:
+        methods.append("dense")
+        distances, seconds, peak_memory = _measure(lambda: cl.distance_matrix(tweets), measure_memory)
+        add_row("distance_matrix", "dense", seconds, peak_memory, None)
+
+        labels, seconds, peak_memory = _measure(lambda: create_one_cluster_labels(tweets, distances, eps=eps),
+                                                measure_memory)
+        add_row("create_one_cluster", "dense", seconds, peak_memory, labels)
+        del distances
+
+    # labels only and end to end clustering with every neighbour search
+    for method in methods:
+        labels, seconds, peak_memory = _measure(lambda: cl.cluster_labels(tweets, eps=eps, method=method),
+                                                measure_memory)
+        add_row("cluster_labels", method, seconds, peak_memory, labels)
+
+        labels, seconds, peak_memory = _measure(lambda: cluster_one_user_labels(user_id, tweets, eps=eps,
+                                                                                neighbour_method=method),
+                                                measure_memory)
+        add_row("cluster_one_user", method, seconds, peak_memory, labels)
+
+    labels_agree = all(np.array_equal(all_labels[0], labels) for labels in all_labels[1:])
+
+    return rows, labels_agree
+
+
+def _size_bucket(number_of_tweets):
+    return SIZE_BUCKETS[np.searchsorted(SIZE_BUCKETS, number_of_tweets, side="right") - 1]
+
+
+def print_summary(rows):
+    """
+    Print total time and largest peak memory of every stage and method by user size.
+
+    :type rows  list[dict]
+    """
+
+    summary = {}
+    for row in rows:
+        key = (row["stage"], row["method"], _size_bucket(row["tweets"]))
+        entry = summary.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += row["seconds"]
+        entry[2] = max(entry[2], row["peak_memory_mb"] or 0.0)
+
+    print("\n%-20s %-8s %8s %6s %10s %12s" % ("stage", "method", "tweets", "users", "seconds", "peak MB"))
+    for (stage, method, bucket), (users, seconds, peak_memory) in sorted(summary.items()):
+        print("%-20s %-8s %8s %6d %10.3f %12.1f" % (stage, method, "%d+" % bucket, users, seconds, peak_memory))
+
+
+def run_benchmark(number_of_users=200,
+                  seed=0,
+                  eps=20,
+                  dense_limit=DENSE_LIMIT,
+                  measure_memory=True,
+                  max_tweets=30000,
+                  output_file="data/output/cluster_benchmark.csv"):
+    """
+    Benchmark the clustering on synthetic users and write one row per user, stage and method to a csv file.
+    Raises an AssertionError after writing the results if the labels of any user disagree.
+
+    :param number_of_users: Number of synthetic users.
+    :param seed:            Seed of the synthetic users, same seed gives the same users.
+    :param eps:             Distance parameter for DBScan algorithm.
+    :param dense_limit:     Largest user clustered with the dense methods.
+    :param measure_memory:  If true then peak memory is measured as well, this runs everything twice.
+    :param max_tweets:      Largest number of tweets of a user.
+    :param output_file:     Location of csv file, nothing is written if None.
+    :return:                List of result rows.
+
+    :type number_of_users   int
+    :type seed              int
+    :type eps               int | float
+    :type dense_limit       int
+    :type measure_memory    bool
+    :type max_tweets        int
+    :type output_file       str | None
+    :rtype                  list[dict]
+    """
+
+    start_time = datetime.now()
+    users = synthetic_users(number_of_users, seed=seed, max_tweets=max_tweets)
+    print("Benchmarking %d users, %d tweets, largest user: %d tweets" % (len(users),
+                                                                          sum(len(x) for x in users.values()),
+                                                                          max(len(x) for x in users.values())))
+
+    # largest users first, so the slow ones show up early
+    all_rows = []
+    disagreeing_users = []
+    for user_id, tweets in sorted(users.items(), key=lambda x: -len(x[1])):
+        rows, labels_agree = benchmark_user(user_id, tweets, eps=eps, dense_limit=dense_limit,
+                                            measure_memory=measure_memory)
+        all_rows.extend(rows)
+        if not labels_agree:
+            disagreeing_users.append(user_id)
+            print("   labels disagree for user %d with %d tweets!" % (user_id, len(tweets)))
+
+    if output_file is not None:
+        create_folder(output_file.rsplit("/", 1)[0] + "/" if "/" in output_file else "./")
+        columns = ["user_id", "tweets", "stage", "method", "seconds", "peak_memory_mb", "clusters"]
+        with open(output_file, 'w', newline="") as out_file:
+            csv_writer = writer(out_file)
+            csv_writer.writerow(columns)
+            csv_writer.writerows([row[column] for column in columns] for row in all_rows)
+
+    print_summary(all_rows)
+    print("\nBenchmark finished in %s" % (datetime.now() - start_time))
+
+    assert len(disagreeing_users) == 0, "Cluster labels disagree for users: %s" % disagreeing_users
+
+    return all_rows
+
+
+if __name__ == "__main__":
+    run_benchmark()
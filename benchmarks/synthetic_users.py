@@ -0,0 +1,113 @@
+"""
+Description:    Synthetic users for benchmarking the clustering. Tweet counts follow a heavy-tailed, power law
+                distribution from 1 up to the robot threshold: a power law with exponent 1.44 fits the tweet counts
+                of dominant clusters in in_development/dominant_distribution.csv. Tweets are concentrated around a
+                few sites of each user (home, work and some other places), with a share of scattered noise.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import numpy as np
+
+# maximum likelihood fit to the tweet counts of dominant clusters in in_development/dominant_distribution.csv
+TWEET_COUNT_EXPONENT = 1.44
+
+# a town sized area in easting, northing coordinates
+AREA_ORIGIN = (400000, 300000)
+AREA_SIZE = 20000
+
+
+def tweet_counts(number_of_users,
+                 random_state,
+                 exponent=TWEET_COUNT_EXPONENT,
+                 max_tweets=30000):
+    """
+    Number of tweets of each user, from a power law P(n) ~ n ** -exponent for n in 1..max_tweets.
+
+    :param number_of_users: Number of users.
+    :param random_state:    Numpy random state.
+    :param exponent:        Exponent of the power law.
+    :param max_tweets:      Largest number of tweets, users above the robot threshold are never clustered.
+    :return:                Tweet count of each user.
+
+    :type number_of_users   int
+    :type random_state      np.random.RandomState
+    :type exponent          float
+    :type max_tweets        int
+    :rtype                  np.ndarray
+    """
+
+    counts = np.arange(1, max_tweets + 1)
+    probabilities = np.cumsum(counts ** -float(exponent))
+    probabilities /= probabilities[-1]
+
+    return counts[np.minimum(np.searchsorted(probabilities, random_state.random_sample(number_of_users)),
+                             max_tweets - 1)]
+
+
+def user_tweets(user_id,
+                number_of_tweets,
+                random_state,
+                site_spread=15,
+                noise_share=0.1):
+    """
+    Tweets of one user around a home, a work site and up to 3 other sites, in the format of fetch_chunk_arrays
+    and create_dictionary_for_chunk: [_id, user_id, [easting, northing]]. Home gets the most tweets.
+    Coordinates are rounded to whole metres, so busy sites have many tweets at the same point as in real data.
+
+    :param user_id:             Twitter user_id.
+    :param number_of_tweets:    Number of tweets.
+    :param random_state:        Numpy random state.
+    :param site_spread:         Standard deviation of tweets around their site in metres.
+    :param noise_share:         Share of tweets scattered over the whole area.
+    :return:                    List of tweets.
+
+    :type user_id               int
+    :type number_of_tweets      int
+    :type random_state          np.random.RandomState
+    :type site_spread           int | float
+    :type noise_share           float
+    :rtype                      list[list]
+    """
+
+    number_of_sites = 2 + random_state.randint(0, 4)
+    sites = np.array(AREA_ORIGIN) + random_state.randint(0, AREA_SIZE, (number_of_sites, 2))
+
+    # home first, then work, then the rest
+    weights = np.array([0.55, 0.3] + [0.15 / max(number_of_sites - 2, 1)] * (number_of_sites - 2))
+    weights /= weights.sum()
+
+    points = sites[random_state.choice(number_of_sites, number_of_tweets, p=weights)] + \
+        random_state.normal(0, site_spread, (number_of_tweets, 2))
+
+    noise = random_state.random_sample(number_of_tweets) < noise_share
+    points[noise] = np.array(AREA_ORIGIN) + random_state.randint(0, AREA_SIZE, (int(noise.sum()), 2))
+    points = np.round(points).astype("int64")
+
+    return [["%d_%d" % (user_id, i), user_id, [int(point[0]), int(point[1])]] for i, point in enumerate(points)]
+
+
+def synthetic_users(number_of_users,
+                    seed=0,
+                    max_tweets=30000,
+                    exponent=TWEET_COUNT_EXPONENT):
+    """
+    Dictionary of synthetic users, in the format of create_dictionary_for_chunk.
+
+    :param number_of_users: Number of users.
+    :param seed:            Seed of the random numbers.
+    :param max_tweets:      Largest number of tweets of a user.
+    :param exponent:        Exponent of the power law of tweet counts.
+    :return:                Dictionary of {user_id: tweets}
+
+    :type number_of_users   int
+    :type seed              int
+    :type max_tweets        int
+    :type exponent          float
+    :rtype                  dict[int, list[list]]
+    """
+
+    random_state = np.random.RandomState(seed)
+    counts = tweet_counts(number_of_users, random_state, exponent=exponent, max_tweets=max_tweets)
+
+    return dict((user_id, user_tweets(user_id, int(count), random_state)) for user_id, count in enumerate(counts))
@@ -0,0 +1,425 @@
+"""
+Description:    Reusable runner for per-chunk aggregations. A pipeline template with CHUNK_ID placeholders is run
+                for every chunk by a bounded number of workers. Each worker process keeps one pooled MongoClient per
+                host for all of its chunks, instead of a new client per chunk, and the partial results are combined
+                with a pairwise tree merge instead of a serial DataFrame.add loop over 1000 results.
+                Partial results can be cached in a local folder, keyed by the pipeline, the chunk and the version
+                stamp of the chunk (see chunk_versions), so reruns only query chunks that were written since.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import functools
+import os
+import pickle
+from datetime import datetime
+from glob import glob
+from hashlib import sha1
+from json import dumps
+
+import numpy as np
+import pymongo
+from joblib import Parallel, delayed, cpu_count
+
+from ons_twitter.chunk_versions import chunk_stamps
+from ons_twitter.supporting_functions import create_folder
+
+# placeholder in pipeline templates, replaced by the chunk_id of each query
+CHUNK_ID = "$$chunk_id$$"
+
+# one client per host and worker process, see pooled_client
+_CLIENTS = {}
+
+
+def pooled_client(host,
+                  max_pool_size=10):
+    """
+    MongoClient of host shared by all queries of this process. Pymongo clients hold a connection pool, so reusing
+    one avoids a new handshake for every chunk.
+
+    :param host:            Mongodb host, eg: 192.168.0.99:30000
+    :param max_pool_size:   Maximum number of connections in the pool.
+    :return:                Client of host.
+
+    :type host              str
+    :type max_pool_size     int
+    :rtype                  pymongo.MongoClient
+    """
+
+    key = (host, max_pool_size)
+    if key not in _CLIENTS:
+        _CLIENTS[key] = pymongo.MongoClient(host, maxPoolSize=max_pool_size)
+
+    return _CLIENTS[key]
+
+
+def fill_pipeline(pipeline,
+                  chunk_id):
+    """
+    Copy of a pipeline template with every CHUNK_ID placeholder replaced by chunk_id.
+
+    Example:
+        fill_pipeline([{"$match": {"chunk_id": CHUNK_ID}}], 12) -> [{"$match": {"chunk_id": 12}}]
+
+    :param pipeline:    Aggregation pipeline template.
+    :param chunk_id:    Chunk to query.
+    :return:            Aggregation pipeline of chunk.
+
+    :type pipeline      list[dict]
+    :type chunk_id      int
+    :rtype              list[dict]
+    """
+
+    if isinstance(pipeline, dict):
+        return dict((key, fill_pipeline(value, chunk_id)) for key, value in pipeline.items())
+    elif isinstance(pipeline, list):
+        return [fill_pipeline(value, chunk_id) for value in pipeline]
+    elif isinstance(pipeline, str) and pipeline == CHUNK_ID:
+        return chunk_id
+    else:
+        return pipeline
+
+
+def _hashable(value):
+    # group keys of compound _ids are documents, use them as tuples
+    if isinstance(value, dict):
+        return tuple(_hashable(x) for x in value.values())
+    elif isinstance(value, list):
+        return tuple(_hashable(x) for x in value)
+    return value
+
+
+class CountPartial(object):
+    """
+    Default partial result: dictionary of {_id: value_field} of the aggregation output.
+    Compound _ids become tuples in the order of the group key.
+
+    :param value_field:     Field of the output documents to count, eg: count
+    """
+
+    def __init__(self, value_field="count"):
+        self.value_field = value_field
+
+    def __call__(self, documents, chunk_id):
+        counts = {}
+        for document in documents:
+            key = _hashable(document["_id"])
+            counts[key] = counts.get(key, 0) + document.get(self.value_field, 0)
+        return counts
+
+
+class ArrayPartial(object):
+    """
+    Partial result in a preallocated array of fixed shape, for integer keys with a known range such as
+    cluster sizes or hours of the day. Output documents with an index outside of the array are ignored.
+
+    :param size:            Length of the array.
+    :param index_field:     Field of the output documents with the position in the array.
+    :param value_field:     Field of the output documents added to that position.
+    :param dtype:           Data type of the array.
+    """
+
+    def __init__(self,
+                 size,
+                 index_field="_id",
+                 value_field="count",
+                 dtype="int64"):
+        self.size = size
+        self.index_field = index_field
+        self.value_field = value_field
+        self.dtype = dtype
+
+    def __call__(self, documents, chunk_id):
+        indices = []
+        values = []
+        for document in documents:
+            indices.append(document[self.index_field])
+            values.append(document.get(self.value_field, 0))
+
+        array = np.zeros(self.size, dtype=self.dtype)
+        indices = np.array(indices, dtype="int64")
+        keep = (indices >= 0) & (indices < self.size)
+        np.add.at(array, indices[keep], np.array(values, dtype=self.dtype)[keep])
+
+        return array
+
+
+def add_partials(partial,
+                 other_partial):
+    """
+    Default merge of two partial results: numpy arrays are added elementwise, dictionaries key by key and
+    pandas objects with add(fill_value=0). The first argument may be changed in place.
+
+    :return:    Sum of the partial results.
+    """
+
+    if partial is None:
+        return other_partial
+    if other_partial is None:
+        return partial
+
+    if isinstance(partial, np.ndarray):
+        partial += other_partial
+        return partial
+    elif isinstance(partial, dict):
+        # add the smaller dictionary into the larger one
+        if len(partial) < len(other_partial):
+            partial, other_partial = other_partial, partial
+        for key, value in other_partial.items():
+            partial[key] = partial.get(key, 0) + value
+        return partial
+    else:
+        return partial.add(other_partial, fill_value=0)
+
+
+def tree_merge(partials,
+               merge_function=add_partials):
+    """
+    Combine partial results pairwise: (1 + 2), (3 + 4)... and then the sums of these, until one is left.
+    Every result takes part in log2(n) merges, instead of the growing total taking part in all n as in a
+    serial loop.
+
+    :param partials:        Partial results.
+    :param merge_function:  Function of two partial results returning their combination.
+    :return:                Combined result, None if there are no partials.
+
+    :type partials          list
+    :type merge_function    function
+    """
+
+    partials = list(partials)
+    if len(partials) == 0:
+        return None
+
+    while len(partials) > 1:
+        merged = [merge_function(partials[i], partials[i + 1]) for i in range(0, len(partials) - 1, 2)]
+        if len(partials) % 2 == 1:
+            merged.append(partials[-1])
+        partials = merged
+
+    return partials[0]
+
+
+def _code_description(code):
+    # bytecode, constants and names of a function, nested functions included
+    return [sha1(code.co_code).hexdigest(),
+            [_code_description(x) if hasattr(x, "co_code") else repr(x) for x in code.co_consts],
+            list(code.co_names)]
+
+
+def _function_description(function):
+    """
+    Description of a partial function that changes whenever its results could change: the class and parameters
+    of callable objects, the code, default arguments and closure of plain functions and lambdas, and the
+    function and arguments of functools.partial objects.
+
+    :rtype      list
+    """
+
+    if isinstance(function, functools.partial):
+        return ["partial",
+                _function_description(function.func),
+                [_function_description(x) if callable(x) else x for x in function.args],
+                dict((key, _function_description(x) if callable(x) else x) for key, x in function.keywords.items())]
+    elif hasattr(function, "__code__"):
+        closure = function.__closure__ or ()
+        return [function.__module__,
+                function.__qualname__,
+                _code_description(function.__code__),
+                list(function.__defaults__ or ()),
+                function.__kwdefaults__,
+                [cell.cell_contents for cell in closure]]
+    else:
+        return [type(function).__module__,
+                type(function).__qualname__,
+                getattr(function, "__dict__", {})]
+
+
+def cache_key(mongo_connection,
+              pipeline,
+              partial_function):
+    """
+    Hash of everything a cached partial result depends on apart from the chunk: the collection, the pipeline
+    template and the partial function with its parameters, see _function_description.
+
+    :return:    Hexadecimal sha1 hash.
+    :rtype      str
+    """
+
+    description = dumps([list(mongo_connection),
+                         pipeline,
+                         _function_description(partial_function)],
+                        sort_keys=True,
+                        default=str)
+
+    return sha1(description.encode("utf-8")).hexdigest()
+
+
+def _cache_file(cache_folder,
+                chunk_id,
+                stamp):
+    return os.path.join(cache_folder, "%04d_%s.pkl" % (chunk_id, stamp))
+
+
+def load_cached(cache_folder,
+                chunk_id,
+                stamp):
+    """
+    Cached partial result of a chunk at a version stamp.
+
+    :return:    Tuple of (True, partial result) if cached, (False, None) otherwise.
+    :rtype      tuple
+    """
+
+    file_name = _cache_file(cache_folder, chunk_id, stamp)
+    if not os.path.exists(file_name):
+        return False, None
+
+    with open(file_name, 'rb') as in_file:
+        return True, pickle.load(in_file)
+
+
+def save_cached(cache_folder,
+                chunk_id,
+                stamp,
+                partial):
+    """
+    Cache the partial result of a chunk and remove the results of its older versions.
+    """
+
+    file_name = _cache_file(cache_folder, chunk_id, stamp)
+
+    # write to temporary file first, so readers never see half a file
+    temporary_file = os.path.join(cache_folder, "." + os.path.basename(file_name) + ".tmp")
+    with open(temporary_file, 'wb') as out_file:
+        pickle.dump(partial, out_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_file, file_name)
+
+    for old_file in glob(os.path.join(cache_folder, "%04d_*.pkl" % chunk_id)):
+        if old_file != file_name:
+            os.remove(old_file)
+
+
+def aggregate_chunks(mongo_connection,
+                     pipeline,
+                     chunk_ids,
+                     partial_function=None,
+                     max_pool_size=10,
+                     cache_folder=None,
+                     stamps=None):
+    """
+    Run the pipeline template for a list of chunks with one pooled client. For parameters see run_aggregation.
+
+    :param cache_folder:    If given then partial results are saved here.
+    :param stamps:          Dictionary of {chunk_id: version stamp} the results are saved with.
+    :return:                List of (chunk_id, partial result) in the order of chunk_ids.
+    :rtype                  list[tuple]
+    """
+
+    if partial_function is None:
+        partial_function = CountPartial()
+
+    collection = pooled_client(mongo_connection[0],
+                               max_pool_size=max_pool_size)[mongo_connection[1]][mongo_connection[2]]
+
+    results = []
+    for chunk_id in chunk_ids:
+        documents = collection.aggregate(fill_pipeline(pipeline, chunk_id), allowDiskUse=True)
+        partial = partial_function(documents, chunk_id)
+        if cache_folder is not None:
+            save_cached(cache_folder, chunk_id, stamps[chunk_id], partial)
+        results.append((chunk_id, partial))
+
+    return results
+
+
+def run_aggregation(mongo_connection,
+                    pipeline,
+                    chunk_range=range(1000),
+                    partial_function=None,
+                    merge_function=add_partials,
+                    n_jobs=-1,
+                    max_pool_size=10,
+                    cache_folder=None):
+    """
+    Run an aggregation pipeline template for every chunk and combine the partial results.
+    Chunks are split between at most n_jobs workers, every worker uses one pooled client for all its chunks.
+
+    If cache_folder is given, then the partial result of every chunk is saved there with the chunk's current
+    version stamp. Later runs of the same pipeline reuse it until a write bumps the stamp of the chunk, and
+    only query the chunks without a cached result.
+
+    Example:
+        run_aggregation(twitter_data,
+                        [{"$match": {"chunk_id": CHUNK_ID, "cluster.type": "cluster"}},
+                         {"$group": {"_id": "$cluster.cluster_id", "size": {"$first": "$cluster.count"}}},
+                         {"$group": {"_id": "$size", "count": {"$sum": 1}}}],
+                        cache_folder="data/cache/")
+
+    :param mongo_connection:    Mongodb parameters to the tweets. [ip, database, collection]
+    :param pipeline:            Aggregation pipeline template with CHUNK_ID placeholders.
+    :param chunk_range:         Chunks to query.
+    :param partial_function:    Function of (aggregation output, chunk_id) returning a partial result.
+                                CountPartial() if None, see also ArrayPartial.
+    :param merge_function:      Function of two partial results returning their combination.
+    :param n_jobs:              Maximum number of chunks queried at the same time, -1 for all cores.
+    :param max_pool_size:       Maximum number of connections of each worker's client.
+    :param cache_folder:        Optional local folder of cached partial results.
+    :return:                    Combined result of all chunks.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type pipeline              list[dict]
+    :type chunk_range           range | list[int]
+    :type partial_function      None | function
+    :type merge_function        function
+    :type n_jobs                int
+    :type max_pool_size         int
+    :type cache_folder          None | str
+    """
+
+    assert n_jobs != 0, "n_jobs must be positive or -1!"
+
+    start_time = datetime.now()
+    chunk_ids = list(chunk_range)
+    if partial_function is None:
+        partial_function = CountPartial()
+
+    # reuse cached results of unchanged chunks
+    partials = {}
+    stamps = None
+    if cache_folder is not None:
+        cache_folder = os.path.join(cache_folder, cache_key(mongo_connection, pipeline, partial_function))
+        create_folder(cache_folder)
+        stamps = chunk_stamps(pooled_client(mongo_connection[0],
+                                            max_pool_size=max_pool_size)[mongo_connection[1]][mongo_connection[2]],
+                              chunk_ids)
+        for chunk_id in set(chunk_ids):
+            is_cached, partial = load_cached(cache_folder, chunk_id, stamps[chunk_id])
+            if is_cached:
+                partials[chunk_id] = partial
+
+    query_ids = sorted(set(chunk_ids) - set(partials.keys()))
+
+    # one group of chunks per worker
+    number_of_workers = cpu_count() if n_jobs < 0 else n_jobs
+    number_of_workers = max(min(number_of_workers, len(query_ids)), 1)
+    chunk_groups = [query_ids[i::number_of_workers] for i in range(number_of_workers)]
+
+    worker_results = Parallel(n_jobs=number_of_workers)(delayed(aggregate_chunks)(mongo_connection,
+                                                                                  pipeline,
+                                                                                  chunk_group,
+                                                                                  partial_function,
+                                                                                  max_pool_size,
+                                                                                  cache_folder,
+                                                                                  stamps)
+                                                        for chunk_group in chunk_groups if len(chunk_group) > 0)
+
+    # back to the order of chunk_range
+    partials.update(result for one_worker in worker_results for result in one_worker)
+    combined = tree_merge([partials[chunk_id] for chunk_id in chunk_ids], merge_function=merge_function)
+
+    print("Aggregation finished for %d chunks (%d from cache) in %s" % (len(chunk_ids),
+                                                                       len(chunk_ids) - len(query_ids),
+                                                                       datetime.now() - start_time))
+
+    return combined
@@ -0,0 +1,415 @@
+"""
+Description:    Single pass analytics over the clustered tweets. Every metric is an accumulator: it names the fields
+                it needs, takes tweets one by one, and can be merged with the partial results of other workers.
+                run_analytics reads each chunk once with the combined projection of all accumulators and feeds
+                every tweet to each of them, instead of one aggregation per metric and chunk as in in_development.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+from copy import deepcopy
+from datetime import datetime
+
+import pymongo
+from joblib import Parallel, delayed, cpu_count
+
+
+def get_field(document, field):
+    """
+    Value of a dotted field in a nested dictionary, None if missing. Numbers index into lists,
+    eg: tweet.coordinates.0
+
+    :param document:    Mongodb document.
+    :param field:       Dotted field name, eg: cluster.address.levels.oslaua
+    :return:            Value of field.
+
+    :type document      dict
+    :type field         str
+    """
+
+    for key in field.split("."):
+        if isinstance(document, dict):
+            document = document.get(key)
+        elif isinstance(document, (list, tuple)) and key.isdigit() and int(key) < len(document):
+            document = document[int(key)]
+        else:
+            return None
+    return document
+
+
+def _add_counts(counts, other_counts):
+    for key, value in other_counts.items():
+        counts[key] = counts.get(key, 0) + value
+
+
+class Accumulator(object):
+    """
+    Base class of metrics. Subclasses set name and fields and implement add, merge and result.
+    end_chunk is called after the last tweet of each chunk, so per-chunk state can be folded and freed.
+    """
+
+    name = None
+    fields = ()
+
+    def add(self, tweet):
+        raise NotImplementedError
+
+    def end_chunk(self):
+        pass
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class DailyVolumes(Accumulator):
+    """
+    Number of tweets by date, as in in_development/daily_volumes.py.
+    """
+
+    name = "daily_volumes"
+    fields = ("time.date",)
+
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, tweet):
+        date = get_field(tweet, "time.date")
+        self.counts[date] = self.counts.get(date, 0) + 1
+
+    def merge(self, other):
+        _add_counts(self.counts, other.counts)
+
+    def result(self):
+        return self.counts
+
+
+class ClusterSizes(Accumulator):
+    """
+    Number of clusters by size, as in in_development/cluster_sizes.py.
+
+    :param dominant_only:   If true then only dominant clusters are counted, as in summary_stats_2.py.
+    """
+
+    name = "cluster_sizes"
+    fields = ("cluster.cluster_id", "cluster.type", "cluster.count", "cluster.dominant")
+
+    def __init__(self, dominant_only=False):
+        self.dominant_only = dominant_only
+        if dominant_only:
+            self.name = "dominant_sizes"
+        self.counts = {}
+        self._seen = set()
+
+    def add(self, tweet):
+        cluster = tweet.get("cluster")
+        if cluster is None or cluster.get("type") != "cluster" or cluster["cluster_id"] in self._seen:
+            return
+        if self.dominant_only and cluster.get("dominant") != 1:
+            return
+        self._seen.add(cluster["cluster_id"])
+        self.counts[cluster["count"]] = self.counts.get(cluster["count"], 0) + 1
+
+    def end_chunk(self):
+        # clusters never span chunks
+        self._seen = set()
+
+    def merge(self, other):
+        _add_counts(self.counts, other.counts)
+
+    def result(self):
+        return self.counts
+
+
+class AddressTypes(Accumulator):
+    """
+    Number of clusters by address classification, as in in_development/summary_stats.py.
+    """
+
+    name = "address_types"
+    fields = ("cluster.cluster_id", "cluster.type", "cluster.address.classification.abbreviated")
+
+    def __init__(self):
+        self.counts = {}
+        self._seen = set()
+
+    def add(self, tweet):
+        cluster = tweet.get("cluster")
+        if cluster is None or cluster.get("type") != "cluster" or cluster["cluster_id"] in self._seen:
+            return
+        self._seen.add(cluster["cluster_id"])
+        address_class = get_field(cluster, "address.classification.abbreviated")
+        if address_class is None:
+            address_class = "NoAddress"
+        self.counts[address_class] = self.counts.get(address_class, 0) + 1
+
+    def end_chunk(self):
+        self._seen = set()
+
+    def merge(self, other):
+        _add_counts(self.counts, other.counts)
+
+    def result(self):
+        return self.counts
+
+
+class LanguagesByLA(Accumulator):
+    """
+    Number of users with a dominant cluster by local authority and the set of languages they used,
+    as in in_development/languages.py. Languages are sorted and joined by "_".
+    """
+
+    name = "languages_by_la"
+    fields = ("cluster.cluster_id", "cluster.dominant", "cluster.address.levels.oslaua", "tweet.language")
+
+    def __init__(self):
+        self.counts = {}
+        self._clusters = {}
+
+    def add(self, tweet):
+        cluster = tweet.get("cluster")
+        if cluster is None or cluster.get("dominant") != 1:
+            return
+        if cluster["cluster_id"] not in self._clusters:
+            self._clusters[cluster["cluster_id"]] = (get_field(cluster, "address.levels.oslaua"), set())
+        self._clusters[cluster["cluster_id"]][1].add(get_field(tweet, "tweet.language"))
+
+    def end_chunk(self):
+        for oslaua, languages in self._clusters.values():
+            key = (oslaua, "_".join(sorted(str(language) for language in languages)))
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self._clusters = {}
+
+    def merge(self, other):
+        _add_counts(self.counts, other.counts)
+
+    def result(self):
+        return self.counts
+
+
+class ResidentialMonths(Accumulator):
+    """
+    Number of users by the number of months they tweeted from a residential cluster, as in
+    in_development/summary_stats_2.py. A month counts if the user has at least min_tweets in that cluster.
+
+    :param min_tweets:  Minimum number of tweets in a cluster in a month.
+    """
+
+    name = "residential_months"
+    fields = ("user_id", "cluster.cluster_id", "cluster.type", "cluster.address.classification.abbreviated",
+              "time.month")
+
+    def __init__(self, min_tweets=3):
+        self.min_tweets = min_tweets
+        self.counts = {}
+        self._tweets = {}
+
+    def add(self, tweet):
+        cluster = tweet.get("cluster")
+        if cluster is None or cluster.get("type") != "cluster" or \
+                get_field(cluster, "address.classification.abbreviated") != "R":
+            return
+        key = (tweet["user_id"], cluster["cluster_id"], get_field(tweet, "time.month"))
+        self._tweets[key] = self._tweets.get(key, 0) + 1
+
+    def end_chunk(self):
+        months = {}
+        for (user_id, cluster_id, month), count in self._tweets.items():
+            if count >= self.min_tweets:
+                months.setdefault(user_id, set()).add(month)
+        for user_months in months.values():
+            self.counts[len(user_months)] = self.counts.get(len(user_months), 0) + 1
+        self._tweets = {}
+
+    def merge(self, other):
+        _add_counts(self.counts, other.counts)
+
+    def result(self):
+        return self.counts
+
+
+def combined_projection(accumulators,
+                        normalised=False):
+    """
+    Projection with the fields of all accumulators. Fields of a parent are not repeated.
+
+    :param accumulators:    List of accumulators.
+    :param normalised:      If true then cluster fields are replaced with cluster_id, as clusters are joined
+                            from the clusters collection.
+    :return:                Projection for find.
+
+    :type accumulators      list[Accumulator]
+    :type normalised        bool
+    :rtype                  dict[str, int]
+    """
+
+    fields = set(["user_id"])
+    for accumulator in accumulators:
+        for field in accumulator.fields:
+            if normalised and field.startswith("cluster."):
+                field = "cluster_id"
+            fields.add(field)
+
+    # mongodb rejects a field together with its parent
+    fields = [field for field in fields if not any(field.startswith(other + ".") for other in fields)]
+
+    return dict((field, 1) for field in sorted(fields))
+
+
+def chunk_clusters(clusters_collection,
+                   chunk_id):
+    """
+    Clusters of one chunk from the normalised clusters collection, in the form they are embedded in tweets.
+
+    :param clusters_collection: Pymongo collection of clusters.
+    :param chunk_id:            Chunk number.
+    :return:                    Dictionary of {cluster_id: cluster}
+
+    :type clusters_collection   pymongo.collection.Collection
+    :type chunk_id              int
+    :rtype                      dict[str, dict]
+    """
+
+    clusters = dict((cluster["_id"], cluster) for cluster in clusters_collection.find({"chunk_id": chunk_id}))
+    for cluster_id, cluster in clusters.items():
+        cluster["cluster_id"] = cluster_id
+
+    return clusters
+
+
+def feed_chunk(accumulators,
+               tweets,
+               clusters=None):
+    """
+    Feed the tweets of one chunk to every accumulator.
+
+    :param accumulators:    List of accumulators.
+    :param tweets:          Iterable of tweets of one chunk.
+    :param clusters:        Dictionary of {cluster_id: cluster document} to attach to tweets as "cluster",
+                            if clusters were written in normalised form.
+    :return:                Number of tweets.
+
+    :type accumulators      list[Accumulator]
+    :type tweets            pymongo.cursor.Cursor | list[dict]
+    :type clusters          None | dict[str, dict]
+    :rtype                  int
+    """
+
+    number_of_tweets = 0
+    for tweet in tweets:
+        if clusters is not None and "cluster_id" in tweet:
+            tweet["cluster"] = clusters.get(tweet["cluster_id"])
+        for accumulator in accumulators:
+            accumulator.add(tweet)
+        number_of_tweets += 1
+
+    for accumulator in accumulators:
+        accumulator.end_chunk()
+
+    return number_of_tweets
+
+
+def _analyse_chunks(mongo_connection,
+                    accumulators,
+                    chunk_ids,
+                    clusters_connection=None):
+    """
+    Run fresh copies of the accumulators over a list of chunks. For parameters see run_analytics.
+
+    :return:    Accumulators with the partial results of the chunks.
+    :rtype      list[Accumulator]
+    """
+
+    accumulators = deepcopy(accumulators)
+    projection = combined_projection(accumulators, normalised=clusters_connection is not None)
+
+    tweets = pymongo.MongoClient(mongo_connection[0])[mongo_connection[1]][mongo_connection[2]]
+    if clusters_connection is not None:
+        clusters_collection = pymongo.MongoClient(clusters_connection[0])[clusters_connection[1]][
+            clusters_connection[2]]
+
+    for chunk_id in chunk_ids:
+        start_time = datetime.now()
+
+        clusters = None
+        if clusters_connection is not None:
+            clusters = chunk_clusters(clusters_collection, chunk_id)
+
+        number_of_tweets = feed_chunk(accumulators,
+                                      tweets.find({"chunk_id": chunk_id}, projection),
+                                      clusters=clusters)
+
+        print("Analysed chunk %04d: %8d tweets in %s" % (chunk_id, number_of_tweets, datetime.now() - start_time))
+
+    return accumulators
+
+
+def merge_accumulators(partials):
+    """
+    Merge the partial accumulators of all workers.
+
+    :param partials:    List of lists of accumulators, one list per worker in the same order.
+    :return:            Merged accumulators.
+
+    :type partials      list[list[Accumulator]]
+    :rtype              list[Accumulator]
+    """
+
+    merged = partials[0]
+    for worker_accumulators in partials[1:]:
+        for accumulator, other in zip(merged, worker_accumulators):
+            accumulator.merge(other)
+
+    return merged
+
+
+def run_analytics(mongo_connection,
+                  accumulators,
+                  chunk_range=range(1000),
+                  clusters_connection=None,
+                  n_jobs=-1):
+    """
+    Compute all metrics in one pass over the tweets. Chunks are split between the workers, every worker reads
+    its chunks once and the partial results are merged at the end.
+
+    Example:
+        run_analytics(twitter_data, [DailyVolumes(), ClusterSizes(), AddressTypes()])
+
+    :param mongo_connection:    Mongodb parameters to the clustered tweets. [ip, database, collection]
+    :param accumulators:        List of accumulators. These are copied for every worker.
+    :param chunk_range:         Chunks to analyse.
+    :param clusters_connection: Mongodb parameters to the clusters collection if clusters were written in
+                                normalised form, see cluster_all.
+    :param n_jobs:              Number of workers, -1 for all cores.
+    :return:                    Dictionary of {accumulator name: result}
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type accumulators          list[Accumulator]
+    :type chunk_range           range | list[int]
+    :type clusters_connection   None | list[str] | tuple[str]
+    :type n_jobs                int
+    :rtype                      dict
+    """
+
+    names = [accumulator.name for accumulator in accumulators]
+    assert len(set(names)) == len(names), "Accumulator names must be unique!"
+
+    start_time = datetime.now()
+    chunk_ids = list(chunk_range)
+
+    # one group of chunks per worker
+    number_of_workers = cpu_count() if n_jobs < 0 else n_jobs
+    number_of_workers = max(min(number_of_workers, len(chunk_ids)), 1)
+    chunk_groups = [chunk_ids[i::number_of_workers] for i in range(number_of_workers)]
+
+    partials = Parallel(n_jobs=n_jobs)(delayed(_analyse_chunks)(mongo_connection,
+                                                                accumulators,
+                                                                chunk_group,
+                                                                clusters_connection) for chunk_group in chunk_groups)
+
+    merged = merge_accumulators(partials)
+    print("\nAnalytics finished for %d chunks in %s" % (len(chunk_ids), datetime.now() - start_time))
+
+    return dict((accumulator.name, accumulator.result()) for accumulator in merged)
@@ -0,0 +1,87 @@
+"""
+Description:    Version stamps of the chunks of a tweets collection, kept next to it in <collection>_versions.
+                Every step that writes tweets of a chunk (import, clustering, robot removal and dominant flagging)
+                gives the chunk a new stamp, so cached results of the chunk (see aggregation.run_aggregation) are
+                only reused while the chunk is unchanged.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+from datetime import datetime
+
+import pymongo
+from bson import ObjectId
+
+# stamp of chunks that were never written since version stamps were introduced
+INITIAL_STAMP = "initial"
+
+
+def versions_collection(collection):
+    """
+    Collection of version stamps of a tweets collection, with acknowledged writes.
+
+    :param collection:  Pymongo collection of tweets.
+    :return:            Pymongo collection of its version stamps.
+
+    :type collection    pymongo.collection.Collection
+    :rtype              pymongo.collection.Collection
+    """
+
+    return collection.database.get_collection(collection.name + "_versions",
+                                              write_concern=pymongo.WriteConcern(w=1))
+
+
+def bump_versions(collection,
+                  chunk_ids,
+                  reason):
+    """
+    Give the chunks new version stamps after their tweets were written. Stamps are new ObjectIds, so they never
+    repeat, even if the versions collection is dropped. The writes must have been acknowledged (w >= 1) before
+    this is called, otherwise results of the old data could be cached under the new stamp.
+
+    :param collection:  Pymongo collection of tweets that was written.
+    :param chunk_ids:   Chunks that were written.
+    :param reason:      Step that wrote the chunks, eg: import
+    :return:            Number of chunks bumped.
+
+    :type collection    pymongo.collection.Collection
+    :type chunk_ids     list[int] | set[int]
+    :type reason        str
+    :rtype              int
+    """
+
+    chunk_ids = sorted(set(int(chunk_id) for chunk_id in chunk_ids))
+    if len(chunk_ids) == 0:
+        return 0
+
+    now = datetime.now()
+    versions_collection(collection).bulk_write([pymongo.UpdateOne({"_id": chunk_id},
+                                                                   {"$set": {"stamp": str(ObjectId()),
+                                                                             "reason": reason,
+                                                                             "updated": now},
+                                                                    "$inc": {"version": 1}},
+                                                                   upsert=True) for chunk_id in chunk_ids],
+                                               ordered=False)
+
+    return len(chunk_ids)
+
+
+def chunk_stamps(collection,
+                 chunk_ids):
+    """
+    Current version stamps of chunks.
+
+    :param collection:  Pymongo collection of tweets.
+    :param chunk_ids:   Chunks to look up.
+    :return:            Dictionary of {chunk_id: stamp}, INITIAL_STAMP for chunks never bumped.
+
+    :type collection    pymongo.collection.Collection
+    :type chunk_ids     list[int]
+    :rtype              dict[int, str]
+    """
+
+    stamps = dict((chunk_id, INITIAL_STAMP) for chunk_id in chunk_ids)
+    for document in versions_collection(collection).find({"_id": {"$in": list(stamps.keys())}}, {"stamp": 1}):
+        stamps[document["_id"]] = document["stamp"]
+
+    return stamps
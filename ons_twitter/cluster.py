@@ -6,91 +6,294 @@ Python version: 3.4
 """
 
 from datetime import datetime
+from functools import partial
+from math import ceil
 import time
 import csv
+import os
 
 import numpy as np
 from bson.son import SON
-from pymongo.errors import OperationFailure, ConnectionFailure, AutoReconnect
+from pymongo.errors import OperationFailure, ConnectionFailure, AutoReconnect, PyMongoError
 import pymongo
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, cpu_count
 
 from ons_twitter.supporting_functions import distance as simple_distance
+from ons_twitter import run_ledger
+from ons_twitter.chunk_versions import bump_versions
+from ons_twitter.metrics import Instrumented, Metrics, add_time, count, split_results, timer, write_report
+
+# scipy is optional, only needed for the kdtree neighbour search
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# approximate number of bytes used while clustering, see estimate_cluster_memory. Pairs and matrix elements are
+# the numpy arrays that are alive at the same time:
+# - an element of a distance matrix strip: two complex meshgrid copies, their complex difference, its float
+#   absolute value, the int32 distance and the < eps mask (_euclidean_distances_matrix, _dense_neighbour_pairs)
+# - a grid candidate pair: 7 int64 index arrays and 3 masks of _grid_neighbour_pairs, plus the same arrays as
+#   a matrix element in _close_pairs
+# - a neighbour pair: the pairs and their blocks before concatenation, their roots, the filtered pairs and the
+#   hooked maximum and minimum of label_clusters, 8 int64 arrays
+# - a tweet: tracemalloc peak of cluster_one_user for users of 2000 to 30000 tweets that are all noise (one update
+#   tuple and one cluster document per tweet, the worst case), less the pair memory above: 880-930 bytes
+MATRIX_ELEMENT_BYTES = 3 * np.dtype("complex128").itemsize + np.dtype("float64").itemsize + \
+    np.dtype("int32").itemsize + np.dtype("bool").itemsize
+CANDIDATE_PAIR_BYTES = 7 * np.dtype("int64").itemsize + 3 * np.dtype("bool").itemsize + MATRIX_ELEMENT_BYTES
+NEIGHBOUR_PAIR_BYTES = 8 * np.dtype("int64").itemsize
+TWEET_BYTES = 950
+
+# maximum number of _ids in one multi-document update, see write_cluster_updates
+UPDATE_BATCH_SIZE = 10000
+
+# number of $near queries sent to the address base at the same time, see resolve_cluster_addresses
+ADDRESS_LOOKUP_THREADS = 8
 
 
 def create_dictionary_for_chunk(mongo_connection,
-                                chunk_id):
+                                chunk_id,
+                                user_ids=None):
     """
     For a given mongodb parameter tuple and a chunk_id returns all the tweets in that chunk as a dictionary.
     User_id: [tweets]
 
     :param mongo_connection:    List of mongodb connection parameters to twitter database. [ip, database, collection]
     :param chunk_id:            Number of chunk to process. 0-999
+    :param user_ids:            Optional list of user ids, only tweets of these users are returned.
     :return:                    Dictionary with {user_id: [tweets]}
 
     :type mongo_connection      list[string] | tuple[string]
     :type chunk_id              int
+    :type user_ids              list[int] | None
     :rtype                      dict[int, list[]]
     """
 
     # initiate dictionary
     tweets_by_user = {}
 
+    # set up query
+    query = {"chunk_id": chunk_id}
+    if user_ids is not None:
+        query["user_id"] = {"$in": list(user_ids)}
+
+    # very crude retry-on-error system, first go and 5 retries
+    for retry in range(6):
+        if retry > 0:
+            print("Retry connection to: ", mongo_connection)
+            time.sleep(5)
+
+        try:
+            # collect cursor
+            mongo_client = pymongo.MongoClient(mongo_connection[0], w=0)[mongo_connection[1]][mongo_connection[2]]
+            cursor = mongo_client.find(query, {"_id": 1, "user_id": 1, "tweet.coordinates": 1})
+
+            # initiate dictionary
+            tweets_by_user = {}
+            for new_tweet_mongo in cursor:
+                new_tweet = [new_tweet_mongo["_id"],
+                             new_tweet_mongo["user_id"],
+                             new_tweet_mongo["tweet"]["coordinates"]]
+
+                # insert into dictionary
+                try:
+                    tweets_by_user[new_tweet_mongo["user_id"]].append(new_tweet)
+                except KeyError:
+                    tweets_by_user[new_tweet_mongo["user_id"]] = [new_tweet]
+            print("Chunk collected: ", chunk_id, datetime.now())
+            break
+        except OperationFailure:
+            continue
+
+    return tweets_by_user
+
+
+class UserTweets(object):
     """
-    The below is a very crude implementation of a retry-on-error system.
+    Tweets of one user as numpy arrays. Slice of a ChunkArrays object.
+    Indexing returns the tweet as an [_id, user_id, coordinates] list, like create_dictionary_for_chunk.
     """
 
-    try:
-        # set up query
-        mongo_client = pymongo.MongoClient(mongo_connection[0], w=0)[mongo_connection[1]][mongo_connection[2]]
-        query = {"chunk_id": chunk_id}
+    def __init__(self, user_id, ids, coordinates):
+        """
+        :param user_id:         Twitter user_id.
+        :param ids:             numpy object array of tweet _ids.
+        :param coordinates:     numpy int32 array of easting, northing coordinates, one row per tweet.
 
-        # collect cursor
-        cursor = mongo_client.find(query, {"_id": 1, "user_id": 1, "tweet.coordinates": 1})
+        :type user_id           int
+        :type ids               numpy.ndarray
+        :type coordinates       numpy.ndarray
+        :rtype                  UserTweets
+        """
 
-        # initiate dictionary
-        tweets_by_user = {}
-        for new_tweet_mongo in cursor:
-            new_tweet = [new_tweet_mongo["_id"],
-                         new_tweet_mongo["user_id"],
-                         new_tweet_mongo["tweet"]["coordinates"]]
+        self.user_id = user_id
+        self.ids = ids
+        self.coordinates = coordinates
 
-            # insert into dictionary
-            try:
-                tweets_by_user[new_tweet_mongo["user_id"]].append(new_tweet)
-            except KeyError:
-                tweets_by_user[new_tweet_mongo["user_id"]] = [new_tweet]
-        print("Chunk collected: ", chunk_id, datetime.now())
-    except OperationFailure:
-        for x in range(5):
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return [self.ids[index], self.user_id, self.coordinates[index].tolist()]
+
+    def __iter__(self):
+        for index in range(len(self.ids)):
+            yield self[index]
+
+
+class ChunkArrays(object):
+    """
+    Columnar copy of the tweets in one chunk, sorted by user_id. The tweets of users[i] are at positions
+    offsets[i]:offsets[i + 1] of ids, user_ids and coordinates. Indexing with a user_id returns a UserTweets slice,
+    so it can be used in place of the output of create_dictionary_for_chunk.
+    """
+
+    def __init__(self, ids, user_ids, coordinates):
+        """
+        :param ids:             numpy object array of tweet _ids.
+        :param user_ids:        numpy int64 array of user_ids.
+        :param coordinates:     numpy int32 array of easting, northing coordinates, one row per tweet.
+
+        :type ids               numpy.ndarray
+        :type user_ids          numpy.ndarray
+        :type coordinates       numpy.ndarray
+        :rtype                  ChunkArrays
+        """
+
+        # sort by user, keeping the original order of tweets within a user
+        order = np.argsort(user_ids, kind="mergesort")
+        self.ids = ids[order]
+        self.user_ids = user_ids[order]
+        self.coordinates = coordinates[order]
+
+        # start of each user
+        self.users, starts = np.unique(self.user_ids, return_index=True)
+        self.offsets = np.append(starts, len(self.user_ids))
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        position = np.searchsorted(self.users, user_id)
+        return position < len(self.users) and self.users[position] == user_id
+
+    def __getitem__(self, user_id):
+        position = np.searchsorted(self.users, user_id)
+        if position == len(self.users) or self.users[position] != user_id:
+            raise KeyError(user_id)
+
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return UserTweets(int(user_id), self.ids[start:end], self.coordinates[start:end])
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self.users.tolist()
+
+
+def fetch_chunk_arrays(mongo_connection,
+                       chunk_id,
+                       user_ids=None):
+    """
+    Columnar version of create_dictionary_for_chunk. Streams the tweets of a chunk into preallocated numpy arrays
+    instead of building python lists for each tweet.
+
+    :param mongo_connection:    List of mongodb connection parameters to twitter database. [ip, database, collection]
+    :param chunk_id:            Number of chunk to process. 0-999
+    :param user_ids:            Optional list of user ids, only tweets of these users are returned.
+    :return:                    ChunkArrays object, indexed by user_id.
+
+    :type mongo_connection      list[string] | tuple[string]
+    :type chunk_id              int
+    :type user_ids              list[int] | None
+    :rtype                      ChunkArrays
+    """
+
+    # set up query
+    query = {"chunk_id": chunk_id}
+    if user_ids is not None:
+        query["user_id"] = {"$in": list(user_ids)}
+
+    # very crude retry-on-error system, first go and 5 retries
+    for retry in range(6):
+        if retry > 0:
             print("Retry connection to: ", mongo_connection)
             time.sleep(5)
-            try:
-                # set up query
-                mongo_client = pymongo.MongoClient(mongo_connection[0], w=0)[mongo_connection[1]][mongo_connection[2]]
-                query = {"chunk_id": chunk_id}
-
-                # collect cursor
-                cursor = mongo_client.find(query, {"_id": 1, "user_id": 1, "tweet.coordinates": 1})
-
-                # initiate dictionary
-                tweets_by_user = {}
-                for new_tweet_mongo in cursor:
-                    new_tweet = [new_tweet_mongo["_id"],
-                                 new_tweet_mongo["user_id"],
-                                 new_tweet_mongo["tweet"]["coordinates"]]
-
-                    # insert into dictionary
-                    try:
-                        tweets_by_user[new_tweet_mongo["user_id"]].append(new_tweet)
-                    except KeyError:
-                        tweets_by_user[new_tweet_mongo["user_id"]] = [new_tweet]
-                print("Chunk collected: ", chunk_id, datetime.now())
-                break
-            except OperationFailure:
-                continue
 
-    return tweets_by_user
+        # start from empty arrays each time
+        number_of_tweets = 0
+        ids = np.empty(0, dtype=object)
+        tweet_user_ids = np.empty(0, dtype="int64")
+        coordinates = np.empty((0, 2), dtype="int32")
+
+        try:
+            mongo_client = pymongo.MongoClient(mongo_connection[0], w=0)[mongo_connection[1]][mongo_connection[2]]
+
+            # preallocate arrays, with some space for tweets inserted while reading
+            capacity = mongo_client.count_documents(query) + 1024
+            ids = np.empty(capacity, dtype=object)
+            tweet_user_ids = np.empty(capacity, dtype="int64")
+            coordinates = np.empty((capacity, 2), dtype="int32")
+
+            cursor = mongo_client.find(query, {"_id": 1, "user_id": 1, "tweet.coordinates": 1})
+            for new_tweet_mongo in cursor:
+                # double arrays if they are full
+                if number_of_tweets == capacity:
+                    ids = np.concatenate((ids, np.empty(capacity, dtype=object)))
+                    tweet_user_ids = np.concatenate((tweet_user_ids, np.empty(capacity, dtype="int64")))
+                    coordinates = np.concatenate((coordinates, np.empty((capacity, 2), dtype="int32")))
+                    capacity *= 2
+
+                ids[number_of_tweets] = new_tweet_mongo["_id"]
+                tweet_user_ids[number_of_tweets] = new_tweet_mongo["user_id"]
+                coordinates[number_of_tweets] = new_tweet_mongo["tweet"]["coordinates"]
+                number_of_tweets += 1
+
+            print("Chunk collected: ", chunk_id, datetime.now())
+            break
+        except OperationFailure:
+            # a chunk that could not be read must not look empty, callers record it as failed
+            if retry == 5:
+                raise
+            continue
+
+    return ChunkArrays(ids[:number_of_tweets], tweet_user_ids[:number_of_tweets], coordinates[:number_of_tweets])
+
+
+def _tweet_coordinates(point_list):
+    """
+    Coordinates of tweets as an array with one row per tweet. Accepts lists of tweets and UserTweets.
+
+    :param point_list:      _id, user_id, coordinates tuples or UserTweets
+    :return:                numpy array of easting, northing coordinates
+
+    :type point_list        list[tuple[]] | UserTweets
+    :rtype                  numpy.ndarray
+    """
+
+    if isinstance(point_list, UserTweets):
+        return point_list.coordinates
+
+    return np.array([one_tweet[2] for one_tweet in point_list]).reshape(-1, 2)
+
+
+def _complex_points(point_list):
+    """
+    Coordinates of tweets as complex numbers. Accepts lists of tweets and UserTweets.
+
+    :param point_list:      _id, user_id, coordinates tuples or UserTweets
+    :return:                numpy array of easting + 1j * northing
+
+    :type point_list        list[tuple[]] | UserTweets
+    :rtype                  numpy.ndarray
+    """
+
+    if isinstance(point_list, UserTweets):
+        return point_list.coordinates[:, 0] + 1j * point_list.coordinates[:, 1]
+
+    return np.array([complex(one_tweet[2][0], one_tweet[2][1]) for one_tweet in point_list])
 
 
 def _euclidean_distances_matrix(vector1,
@@ -137,7 +340,7 @@ def distance_matrix(point_list,
     """
 
     # create numpy array from input points
-    all_points = np.array([complex(one_tweet[2][0], one_tweet[2][1]) for one_tweet in point_list])
+    all_points = _complex_points(point_list)
 
     # count the size of input
     n = len(point_list)
@@ -165,6 +368,560 @@ def distance_matrix(point_list,
     return distance_array_integer
 
 
+def _close_pairs(all_points,
+                 rows,
+                 cols,
+                 eps):
+    """
+    Keep only those candidate pairs that are closer than eps. Uses the same integer truncated euclidean
+    distance as distance_matrix, so that all neighbour search methods agree exactly.
+
+    :param all_points:  numpy array of complex coordinates.
+    :param rows:        Indices of first points in candidate pairs.
+    :param cols:        Indices of second points in candidate pairs.
+    :param eps:         Distance parameter for DBScan algorithm.
+    :return:            Tuple of filtered rows and cols.
+
+    :type all_points    numpy.ndarray
+    :type rows          numpy.ndarray
+    :type cols          numpy.ndarray
+    :type eps           int | float
+    :rtype              tuple[numpy.ndarray, numpy.ndarray]
+    """
+
+    close = abs(all_points[rows] - all_points[cols]).astype("int32") < eps
+
+    return rows[close], cols[close]
+
+
+def _grid_cell_pairs(all_points,
+                     eps):
+    """
+    Bucket points into square grid cells with sides of eps (rounded up) and list the pairs of cells that
+    need to be compared: each occupied cell with itself and with its occupied neighbours.
+
+    :param all_points:  numpy array of complex coordinates.
+    :param eps:         Distance parameter for DBScan algorithm.
+    :return:            Tuple of point order (sorted by cell), start and size of each cell in that order,
+                        first and second cells of each cell pair.
+
+    :type all_points    numpy.ndarray
+    :type eps           int | float
+    :rtype              tuple[numpy.ndarray]
+    """
+
+    # int(distance) < eps is the same as distance < ceil(eps), so close points are less than a cell apart
+    cell_size = max(ceil(eps), 1)
+
+    # find grid cell of each point, shifted so that neighbouring cell ids are never negative
+    cell_x = np.floor(all_points.real / cell_size).astype("int64")
+    cell_y = np.floor(all_points.imag / cell_size).astype("int64")
+    cell_x -= cell_x.min() - 1
+    cell_y -= cell_y.min() - 1
+    grid_height = cell_y.max() + 2
+    cell_key = cell_x * grid_height + cell_y
+
+    # sort points by cell, then find the start and size of each occupied cell
+    order = np.argsort(cell_key, kind="mergesort")
+    cells, cell_start, cell_count = np.unique(cell_key[order], return_index=True, return_counts=True)
+
+    # compare each cell to itself and to 4 of its neighbours, the other 4 are covered from the other side
+    first_cells = []
+    second_cells = []
+    for offset in (0, 1, grid_height - 1, grid_height, grid_height + 1):
+        position = np.searchsorted(cells, cells + offset)
+        position[position == len(cells)] = 0
+        found = np.flatnonzero(cells[position] == cells + offset)
+        first_cells.append(found)
+        second_cells.append(position[found])
+
+    return order, cell_start, cell_count, np.concatenate(first_cells), np.concatenate(second_cells)
+
+
+def _grid_neighbour_pairs(all_points,
+                          eps,
+                          block_size=1000):
+    """
+    Find all pairs of points closer than eps by bucketing the points into square grid cells with sides of eps
+    (rounded up). Two close points are always in the same or in adjacent cells, so only those cells are compared.
+    Candidate pairs are generated in blocks of at most block_size ** 2 pairs to keep memory bounded.
+
+    :param all_points:  numpy array of complex coordinates.
+    :param eps:         Distance parameter for DBScan algorithm.
+    :param block_size:  Square root of the maximum number of candidate pairs held in memory at once.
+    :return:            Tuple of row and column indices, each pair is only returned once.
+
+    :type all_points    numpy.ndarray
+    :type eps           int | float
+    :type block_size    int
+    :rtype              tuple[numpy.ndarray, numpy.ndarray]
+    """
+
+    order, cell_start, cell_count, first_cells, second_cells = _grid_cell_pairs(all_points, eps)
+    pair_sizes = cell_count[first_cells] * cell_count[second_cells]
+
+    # split cell pairs into blocks of candidate pairs
+    block_end = np.cumsum(pair_sizes) // max(block_size ** 2, 1)
+    block_breaks = np.flatnonzero(np.diff(block_end)) + 1
+    block_bounds = np.concatenate(([0], block_breaks, [len(first_cells)]))
+
+    rows = []
+    cols = []
+    for block_id in range(len(block_bounds) - 1):
+        block = slice(block_bounds[block_id], block_bounds[block_id + 1])
+        first = first_cells[block]
+        second = second_cells[block]
+        sizes = pair_sizes[block]
+
+        # enumerate every combination of points between the two cells of each cell pair
+        pair_owner = np.repeat(np.arange(len(first)), sizes)
+        within = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        second_size = cell_count[second][pair_owner]
+        first_local = within // second_size
+        second_local = within % second_size
+
+        # pairs within the same cell are counted only once
+        keep = (first[pair_owner] != second[pair_owner]) | (first_local < second_local)
+
+        block_rows = order[cell_start[first][pair_owner][keep] + first_local[keep]]
+        block_cols = order[cell_start[second][pair_owner][keep] + second_local[keep]]
+
+        block_rows, block_cols = _close_pairs(all_points, block_rows, block_cols, eps)
+        rows.append(block_rows)
+        cols.append(block_cols)
+
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def _kdtree_neighbour_pairs(all_points,
+                            eps):
+    """
+    Find all pairs of points closer than eps using scipy's KD-tree.
+
+    :param all_points:  numpy array of complex coordinates.
+    :param eps:         Distance parameter for DBScan algorithm.
+    :return:            Tuple of row and column indices, each pair is only returned once.
+
+    :type all_points    numpy.ndarray
+    :type eps           int | float
+    :rtype              tuple[numpy.ndarray, numpy.ndarray]
+    """
+
+    tree = cKDTree(np.column_stack((all_points.real, all_points.imag)))
+
+    # search slightly further than needed, the exact filtering is done afterwards
+    pairs = tree.query_pairs(max(ceil(eps), 1) + 0.5, output_type="ndarray")
+
+    return _close_pairs(all_points, pairs[:, 0].astype("int64"), pairs[:, 1].astype("int64"), eps)
+
+
+def _dense_neighbour_pairs(all_points,
+                           eps,
+                           block_size=1000):
+    """
+    Find all pairs of points closer than eps from strips of the distance matrix. Only one strip of
+    block_size columns is held in memory at a time.
+
+    :param all_points:  numpy array of complex coordinates.
+    :param eps:         Distance parameter for DBScan algorithm.
+    :param block_size:  Number of columns in each strip of the distance matrix.
+    :return:            Tuple of row and column indices, each pair is only returned once.
+
+    :type all_points    numpy.ndarray
+    :type eps           int | float
+    :type block_size    int
+    :rtype              tuple[numpy.ndarray, numpy.ndarray]
+    """
+
+    rows = []
+    cols = []
+    for start in range(0, len(all_points), block_size):
+        # rows of the strip are the points in the block, columns are all points
+        block_rows, block_cols = np.nonzero(_euclidean_distances_matrix(all_points,
+                                                                        all_points[start:(start + block_size)]) < eps)
+        block_rows += start
+        upper = block_rows < block_cols
+        rows.append(block_rows[upper].astype("int64"))
+        cols.append(block_cols[upper].astype("int64"))
+
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def _find_neighbour_pairs(all_points,
+                          eps,
+                          method="grid",
+                          block_size=1000):
+    """
+    Dispatch neighbour search of complex coordinates to one of the available methods. See neighbour_pairs.
+
+    :type all_points    numpy.ndarray
+    :type eps           int | float
+    :type method        str
+    :type block_size    int
+    :rtype              tuple[numpy.ndarray, numpy.ndarray]
+    """
+
+    assert method in ("grid", "kdtree", "dense"), "method must be one of grid, kdtree or dense"
+
+    if len(all_points) < 2:
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+
+    if method == "kdtree" and cKDTree is None:
+        print("scipy is not available, using grid neighbour search instead")
+        method = "grid"
+
+    if method == "grid":
+        return _grid_neighbour_pairs(all_points, eps, block_size=block_size)
+    elif method == "kdtree":
+        return _kdtree_neighbour_pairs(all_points, eps)
+    else:
+        return _dense_neighbour_pairs(all_points, eps, block_size=block_size)
+
+
+def neighbour_pairs(point_list,
+                    eps=20,
+                    method="grid",
+                    block_size=1000):
+    """
+    For a given list of input points (Tweets) returns all pairs of points that are closer than eps.
+    Unlike distance_matrix, memory use grows with the number of close pairs rather than the square of the number
+    of tweets.
+
+    :param point_list:      _id, user_id, coordinates tuples
+    :param eps:             Distance parameter for DBScan algorithm.
+    :param method:          "grid" for grid cell bucketing, "kdtree" for scipy's KD-tree (falls back to grid
+                            if scipy is not installed), "dense" for strips of the distance matrix.
+    :param block_size:      Block size for dense distance matrix and grid candidate generation.
+    :return:                Tuple of row and column indices, each pair is only returned once.
+
+    :type point_list        list[tuple[]]
+    :type eps               int | float
+    :type method            str
+    :type block_size        int
+    :rtype                  tuple[numpy.ndarray, numpy.ndarray]
+    """
+
+    # create numpy array from input points
+    all_points = _complex_points(point_list)
+
+    return _find_neighbour_pairs(all_points, eps=eps, method=method, block_size=block_size)
+
+
+def neighbour_graph(point_list,
+                    eps=20,
+                    method="grid",
+                    block_size=1000):
+    """
+    Sparse replacement of distance_matrix. Returns the neighbours of every point in compressed sparse row form:
+    the neighbours of point i are indices[indptr[i]:indptr[i + 1]], in increasing order.
+
+    :param point_list:      _id, user_id, coordinates tuples
+    :param eps:             Distance parameter for DBScan algorithm.
+    :param method:          Neighbour search method, see neighbour_pairs.
+    :param block_size:      Block size for neighbour search, see neighbour_pairs.
+    :return:                Tuple of indptr and indices arrays.
+
+    :type point_list        list[tuple[]]
+    :type eps               int | float
+    :type method            str
+    :type block_size        int
+    :rtype                  tuple[numpy.ndarray, numpy.ndarray]
+    """
+
+    rows, cols = neighbour_pairs(point_list, eps=eps, method=method, block_size=block_size)
+
+    # store each pair in both directions, sorted by row then column
+    all_rows = np.concatenate((rows, cols))
+    all_cols = np.concatenate((cols, rows))
+    order = np.lexsort((all_cols, all_rows))
+
+    indptr = np.zeros(len(point_list) + 1, dtype="int64")
+    np.cumsum(np.bincount(all_rows, minlength=len(point_list)), out=indptr[1:])
+
+    return indptr, all_cols[order]
+
+
+def _close_points(search_row,
+                  remaining_columns,
+                  distance_array,
+                  eps):
+    """
+    Return the remaining columns that are closer than eps to search_row.
+
+    :param search_row:          Row index of the point to search around.
+    :param remaining_columns:   numpy array of column indices that have not been assigned yet.
+    :param distance_array:      Either a distance matrix (distance_matrix) or a sparse neighbour graph
+                                (neighbour_graph).
+    :param eps:                 Distance parameter for DBScan algorithm. Not used for neighbour graphs.
+    :return:                    numpy array of close column indices.
+
+    :type search_row            int
+    :type remaining_columns     numpy.ndarray
+    :type distance_array        numpy.ndarray | tuple[numpy.ndarray, numpy.ndarray]
+    :type eps                   int | float
+    :rtype                      numpy.ndarray
+    """
+
+    if isinstance(distance_array, np.ndarray):
+        return remaining_columns[distance_array[search_row, remaining_columns] < eps]
+
+    indptr, indices = distance_array
+    neighbours = indices[indptr[search_row]:indptr[search_row + 1]]
+
+    return remaining_columns[np.isin(remaining_columns, neighbours)]
+
+
+def label_clusters(number_of_points,
+                   rows,
+                   cols):
+    """
+    Label the connected components of a neighbour graph given as a list of pairs. This is the same as running
+    create_one_cluster until the points are exhausted, but runs in near linear time in the number of pairs.
+    Uses a vectorised union-find: every round each pair hooks the larger of its two roots under the smaller,
+    then paths are compressed until every point points at its root.
+
+    :param number_of_points:    Number of points in the graph.
+    :param rows:                Indices of first points in neighbour pairs.
+    :param cols:                Indices of second points in neighbour pairs.
+    :return:                    Cluster label for each point. Labels are numbered in order of the first
+                                point of each cluster, same as the order of create_one_cluster.
+
+    :type number_of_points      int
+    :type rows                  numpy.ndarray
+    :type cols                  numpy.ndarray
+    :rtype                      numpy.ndarray
+    """
+
+    parent = np.arange(number_of_points, dtype="int64")
+
+    while True:
+        # compress paths
+        grand_parent = parent[parent]
+        while (grand_parent != parent).any():
+            parent = grand_parent
+            grand_parent = parent[parent]
+
+        # drop pairs that are already in the same cluster
+        row_roots = parent[rows]
+        col_roots = parent[cols]
+        different = row_roots != col_roots
+        if not different.any():
+            break
+
+        rows = rows[different]
+        cols = cols[different]
+
+        # hook larger roots under smaller ones, so the root of each cluster is its first point
+        np.minimum.at(parent,
+                      np.maximum(row_roots[different], col_roots[different]),
+                      np.minimum(row_roots[different], col_roots[different]))
+
+    # roots are sorted, so labels follow the first point of each cluster
+    return np.unique(parent, return_inverse=True)[1].reshape(-1)
+
+
+def cluster_labels(point_list,
+                   eps=20,
+                   method="grid",
+                   block_size=1000):
+    """
+    For a given list of input points (Tweets) return the cluster label of each point. Points with identical
+    coordinates are always in the same cluster, so neighbours are only searched between distinct coordinates.
+
+    :param point_list:      _id, user_id, coordinates tuples
+    :param eps:             Distance parameter for DBScan algorithm.
+    :param method:          Neighbour search method, see neighbour_pairs.
+    :param block_size:      Block size for neighbour search, see neighbour_pairs.
+    :return:                Cluster label for each point, numbered in order of the first point of each cluster.
+
+    :type point_list        list[tuple[]]
+    :type eps               int | float
+    :type method            str
+    :type block_size        int
+    :rtype                  numpy.ndarray
+    """
+
+    if len(point_list) == 0:
+        return np.empty(0, dtype="int64")
+
+    # collapse duplicate coordinates
+    all_points = _complex_points(point_list)
+    unique_points, inverse = np.unique(all_points, return_inverse=True)
+
+    # label distinct coordinates then spread labels back to all points
+    with timer("build neighbours", items=len(unique_points)):
+        rows, cols = _find_neighbour_pairs(unique_points, eps=eps, method=method, block_size=block_size)
+    with timer("label", items=len(point_list)):
+        labels = _number_by_first_point(label_clusters(len(unique_points), rows, cols)[inverse.reshape(-1)])
+
+    return labels
+
+
+def _number_by_first_point(labels):
+    """
+    Renumber cluster labels in order of the first point of each cluster.
+
+    :param labels:          Cluster label of each point.
+    :return:                New cluster label of each point.
+
+    :type labels            numpy.ndarray
+    :rtype                  numpy.ndarray
+    """
+
+    first_points = np.unique(labels, return_index=True)[1]
+    new_labels = np.empty(len(first_points), dtype="int64")
+    new_labels[np.argsort(first_points)] = np.arange(len(first_points))
+
+    return new_labels[labels]
+
+
+def cluster_labels_sweep(point_list,
+                         eps_values,
+                         method="grid",
+                         block_size=1000):
+    """
+    Cluster labels for several values of eps at once. Neighbours are only searched once, at the largest eps,
+    then the pairs closer than each eps are labelled separately. Same output as calling cluster_labels
+    for each eps.
+
+    :param point_list:      _id, user_id, coordinates tuples
+    :param eps_values:      Distance parameters for DBScan algorithm.
+    :param method:          Neighbour search method, see neighbour_pairs.
+    :param block_size:      Block size for neighbour search, see neighbour_pairs.
+    :return:                Dictionary of {eps: cluster label for each point}
+
+    :type point_list        list[tuple[]]
+    :type eps_values        list[int | float]
+    :type method            str
+    :type block_size        int
+    :rtype                  dict[int | float, numpy.ndarray]
+    """
+
+    if len(point_list) == 0:
+        return dict((eps, np.empty(0, dtype="int64")) for eps in eps_values)
+
+    # collapse duplicate coordinates
+    unique_points, inverse = np.unique(_complex_points(point_list), return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # neighbours at the largest eps with their truncated distances
+    rows, cols = _find_neighbour_pairs(unique_points, eps=max(eps_values), method=method, block_size=block_size)
+    distances = abs(unique_points[rows] - unique_points[cols]).astype("int32")
+
+    labels_by_eps = {}
+    for eps in eps_values:
+        close = distances < eps
+        labels = label_clusters(len(unique_points), rows[close], cols[close])[inverse]
+        labels_by_eps[eps] = _number_by_first_point(labels)
+
+    return labels_by_eps
+
+
+def estimate_cluster_memory(point_list,
+                            eps=20,
+                            block_size=1000):
+    """
+    Estimate the peak memory needed to cluster one user with each neighbour search strategy.
+    The number of neighbour pairs is bounded by the number of candidate pairs in neighbouring grid cells,
+    so the estimates are on the safe side.
+
+    :param point_list:      _id, user_id, coordinates tuples
+    :param eps:             Distance parameter for DBScan algorithm.
+    :param block_size:      Block size for the blocked and grid strategies.
+    :return:                Dictionary of {strategy: estimated bytes} for "dense", "blocked" and "grid".
+
+    :type point_list        list[tuple[]]
+    :type eps               int | float
+    :type block_size        int
+    :rtype                  dict[str, int]
+    """
+
+    # neighbours are only searched between distinct coordinates
+    all_points = np.unique(_complex_points(point_list))
+    distinct_points = len(all_points)
+
+    # count candidate pairs in neighbouring grid cells
+    cell_count, first_cells, second_cells = _grid_cell_pairs(all_points, eps)[2:]
+    pair_sizes = cell_count[first_cells] * cell_count[second_cells]
+    candidate_pairs = int(pair_sizes.sum())
+
+    # memory that is needed whatever the strategy
+    base_memory = len(point_list) * TWEET_BYTES + candidate_pairs * NEIGHBOUR_PAIR_BYTES
+
+    # grid holds one block of candidate pairs, unless a single pair of cells is bigger than that
+    grid_candidates = max(min(candidate_pairs, block_size ** 2), int(pair_sizes.max()))
+
+    return {"dense": base_memory + distinct_points ** 2 * MATRIX_ELEMENT_BYTES,
+            "blocked": base_memory + distinct_points * min(block_size, distinct_points) * MATRIX_ELEMENT_BYTES,
+            "grid": base_memory + grid_candidates * CANDIDATE_PAIR_BYTES}
+
+
+def plan_cluster_memory(point_list,
+                        memory_budget,
+                        eps=20,
+                        block_size=1000):
+    """
+    Pick the neighbour search strategy for one user that fits into the memory budget. Strategies are tried
+    in order of dense matrix, grid and blocked matrix. The blocked matrix uses smaller blocks if needed.
+
+    :param point_list:      _id, user_id, coordinates tuples
+    :param memory_budget:   Memory available for clustering one user in bytes.
+    :param eps:             Distance parameter for DBScan algorithm.
+    :param block_size:      Default block size for the blocked and grid strategies.
+    :return:                Tuple of strategy name, neighbour search method, block size and estimated peak
+                            memory in bytes. Strategy and method are None if the user does not fit the budget.
+
+    :type point_list        list[tuple[]]
+    :type memory_budget     int | float
+    :type eps               int | float
+    :type block_size        int
+    :rtype                  tuple[str | None, str | None, int, int]
+    """
+
+    estimates = estimate_cluster_memory(point_list, eps=eps, block_size=block_size)
+
+    if estimates["dense"] <= memory_budget:
+        return "dense", "dense", max(len(point_list), 1), estimates["dense"]
+
+    if estimates["grid"] <= memory_budget:
+        return "grid", "grid", block_size, estimates["grid"]
+
+    # shrink blocks of the distance matrix until they fit
+    distinct_points = len(np.unique(_complex_points(point_list)))
+    row_memory = distinct_points * MATRIX_ELEMENT_BYTES
+    base_memory = estimates["blocked"] - min(block_size, distinct_points) * row_memory
+    fitting_block = int((memory_budget - base_memory) // row_memory)
+
+    if fitting_block >= 1:
+        fitting_block = min(fitting_block, block_size)
+        return "blocked", "dense", fitting_block, base_memory + fitting_block * row_memory
+
+    # nothing fits, report the smallest estimate
+    return None, None, block_size, min(estimates.values())
+
+
+def _plot_cluster(new_cluster):
+    """
+    Plot the points of one cluster with matplotlib for debugging.
+
+    :param new_cluster: List of points in the cluster.
+    :return:            None
+
+    :type new_cluster   list[tuple[]]
+    :rtype              None
+    """
+
+    import matplotlib.pyplot as plt
+
+    x = [one_point[2][0] for one_point in new_cluster]
+    y = [one_point[2][1] for one_point in new_cluster]
+
+    plt.plot(x, y, 'ro')
+    plt.show()
+
+    return None
+
+
 def create_one_cluster(cluster_points,
                        remaining_mask,
                        distance_array,
@@ -179,7 +936,7 @@ def create_one_cluster(cluster_points,
                             that have not been searched before. An updated version of this will be returned,
                             with the new mask.
     :param distance_array:  numpy integer array of approximated euclidean distances, output of distance matrix
-                            function.
+                            function. Can also be a sparse neighbour graph, output of neighbour_graph function.
     :param eps:             Distance parameter for DBScan algorithm
     :param graphical_debug  If true then matplotlib is used to print the resulting cluster for debugging.
 
@@ -188,7 +945,7 @@ def create_one_cluster(cluster_points,
 
     :type cluster_points    list[tuple]
     :type remaining_mask    list[list[], numpy.ndarray]
-    :type distance_array    numpy.ndarray
+    :type distance_array    numpy.ndarray | tuple[numpy.ndarray, numpy.ndarray]
     :type eps               int | float
     :type graphical_debug   bool
 
@@ -207,7 +964,7 @@ def create_one_cluster(cluster_points,
     remaining_mask[1] = np.delete(remaining_mask[1], 0)
 
     # search for that one row
-    found = remaining_mask[1][distance_array[search_row, remaining_mask[1]] < eps]
+    found = _close_points(search_row, remaining_mask[1], distance_array, eps)
 
     # find all other rows that are close to row 1
     search_these = []
@@ -229,7 +986,7 @@ def create_one_cluster(cluster_points,
             remaining_mask[0].remove(search_row)
 
             # search row=
-            found = remaining_mask[1][distance_array[search_row, remaining_mask[1]] < eps]
+            found = _close_points(search_row, remaining_mask[1], distance_array, eps)
 
             # search all found indices
             for found_index in found:
@@ -249,15 +1006,325 @@ def create_one_cluster(cluster_points,
         search_these = new_search_list[:]
 
     if graphical_debug:
-        import matplotlib.pyplot as plt
+        _plot_cluster(new_cluster)
+
+    return new_cluster, remaining_mask
+
+
+def cluster_statistics(coordinates,
+                       labels):
+    """
+    Compute the statistics of every cluster of one user at once. For each cluster: number of points, mean
+    centroid and the maximum, mean and standard deviation of distances from the centroid. Distances from the
+    centroid are truncated to integers, as in distance_matrix.
+
+    :param coordinates:     numpy array of easting, northing coordinates, one row per point.
+    :param labels:          Cluster label of each point, numbered from 0. Output of cluster_labels.
+    :return:                Dictionary of numpy arrays: "count", "centroid", "max_distance", "mean_distance",
+                            "standard_deviation_distance" with one element per cluster and "distance" with one
+                            element per point.
+
+    :type coordinates       numpy.ndarray
+    :type labels            numpy.ndarray
+    :rtype                  dict[str, numpy.ndarray]
+    """
+
+    coordinates = np.asarray(coordinates, dtype="float64")
+
+    # number of points and mean centroid of each cluster
+    count = np.bincount(labels)
+    centroid = np.column_stack((np.bincount(labels, weights=coordinates[:, 0]) / count,
+                                np.bincount(labels, weights=coordinates[:, 1]) / count))
+
+    # convert to complex numbers for easier calculations
+    complex_coordinates = 1j * coordinates[..., 1] + coordinates[..., 0]
+    complex_centroid = 1j * centroid[..., 1] + centroid[..., 0]
+
+    # distance of each point from the centroid of its own cluster
+    distance = abs(complex_coordinates - complex_centroid[labels]).astype("int32")
+
+    # group reductions of distances
+    max_distance = np.zeros(len(count), dtype="int32")
+    np.maximum.at(max_distance, labels, distance)
+    mean_distance = np.bincount(labels, weights=distance) / count
+    deviation = distance - mean_distance[labels]
+    standard_deviation_distance = np.sqrt(np.bincount(labels, weights=deviation * deviation) / count)
+
+    return {"count": count,
+            "centroid": centroid,
+            "max_distance": max_distance,
+            "mean_distance": mean_distance,
+            "standard_deviation_distance": standard_deviation_distance,
+            "distance": distance}
+
+
+def _connect_address_base(mongo_address_list):
+    """
+    Connect to the address base with automatic retries.
+
+    :param mongo_address_list:      Pymongo connection parameters to geo_indexed address base
+                                    [ip, database, collection].
+    :return:                        Pymongo collection of the address base.
+
+    :type mongo_address_list        list[str] | tuple[str]
+    :rtype                          pymongo.collection.Collection
+    """
+
+    mongo_address = None
+
+    # create pymongo connection with automatic retries
+    try:
+        mongo_address = pymongo.MongoClient(host=mongo_address_list[0], w=0)[mongo_address_list[1]][
+            mongo_address_list[2]]
+    except ConnectionFailure:
+        for x in range(5):
+            try:
+                print("server is busy %s retry number: %d" % (mongo_address_list, x))
+                time.sleep(1)
+                mongo_address = pymongo.MongoClient(host=mongo_address_list[0], w=0)[mongo_address_list[1]][
+                    mongo_address_list[2]]
+                break
+
+            except ConnectionFailure:
+                pass
+
+    assert mongo_address is not None, "Connection to address base failed after 5 retries: %s" % mongo_address_list
+
+    return mongo_address
+
+
+def _find_cluster_address(cluster_centroid,
+                          mongo_address,
+                          mongo_address_list):
+    """
+    Find the closest address within 300m of a cluster centroid.
+
+    :param cluster_centroid:        Mean centroid coordinates of cluster.
+    :param mongo_address:           Pymongo collection of the address base, see _connect_address_base.
+    :param mongo_address_list:      Pymongo connection parameters to the same address base, for messages.
+    :return:                        Tuple of the address document ("NA" if none found) and the place to
+                                    include in cluster_id (postcode, "NA" or "FAILURE").
+
+    :type cluster_centroid          numpy.ndarray | list[float] | tuple[float]
+    :type mongo_address             pymongo.collection.Collection
+    :type mongo_address_list        list[str] | tuple[str]
+    :rtype                          tuple[dict | str, str]
+    """
+
+    # initiate empty variables
+    place = "MISSING"
+    address = "NA"
+
+    query = {"coordinates": SON([("$near", (float(cluster_centroid[0]), float(cluster_centroid[1]))),
+                                 ("$maxDistance", 300)])}
+    try:
+        closest_address_list = mongo_address.find(query, {"_id": 0}).limit(1)[0]
+        address = closest_address_list
+        address["distance"] = float('%.3f' % round(simple_distance(closest_address_list["coordinates"],
+                                                                   cluster_centroid), 3))
+
+        place = closest_address_list["postcode"].replace(" ", "_")
+    except IndexError:
+        # no address has been found within 300m
+        address = "NA"
+        place = "NA"
+    except OperationFailure:
+        print("No address base available!")
+        address = "NA"
+        place = "FAILURE"
+    except AutoReconnect:
+        print("Address base is busy!")
+        for x in range(5):
+            try:
+                time.sleep(1)
+                closest_address_list = mongo_address.find(query, {"_id": 0}).limit(1)[0]
+                address = closest_address_list
+                address["distance"] = float('%.3f' % round(simple_distance(closest_address_list["coordinates"],
+                                                                           cluster_centroid), 3))
+
+                place = closest_address_list["postcode"].replace(" ", "_")
+                break
+
+            except IndexError:
+                # no address has been found within 300m
+                address = "NA"
+                place = "NA"
+                break
+
+            except OperationFailure:
+                print("No address base available!: %s" % mongo_address_list)
+                address = "NA"
+                place = "FAILURE"
+                break
+
+            except AutoReconnect:
+                print("Try failed: %d" % x)
+                continue
+
+    return address, place
+
+
+def resolve_cluster_addresses(pending_addresses,
+                              mongo_address_list,
+                              lookup_threads=ADDRESS_LOOKUP_THREADS):
+    """
+    Look up the closest address of many clusters in one go and attach them to the cluster info.
+    Identical centroids are only looked up once and the lookups run on lookup_threads threads sharing one
+    connection, so the round trips of the $near queries overlap. Also completes the cluster_id with the postcode.
+
+    :param pending_addresses:       List of (cluster_info, centroid, user_id, cluster_name) tuples, as collected
+                                    by cluster_one_user.
+    :param mongo_address_list:      Pymongo connection parameters to geo_indexed address base
+                                    [ip, database, collection].
+    :param lookup_threads:          Number of lookups running at the same time.
+    :return:                        Number of distinct centroids looked up.
+
+    :type pending_addresses         list[tuple]
+    :type mongo_address_list        list[str] | tuple[str]
+    :type lookup_threads            int
+    :rtype                          int
+    """
+
+    if len(pending_addresses) == 0:
+        return 0
+
+    # collect distinct centroids
+    found_addresses = {}
+    for one_pending in pending_addresses:
+        found_addresses[(float(one_pending[1][0]), float(one_pending[1][1]))] = None
+
+    # look up all of them on a few threads, pymongo connections are thread safe
+    mongo_address = _connect_address_base(mongo_address_list)
+    centroids = list(found_addresses.keys())
+    addresses = Parallel(n_jobs=min(lookup_threads, len(centroids)), backend="threading")(
+        delayed(_find_cluster_address)(centroid, mongo_address, mongo_address_list) for centroid in centroids)
+    found_addresses = dict(zip(centroids, addresses))
+
+    # attach addresses and finish cluster ids
+    for cluster_info, centroid, user_id, cluster_name in pending_addresses:
+        address, place = found_addresses[(float(centroid[0]), float(centroid[1]))]
+
+        # clusters sharing a centroid get their own copy of the address
+        if type(address) is dict:
+            address = dict(address)
+
+        cluster_info["address"] = address
+        cluster_info["cluster_id"] = "%s_%s_%s" % (user_id, place, cluster_name)
+
+    return len(found_addresses)
+
+
+def _is_residential(address):
+    """
+    Check whether an address document from the address base is residential.
+
+    :param address:     Address document or "NA".
+    :return:            True if the address is classified as residential.
+
+    :type address       dict | str
+    :rtype              bool
+    """
+
+    return isinstance(address, dict) and address.get("classification", {}).get("abbreviated") == "R"
+
+
+def find_dominant_clusters(cluster_infos):
+    """
+    Find the dominant cluster of one user: the most populous cluster with a residential address. If more than one
+    residential cluster has the largest count, then all of them are returned, as in 1.5_flag_dominant.py.
+
+    :param cluster_infos:   Cluster info of every cluster of the user, with addresses attached.
+    :return:                List of the dominant cluster infos, empty if the user has no residential cluster.
+
+    :type cluster_infos     list[dict]
+    :rtype                  list[dict]
+    """
+
+    residential_clusters = [cluster_info for cluster_info in cluster_infos
+                            if cluster_info["type"] == "cluster" and _is_residential(cluster_info.get("address"))]
+
+    if len(residential_clusters) == 0:
+        return []
+
+    largest_count = max(cluster_info["count"] for cluster_info in residential_clusters)
+
+    return [cluster_info for cluster_info in residential_clusters if cluster_info["count"] == largest_count]
+
+
+def _flag_dominant_clusters(user_updates):
+    """
+    Set "dominant": 1 in the cluster info of the dominant clusters of one user, see find_dominant_clusters.
+
+    :param user_updates:    Update instructions of one user, as returned by cluster_one_user.
+    :return:                Number of clusters flagged.
+
+    :type user_updates      list[list[tuple]]
+    :rtype                  int
+    """
+
+    dominant_clusters = find_dominant_clusters([cluster[0][1] for cluster in user_updates if len(cluster) > 0])
+    for cluster_info in dominant_clusters:
+        cluster_info["dominant"] = 1
+
+    return len(dominant_clusters)
+
+
+def _cluster_document(statistics,
+                      label,
+                      user_id,
+                      cluster_name,
+                      pending_addresses,
+                      min_points=3):
+    """
+    Build the cluster info of one cluster from the output of cluster_statistics. The address of real clusters
+    is not looked up here, the cluster is added to pending_addresses instead (see resolve_cluster_addresses).
+
+    :param statistics:              Output of cluster_statistics.
+    :param label:                   Label of the cluster in statistics.
+    :param user_id:                 Twitter user_id, to include in cluster_id.
+    :param cluster_name:            Name to include in cluster_id.
+    :param pending_addresses:       List to collect clusters that need an address.
+    :param min_points:              Number of points in cluster for cluster classification.
+    :return:                        Json formatted dictionary for mongodb twitter["cluster"] insert.
+
+    :type statistics                dict[str, numpy.ndarray]
+    :type label                     int
+    :type user_id                   int
+    :type cluster_name              str | int
+    :type pending_addresses         list[tuple]
+    :type min_points                int
+    :rtype                          dict
+    """
+
+    cluster_centroid = statistics["centroid"][label]
+
+    # start building final dictionary, these parts are same for all tweets
+    cluster_info = {
+        "count": int(statistics["count"][label]),
+        "centroid_coordinates": [int(cluster_centroid[0]),
+                                 int(cluster_centroid[1])],
+        "stats": {
+            "max_distance": float('%.3f' % round(statistics["max_distance"][label], 3)),
+            "mean_distance": float('%.3f' % round(statistics["mean_distance"][label], 3)),
+            "standard_deviation_distance": float('%.3f' % round(statistics["standard_deviation_distance"][label], 3))
+        }
+    }
 
-        x = [one_point[2][0] for one_point in new_cluster]
-        y = [one_point[2][1] for one_point in new_cluster]
+    # get cluster_type
+    if min_points <= cluster_info["count"]:
+        cluster_info["type"] = "cluster"
+    else:
+        cluster_info["type"] = "noise"
 
-        plt.plot(x, y, 'ro')
-        plt.show()
+    # leave address lookup for later
+    if cluster_info["type"] == "cluster":
+        cluster_info["address"] = "NA"
+        pending_addresses.append((cluster_info, cluster_centroid, user_id, cluster_name))
+    else:
+        cluster_info["address"] = "NA_noise"
+        cluster_info["cluster_id"] = "%s_noise_%s" % (user_id, cluster_name)
 
-    return new_cluster, remaining_mask
+    return cluster_info
 
 
 def create_cluster_info(complete_cluster,
@@ -266,7 +1333,7 @@ def create_cluster_info(complete_cluster,
                         min_points=3):
     """
     Return more information for the cluster. Mean of distances, maximum distance, standard deviation of distances
-    from cluster centroid.
+    from cluster centroid. To process all clusters of a user at once, use cluster_statistics.
 
     :param complete_cluster:        All points in completed cluster.
     :param cluster_name:            Name to include in cluster_id.
@@ -286,119 +1353,17 @@ def create_cluster_info(complete_cluster,
 
     :rtype                          tuple[dict, list]
     """
-    # convert cluster name to string in case of numeric input
-    cluster_name = str(cluster_name)
-
-    # get coordinates and mean centroid coordinates
-    coordinate_points = np.array([one_tweet[2] for one_tweet in complete_cluster])
-    cluster_centroid = coordinate_points.mean(0)
-
-    # convert to complex numbers for easier calculations
-    complex_coordinates = 1j * coordinate_points[..., 1] + coordinate_points[..., 0]
-    complex_centroid = 1j * cluster_centroid[..., 1] + cluster_centroid[..., 0]
-
-    # calculate all the distances
-    distances = _euclidean_distances_matrix(complex_coordinates, complex_centroid)
-
-    # start building final dictionary, these parts are same for all tweets
-    cluster_info = {
-        "count": len(complete_cluster),
-        "centroid_coordinates": [int(cluster_centroid[0]),
-                                 int(cluster_centroid[1])],
-        "stats": {
-            "max_distance": float('%.3f' % round(distances.max(), 3)),
-            "mean_distance": float('%.3f' % round(distances.mean(), 3)),
-            "standard_deviation_distance": float('%.3f' % round(distances.std(), 3))
-        }
-    }
-
-    # get cluster_type
-    if min_points <= cluster_info["count"]:
-        cluster_info["type"] = "cluster"
-    else:
-        cluster_info["type"] = "noise"
-
-    # initiate empty variables
-    place = "MISSING"
-    cluster_info["address"] = "NA"
-
-    mongo_address = None
-
-    # find closest address
-    if cluster_info["type"] == "cluster":
-        # create pymongo connection with automatic retries
-        try:
-            mongo_address = pymongo.MongoClient(host=mongo_address_list[0], w=0)[mongo_address_list[1]][
-                mongo_address_list[2]]
-        except ConnectionFailure:
-            for x in range(5):
-                try:
-                    print("server is busy %s retry number: %d" % (mongo_address_list, x))
-                    time.sleep(1)
-                    mongo_address = pymongo.MongoClient(host=mongo_address_list[0], w=0)[mongo_address_list[1]][
-                        mongo_address_list[2]]
-                    break
-
-                except ConnectionFailure:
-                    pass
-
-        assert mongo_address is not None, "Connection to address base failed after 5 retries: %s" % mongo_address_list
 
-        query = {"coordinates": SON([("$near", (float(cluster_centroid[0]), float(cluster_centroid[1]))),
-                                     ("$maxDistance", 300)])}
-        try:
-            closest_address_list = mongo_address.find(query, {"_id": 0}).limit(1)[0]
-            cluster_info["address"] = closest_address_list
-            cluster_info["address"]["distance"] = float('%.3f' %
-                                                        round(simple_distance(closest_address_list["coordinates"],
-                                                                              cluster_centroid), 3))
-
-            place = closest_address_list["postcode"].replace(" ", "_")
-        except IndexError:
-            # no address has been found within 300m
-            cluster_info["address"] = "NA"
-            place = "NA"
-        except OperationFailure:
-            print("No address base available!")
-            cluster_info["address"] = "NA"
-            place = "FAILURE"
-        except AutoReconnect:
-            print("Address base is busy!")
-            for x in range(5):
-                try:
-                    time.sleep(1)
-                    closest_address_list = mongo_address.find(query, {"_id": 0}).limit(1)[0]
-                    cluster_info["address"] = closest_address_list
-                    cluster_info["address"]["distance"] = float('%.3f' %
-                                                                round(
-                                                                    simple_distance(closest_address_list["coordinates"],
-                                                                                    cluster_centroid), 3))
-
-                    place = closest_address_list["postcode"].replace(" ", "_")
-                    break
-
-                except IndexError:
-                    # no address has been found within 300m
-                    cluster_info["address"] = "NA"
-                    place = "NA"
-                    break
-
-                except OperationFailure:
-                    print("No address base available!: %s" % mongo_address_list)
-                    cluster_info["address"] = "NA"
-                    place = "FAILURE"
-                    break
-
-                except AutoReconnect:
-                    print("Try failed: %d" % x)
-                    continue
-    else:
-        cluster_info["address"] = "NA_noise"
-        place = "noise"
+    # treat the whole cluster as a single label
+    statistics = cluster_statistics([one_tweet[2] for one_tweet in complete_cluster],
+                                    np.zeros(len(complete_cluster), dtype="int64"))
 
-    cluster_info["cluster_id"] = "%s_%s_%s" % (complete_cluster[0][1], place, cluster_name)
+    pending_addresses = []
+    cluster_info = _cluster_document(statistics, 0, complete_cluster[0][1], str(cluster_name), pending_addresses,
+                                     min_points=min_points)
+    resolve_cluster_addresses(pending_addresses, mongo_address_list)
 
-    return cluster_info, list(distances[0])
+    return cluster_info, list(statistics["distance"])
 
 
 def cluster_one_user(user_id,
@@ -408,25 +1373,40 @@ def cluster_one_user(user_id,
                      min_points=3,
                      debug=False,
                      graph_debug=False,
-                     robot_threshold=30000):
+                     robot_threshold=30000,
+                     neighbour_method="grid",
+                     memory_budget=None,
+                     pending_addresses=None):
     """
     Cluster all the tweets of one user from a twitter dictionary.
 
     :param user_id:         Twitter user_id.
     :param tweets_by_user:  Dictionary of user/list of tweets pairs. Output of create_dictionary_for_chunk
+                            or fetch_chunk_arrays.
     :param mongo_address:   Pymongo connection parameters to an address base.
     :param eps:             Distance parameter for naive DBScan clustering.
     :param min_points:      Minimum number of points in a valid cluster.
+    :param neighbour_method:Neighbour search method: "grid", "kdtree" or "dense", see neighbour_pairs.
+    :param memory_budget:   Memory available for clustering this user in bytes. If given then the neighbour
+                            search is picked by plan_cluster_memory instead of neighbour_method.
+    :param pending_addresses:If a list is given then addresses of clusters are not looked up, the clusters are
+                            appended to this list instead for a later resolve_cluster_addresses call and
+                            the dominant cluster is not flagged. Otherwise addresses are looked up and the dominant
+                            cluster is flagged before returning, see find_dominant_clusters.
     :return:                Updates instructions for cluster_chunk to update mongodb database for user,
-                            with cluster info. False if user is above robot_threshold.
+                            with cluster info. False if user is above robot_threshold, None if the user
+                            does not fit into the memory budget and has to be deferred.
 
     :type user_id           int
-    :type tweets_by_user    dict[int, list[]]
+    :type tweets_by_user    dict[int, list[]] | ChunkArrays
     :type mongo_address     list[str] | tuple[str]
     :type eps               int | float
     :type min_points        int
+    :type neighbour_method  str
+    :type memory_budget     int | float | None
+    :type pending_addresses list[tuple] | None
 
-    :rtype                  list[list[]] | bool
+    :rtype                  list[list[]] | bool | None
     """
 
     # set threshold for debugging
@@ -442,49 +1422,65 @@ def cluster_one_user(user_id,
     if len(all_tweets) > robot_threshold:
         return False
 
-    # create distance matrix
+    # pick a neighbour search that fits into the memory budget
+    block_size = 1000
+    if memory_budget is not None:
+        strategy, neighbour_method, block_size, peak_memory = plan_cluster_memory(all_tweets, memory_budget,
+                                                                                  eps=eps, block_size=block_size)
+        count("users with strategy %s" % (strategy if strategy is not None else "deferred"))
+
+        # most users fit the dense matrix, only the others are worth a line in the log
+        if strategy != "dense":
+            print("   user: %d tweets: %d strategy: %s estimated peak memory: %.1f MB" %
+                  (user_id, len(all_tweets), strategy, peak_memory / 2 ** 20))
+
+        # defer user if it doesn't fit
+        if strategy is None:
+            return None
+
+    # label every tweet with its cluster
     p1_time = datetime.now()
 
-    distance_array = distance_matrix(all_tweets)
+    labels = cluster_labels(all_tweets, eps=eps, method=neighbour_method, block_size=block_size)
 
     if debug and len(all_tweets) > debug_threshold:
-        print(" ** matrix done in ", datetime.now() - p1_time)
-
-    # create mask and switch
-    index = 0
-    continue_clustering = True
-    mask = [[x for x in range(len(all_tweets))],
-            np.arange(len(all_tweets), dtype=np.uint32)]
+        print(" ** labels done in ", datetime.now() - p1_time)
 
     p2_time = datetime.now()
 
-    # set up empty holder for new cluster information
-    mongo_updates = []
+    # group tweet positions by cluster label, keeping the original order of tweets within each cluster
+    by_label = np.argsort(labels, kind="mergesort")
+    cluster_ends = np.cumsum(np.bincount(labels))
 
-    # do clustering till set is exhausted
-    while continue_clustering:
+    # statistics of all clusters at once
+    statistics = cluster_statistics(_tweet_coordinates(all_tweets), labels)
 
-        new_cluster, mask = create_one_cluster(all_tweets, mask, distance_array, eps=eps, graphical_debug=graph_debug)
+    # set up empty holder for new cluster information and clusters waiting for an address
+    mongo_updates = []
+    lookup_addresses = pending_addresses is None
+    if lookup_addresses:
+        pending_addresses = []
 
-        # get info and update database if new info is found
-        if new_cluster is not None:
-            # grab new info
+    tweet_ids = all_tweets.ids if isinstance(all_tweets, UserTweets) else [tweet[0] for tweet in all_tweets]
 
-            new_info, distances = create_cluster_info(new_cluster, index, mongo_address, min_points=min_points)
+    for index, cluster_positions in enumerate(np.split(by_label, cluster_ends[:-1])):
+        if graph_debug:
+            _plot_cluster([all_tweets[position] for position in cluster_positions])
 
-            # find tweet ids to update
-            tweet_ids_to_update = [tweet[0] for tweet in new_cluster]
+        # grab new info
+        new_info = _cluster_document(statistics, index, user_id, index, pending_addresses, min_points=min_points)
 
-            # generate and store new update rule
-            one_update_rule = [(tweet_ids_to_update[i], new_info, distances[i], len(all_tweets)) for i in
-                               range(len(tweet_ids_to_update))]
-            mongo_updates.append(one_update_rule)
+        # generate and store new update rule
+        one_update_rule = [(tweet_ids[position], new_info, statistics["distance"][position], len(all_tweets))
+                           for position in cluster_positions]
+        mongo_updates.append(one_update_rule)
 
-            index += 1
+    add_time("cluster info", (datetime.now() - p2_time).total_seconds(), items=len(all_tweets))
 
-        else:
-            # terminate clustering if user tweets have been used up
-            continue_clustering = False
+    # flag dominant cluster once the addresses are known
+    if lookup_addresses:
+        resolve_cluster_addresses(pending_addresses, mongo_address)
+        _flag_dominant_clusters(mongo_updates)
 
     if debug and len(all_tweets) > debug_threshold:
         print(" ** clustering done for %06d tweets in: %s" % (len(all_tweets), datetime.now() - p2_time))
@@ -492,6 +1488,433 @@ def cluster_one_user(user_id,
     return mongo_updates
 
 
+def cluster_document_for_collection(cluster_info,
+                                    total_tweets_for_user):
+    """
+    Document of one cluster for the normalised clusters collection: the cluster info of cluster_one_user with
+    _id, user_id, chunk_id, total_tweets_for_user and dominant flag added.
+
+    :param cluster_info:            Cluster info, as in twitter["cluster"].
+    :param total_tweets_for_user:   Number of tweets of the user.
+    :return:                        Json formatted dictionary for mongodb clusters insert.
+
+    :type cluster_info              dict
+    :type total_tweets_for_user     int
+    :rtype                          dict
+    """
+
+    # cluster ids start with the user_id
+    user_id = int(cluster_info["cluster_id"].split("_", 1)[0])
+
+    cluster_document = dict(cluster_info)
+    cluster_document["_id"] = cluster_info["cluster_id"]
+    cluster_document["user_id"] = user_id
+    cluster_document["chunk_id"] = user_id % 1000
+    cluster_document["total_tweets_for_user"] = int(total_tweets_for_user)
+    cluster_document.setdefault("dominant", 0)
+
+    return cluster_document
+
+
+def write_cluster_updates(mongo_connection,
+                          mongo_updates,
+                          user_totals=None,
+                          batch_size=UPDATE_BATCH_SIZE,
+                          clusters_connection=None,
+                          remove_clusters=None,
+                          acknowledged=False,
+                          dominant_changes=None):
+    """
+    Write the cluster info of clustered tweets to the database. The cluster sub-document and total_tweets_for_user
+    are the same for all tweets of a cluster, so they are written with one multi-document update per cluster.
+    Distances from the centroid are written in a second bulk operation, with one multi-document update per
+    distinct distance in each cluster.
+
+    If clusters_connection is given, then the output is normalised: each cluster is written once to the clusters
+    collection (see cluster_document_for_collection) and tweets only get their cluster_id and distance.
+
+    :param mongo_connection:    Mongodb parameters to database of tweets. [ip, database, collection]
+    :param mongo_updates:       List of update instructions for each user, as returned by cluster_one_user.
+    :param user_totals:         Optional dictionary of {(chunk_id, user_id): total tweets}. These users get their
+                                total_tweets_for_user updated on all of their tweets (or clusters).
+    :param batch_size:          Maximum number of _ids in one update.
+    :param clusters_connection: Optional mongodb parameters to the clusters collection. [ip, database, collection]
+    :param remove_clusters:     Optional query for cluster documents to remove before writing the new ones.
+    :param acknowledged:        If true then writes wait for the server to acknowledge them, so errors are raised.
+    :param dominant_changes:    Optional list of (chunk_id, user_id, cluster_id, dominant) tuples for clusters that
+                                are not rewritten, but their dominant flag has changed.
+    :return:                    Number of tweets updated.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type mongo_updates         list[list[list[tuple]]]
+    :type user_totals           dict[tuple[int, int], int] | None
+    :type batch_size            int
+    :type clusters_connection   list[str] | tuple[str] | None
+    :type remove_clusters       dict | None
+    :type acknowledged          bool
+    :type dominant_changes      list[tuple[int, int, str, int]] | None
+    :rtype                      int
+    """
+
+    # establish connection with server
+    write_concern = 1 if acknowledged else 0
+    destination = pymongo.MongoClient(mongo_connection[0], w=write_concern)[mongo_connection[1]][mongo_connection[2]]
+    normalised = clusters_connection is not None
+
+    # start bulk update objects, order does not matter as every field is only set to one value
+    cluster_updates = destination.initialize_unordered_bulk_op()
+    distance_updates = destination.initialize_unordered_bulk_op()
+    number_of_tweets = 0
+    number_of_operations = [0, 0, 0]
+
+    # cluster documents are written in order, so old ones are removed first
+    if normalised:
+        clusters = pymongo.MongoClient(clusters_connection[0],
+                                       w=write_concern)[clusters_connection[1]][clusters_connection[2]]
+        cluster_documents = clusters.initialize_ordered_bulk_op()
+        if remove_clusters is not None:
+            cluster_documents.find(remove_clusters).remove()
+            number_of_operations[2] += 1
+
+    # update user totals of all tweets (or clusters) of a user
+    if user_totals is not None:
+        for (chunk_id, user_id), total_tweets in user_totals.items():
+            if normalised:
+                cluster_documents.find({"chunk_id": chunk_id, "user_id": user_id}).update(
+                    {"$set": {"total_tweets_for_user": int(total_tweets)}})
+                number_of_operations[2] += 1
+            else:
+                cluster_updates.find({"chunk_id": chunk_id, "user_id": user_id}).update(
+                    {"$set": {"total_tweets_for_user": int(total_tweets)}})
+                number_of_operations[0] += 1
+
+    # set or remove dominant flag of unchanged clusters
+    if dominant_changes is not None:
+        for chunk_id, user_id, cluster_id, dominant in dominant_changes:
+            if normalised:
+                cluster_documents.find({"_id": cluster_id}).update({"$set": {"dominant": dominant}})
+                number_of_operations[2] += 1
+            else:
+                if dominant:
+                    flag_update = {"$set": {"cluster.dominant": 1}}
+                else:
+                    flag_update = {"$unset": {"cluster.dominant": ""}}
+                cluster_updates.find({"chunk_id": chunk_id,
+                                      "user_id": user_id,
+                                      "cluster.cluster_id": cluster_id}).update(flag_update)
+                number_of_operations[0] += 1
+
+    # add each cluster to bulk process
+    for user in mongo_updates:
+        for cluster in user:
+            if len(cluster) == 0:
+                continue
+
+            # shared fields of the cluster
+            if normalised:
+                cluster_documents.find({"_id": cluster[0][1]["cluster_id"]}).upsert().replace_one(
+                    cluster_document_for_collection(cluster[0][1], cluster[0][3]))
+                number_of_operations[2] += 1
+                shared_fields = {"cluster_id": cluster[0][1]["cluster_id"]}
+            else:
+                shared_fields = {"cluster": cluster[0][1],
+                                 "total_tweets_for_user": int(cluster[0][3])}
+
+            tweet_ids = [tweet_info[0] for tweet_info in cluster]
+            for start in range(0, len(tweet_ids), batch_size):
+                cluster_updates.find({"_id": {"$in": tweet_ids[start:start + batch_size]}}).update(
+                    {"$set": shared_fields})
+                number_of_operations[0] += 1
+
+            # group tweets of the cluster by distance
+            ids_by_distance = {}
+            for tweet_info in cluster:
+                ids_by_distance.setdefault(float(tweet_info[2]), []).append(tweet_info[0])
+
+            for distance, distance_ids in ids_by_distance.items():
+                for start in range(0, len(distance_ids), batch_size):
+                    distance_updates.find({"_id": {"$in": distance_ids[start:start + batch_size]}}).update(
+                        {"$set": {"tweet.distance_from_centroid": distance}})
+                    number_of_operations[1] += 1
+
+            number_of_tweets += len(cluster)
+
+    # execute bulk updates
+    if number_of_operations[2] > 0:
+        cluster_documents.execute()
+    if number_of_operations[0] > 0:
+        cluster_updates.execute()
+    if number_of_operations[1] > 0:
+        distance_updates.execute()
+
+    return number_of_tweets
+
+
+def update_user_clusters(user_id,
+                         all_tweets,
+                         old_cluster_ids,
+                         pending_addresses,
+                         eps=20,
+                         min_points=3,
+                         neighbour_method="grid"):
+    """
+    Add new tweets of a user to the existing clusters. New tweets join the clusters they are within eps of,
+    clusters connected by new tweets are merged and the rest of the new tweets form new clusters. Only clusters
+    that have changed are returned. The tweets of the resulting clusters, their counts, centroids and stats are
+    the same as reclustering the user from scratch, but the cluster numbers (and so the cluster_ids) are not:
+    changed clusters keep the smallest cluster number of the clusters they contain, new clusters get numbers after
+    the largest old number and unchanged clusters are never renumbered, as that would rewrite all of their tweets.
+    Recluster the chunk with cluster_one_chunk if the cluster_ids have to match a full run.
+
+    :param user_id:             Twitter user_id.
+    :param all_tweets:          All tweets of the user, old and new. _id, user_id, coordinates tuples
+    :param old_cluster_ids:     cluster_id of each tweet, None for new tweets.
+    :param pending_addresses:   List to collect clusters that need an address, see cluster_one_user.
+    :param eps:                 Distance parameter for naive DBScan clustering.
+    :param min_points:          Minimum number of points in a valid cluster.
+    :param neighbour_method:    Neighbour search method, see neighbour_pairs.
+    :return:                    Update instructions for changed clusters, as in cluster_one_user.
+
+    :type user_id               int
+    :type all_tweets            list[tuple[]]
+    :type old_cluster_ids       list[str | None]
+    :type pending_addresses     list[tuple]
+    :type eps                   int | float
+    :type min_points            int
+    :type neighbour_method      str
+    :rtype                      list[list[]]
+    """
+
+    labels = cluster_labels(all_tweets, eps=eps, method=neighbour_method)
+    number_of_clusters = labels.max() + 1
+
+    # find which old clusters ended up in each new cluster
+    old_clusters_by_label = [set() for x in range(number_of_clusters)]
+    labels_by_old_cluster = {}
+    has_new_tweets = np.zeros(number_of_clusters, dtype=bool)
+    for label, old_cluster_id in zip(labels.tolist(), old_cluster_ids):
+        if old_cluster_id is None:
+            has_new_tweets[label] = True
+        else:
+            old_clusters_by_label[label].add(old_cluster_id)
+            labels_by_old_cluster.setdefault(old_cluster_id, set()).add(label)
+
+    # numbers of old clusters are the last part of cluster_id
+    old_numbers = dict((old_cluster_id, int(old_cluster_id.rsplit("_", 1)[1]))
+                       for old_cluster_id in labels_by_old_cluster.keys())
+    next_number = max(old_numbers.values()) + 1 if len(old_numbers) > 0 else 0
+
+    statistics = cluster_statistics(_tweet_coordinates(all_tweets), labels)
+    by_label = np.argsort(labels, kind="mergesort")
+    cluster_ends = np.cumsum(statistics["count"])
+
+    mongo_updates = []
+    for label, cluster_positions in enumerate(np.split(by_label, cluster_ends[:-1])):
+        old_clusters = old_clusters_by_label[label]
+
+        # skip clusters made of exactly one old cluster without any new tweets
+        if not has_new_tweets[label] and len(old_clusters) == 1 and \
+                len(labels_by_old_cluster[next(iter(old_clusters))]) == 1:
+            continue
+
+        # keep the smallest old number or give a new one
+        if len(old_clusters) > 0:
+            cluster_name = min(old_numbers[old_cluster_id] for old_cluster_id in old_clusters)
+        else:
+            cluster_name = next_number
+            next_number += 1
+
+        new_info = _cluster_document(statistics, label, user_id, cluster_name, pending_addresses,
+                                     min_points=min_points)
+
+        mongo_updates.append([(all_tweets[position][0], new_info, statistics["distance"][position], len(all_tweets))
+                              for position in cluster_positions])
+
+    return mongo_updates
+
+
+def cluster_new_tweets(mongo_connection,
+                       mongo_address,
+                       chunk_id,
+                       eps=20,
+                       min_points=3,
+                       debug=False,
+                       robot_threshold=30000,
+                       neighbour_method="grid",
+                       clusters_collection=None,
+                       track_versions=True):
+    """
+    Incremental version of cluster_one_chunk. Only users with tweets that have no cluster yet are processed
+    and only their changed clusters are updated, see update_user_clusters. Every tweet of these users gets its
+    total_tweets_for_user updated. With normalised output, cluster documents that were merged into other clusters
+    are removed from the clusters collection.
+
+    :param mongo_connection:    Mongodb parameters to database of tweets. [ip, database, collection]
+    :param mongo_address:       Mongodb parameters to address_base. [ip, database, collection]
+    :param chunk_id:            Chunk number.
+    :param eps:                 Distance parameter for naive DBScan clustering.
+    :param min_points:          Minimum number of points in a valid cluster.
+    :param debug:               Boolean for debugging.
+    :param robot_threshold:     Users with more tweets than this are skipped, as in cluster_one_user. Their new
+                                tweets are marked as robot tweets (cluster.type: robot, or cluster_id: null if
+                                output is normalised), so they are not fetched again by the next run.
+    :param neighbour_method:    Neighbour search method, see neighbour_pairs.
+    :param clusters_collection: Name of the clusters collection for normalised output, in the same database as
+                                the tweets. See write_cluster_updates.
+    :param track_versions:      If true then updates are acknowledged and the chunk gets a new version stamp
+                                afterwards, see cluster_one_chunk.
+    :return:                    Number of users updated.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type mongo_address         list[str] | tuple[str]
+    :type chunk_id              int
+    :type eps                   int | float
+    :type min_points            int
+    :type debug                 bool
+    :type robot_threshold       int
+    :type neighbour_method      str
+    :type clusters_collection   str | None
+    :type track_versions        bool
+    :rtype                      int
+    """
+
+    start_time = datetime.now()
+
+    # tweets point to their cluster with the cluster_id field if output is normalised
+    clusters_connection = None
+    cluster_field = "cluster"
+    if clusters_collection is not None:
+        clusters_connection = (mongo_connection[0], mongo_connection[1], clusters_collection)
+        cluster_field = "cluster_id"
+
+    # find users with new tweets
+    source = pymongo.MongoClient(mongo_connection[0])[mongo_connection[1]][mongo_connection[2]]
+    new_users = source.distinct("user_id", {"chunk_id": chunk_id, cluster_field: {"$exists": False}})
+
+    if len(new_users) == 0:
+        print("No new tweets in chunk %04d" % chunk_id)
+        return 0
+
+    # fields of existing clusters needed for the dominant flag
+    cluster_fields = ["cluster_id", "count", "type", "address.classification", "dominant"]
+
+    # grab all tweets of these users, with their current cluster
+    tweets_by_user = {}
+    cluster_ids_by_user = {}
+    old_clusters = {}
+    projection = {"_id": 1, "user_id": 1, "tweet.coordinates": 1, "cluster_id": 1}
+    if clusters_connection is None:
+        projection.update(("cluster." + field, 1) for field in cluster_fields)
+
+    for new_tweet_mongo in source.find({"chunk_id": chunk_id, "user_id": {"$in": new_users}}, projection):
+        user_id = new_tweet_mongo["user_id"]
+        tweets_by_user.setdefault(user_id, []).append([new_tweet_mongo["_id"],
+                                                       user_id,
+                                                       new_tweet_mongo["tweet"]["coordinates"]])
+        if clusters_connection is None:
+            old_cluster_id = new_tweet_mongo.get("cluster", {}).get("cluster_id")
+            if old_cluster_id is not None:
+                old_clusters[old_cluster_id] = new_tweet_mongo["cluster"]
+        else:
+            old_cluster_id = new_tweet_mongo.get("cluster_id")
+        cluster_ids_by_user.setdefault(user_id, []).append(old_cluster_id)
+
+    # with normalised output existing clusters are in their own collection
+    if clusters_connection is not None:
+        clusters = pymongo.MongoClient(clusters_connection[0])[clusters_connection[1]][clusters_connection[2]]
+        for old_cluster in clusters.find({"chunk_id": chunk_id, "user_id": {"$in": new_users}},
+                                         dict((field, 1) for field in cluster_fields)):
+            old_clusters[old_cluster["_id"]] = old_cluster
+
+    # update clusters of each user
+    mongo_updates = []
+    pending_addresses = []
+    user_totals = {}
+    robot_users = []
+    for user_id, all_tweets in tweets_by_user.items():
+        if len(all_tweets) > robot_threshold:
+            print("* * * * * * * Robot found: ", user_id)
+            robot_users.append(user_id)
+            continue
+
+        mongo_updates.append(update_user_clusters(user_id,
+                                                  all_tweets,
+                                                  cluster_ids_by_user[user_id],
+                                                  pending_addresses,
+                                                  eps=eps,
+                                                  min_points=min_points,
+                                                  neighbour_method=neighbour_method))
+        user_totals[(chunk_id, user_id)] = len(all_tweets)
+
+        if debug:
+            print("   user: %d tweets: %d changed clusters: %d" % (user_id, len(all_tweets), len(mongo_updates[-1])))
+
+    resolve_cluster_addresses(pending_addresses, mongo_address)
+
+    # new cluster of each tweet in a changed cluster
+    new_cluster_ids = {}
+    for user in mongo_updates:
+        for cluster in user:
+            for tweet_info in cluster:
+                new_cluster_ids[tweet_info[0]] = cluster[0][1]["cluster_id"]
+
+    all_old_cluster_ids = set()
+    all_used_cluster_ids = set()
+    dominant_changes = []
+    for (user_chunk_id, user_id), user_updates in zip(user_totals.keys(), mongo_updates):
+        # clusters still used by the tweets of the user
+        old_cluster_ids = set(cluster_ids_by_user[user_id]) - {None}
+        used_cluster_ids = set(new_cluster_ids.get(tweet[0], old_cluster_id)
+                               for tweet, old_cluster_id in zip(tweets_by_user[user_id], cluster_ids_by_user[user_id]))
+        all_old_cluster_ids |= old_cluster_ids
+        all_used_cluster_ids |= used_cluster_ids
+
+        # dominant flag over changed and unchanged clusters
+        changed_clusters = [cluster[0][1] for cluster in user_updates if len(cluster) > 0]
+        changed_cluster_ids = set(cluster_info["cluster_id"] for cluster_info in changed_clusters)
+        unchanged_clusters = [old_clusters[cluster_id] for cluster_id in used_cluster_ids & old_cluster_ids
+                              if cluster_id in old_clusters and cluster_id not in changed_cluster_ids]
+        dominant_clusters = [id(x) for x in find_dominant_clusters(changed_clusters + unchanged_clusters)]
+
+        for cluster_info in changed_clusters:
+            if id(cluster_info) in dominant_clusters:
+                cluster_info["dominant"] = 1
+        for cluster_info in unchanged_clusters:
+            dominant = int(id(cluster_info) in dominant_clusters)
+            if dominant != cluster_info.get("dominant", 0):
+                dominant_changes.append((chunk_id, user_id, cluster_info["cluster_id"], dominant))
+
+    # find cluster documents that are not used by any tweet any more
+    remove_clusters = None
+    if clusters_connection is not None:
+        remove_clusters = {"_id": {"$in": list(all_old_cluster_ids - all_used_cluster_ids)}}
+
+    with timer("bulk write") as write_timer:
+        number_of_updates = write_cluster_updates(mongo_connection,
+                                                  mongo_updates,
+                                                  user_totals=user_totals,
+                                                  clusters_connection=clusters_connection,
+                                                  remove_clusters=remove_clusters,
+                                                  dominant_changes=dominant_changes,
+                                                  acknowledged=track_versions)
+        write_timer.items = number_of_updates
+
+    # mark new tweets of robots, otherwise they are selected as new users again in every run
+    if len(robot_users) > 0:
+        robot_marker = {"type": "robot"} if clusters_connection is None else None
+        source.update_many({"chunk_id": chunk_id, "user_id": {"$in": robot_users}, cluster_field: {"$exists": False}},
+                           {"$set": {cluster_field: robot_marker}})
+
+    # invalidate cached results of the chunk, only after the updates have been applied
+    if track_versions:
+        bump_versions(source, [chunk_id], "clustering")
+
+    print("  *******Finished new tweets of %4d at: %s in %s, users: %d, tweets updated: %d" %
+          (chunk_id, datetime.now(), datetime.now() - start_time, len(user_totals), number_of_updates))
+
+    return len(user_totals)
+
+
 def cluster_one_chunk(mongo_connection,
                       mongo_address,
                       chunk_id,
@@ -499,10 +1922,17 @@ def cluster_one_chunk(mongo_connection,
                       debug_user=-1,
                       graph_debug=False,
                       return_csv=False,
-                      sleep_for_cores=True):
+                      sleep_for_cores=True,
+                      neighbour_method="grid",
+                      memory_budget=None,
+                      user_ids=None,
+                      clusters_collection=None,
+                      acknowledged=None,
+                      track_versions=True,
+                      raise_errors=False):
     """
     Cluster all the tweets for one chunk. Update all the tweets in the dictionary and return the number of users
-    in the chunk.
+    in the chunk. The dominant cluster of each user is flagged with dominant: 1, see find_dominant_clusters.
 
     :param mongo_connection:    Mongodb parameters to database of tweets. [ip, database, collection]
     :param mongo_address:       Mongodb parameters to address_base. [ip, database, collection]
@@ -513,7 +1943,25 @@ def cluster_one_chunk(mongo_connection,
     :param return_csv:          If true then returns the complete list of updates that were carried out.
     :param sleep_for_cores:     If true then first 8 cores go to sleep for 30 sec before the process
                                 to allow more spread out mongo accesses in the clustering process.
-    :return:                    Number of users clustered or complete update list (see return_csv)
+    :param neighbour_method:    Neighbour search used for clustering, see cluster_one_user.
+    :param memory_budget:       Memory available for clustering one user in bytes, see cluster_one_user.
+                                Users that don't fit are deferred and returned, they are not updated.
+    :param user_ids:            Optional list of user ids, only these users of the chunk are clustered.
+    :param clusters_collection: Name of the clusters collection for normalised output, in the same database as
+                                the tweets. Previous cluster documents of the clustered users are replaced.
+                                See write_cluster_updates.
+    :param acknowledged:        If true then updates are acknowledged by the server (w=1), if false then they are
+                                not (w=0), see write_cluster_updates. By default (None) updates are acknowledged
+                                exactly when track_versions is true.
+    :param track_versions:      If true then the chunk gets a new version stamp after its updates, so cached
+                                aggregation results of it are invalidated (see chunk_versions). Needs acknowledged
+                                updates, otherwise the stamp could be written before them and stale results could be
+                                cached under the new stamp. Set it to false for the old unacknowledged writes.
+    :param raise_errors:        If true then a chunk that can not be read raises the error, so the caller can record
+                                it (see the run ledger). Otherwise the error is printed and the chunk is skipped.
+    :return:                    Number of users clustered or complete update list (see return_csv).
+                                If memory_budget is given, then a tuple of the number of users clustered
+                                and a list of deferred user ids.
 
     :type mongo_connection      list[str] | tuple[str]
     :type mongo_address         list[str] | tuple[str]
@@ -522,9 +1970,21 @@ def cluster_one_chunk(mongo_connection,
     :type debug_user            int
     :type graph_debug           bool
     :type return_csv            bool
-    :rtype                      int | list[list[]]
+    :type neighbour_method      str
+    :type memory_budget         int | float | None
+    :type user_ids              list[int] | None
+    :type clusters_collection   str | None
+    :type acknowledged          bool | None
+    :type track_versions        bool
+    :type raise_errors          bool
+    :rtype                      int | list[list[]] | tuple[int, list[int]]
     """
 
+    # stamps must not be written before the updates they stand for
+    if acknowledged is None:
+        acknowledged = track_versions
+    assert acknowledged or not track_versions, "version stamps need acknowledged updates, set track_versions=False"
+
     # send to sleep the first few cores.
     if sleep_for_cores and chunk_id <= 8:
         print("core", chunk_id, "going to sleep for a bit...")
@@ -534,14 +1994,27 @@ def cluster_one_chunk(mongo_connection,
     # keep track of performance
     start_time = datetime.now()
 
-    # grab the data
-    tweets_by_user_dict = create_dictionary_for_chunk(mongo_connection, chunk_id=chunk_id)
+    # grab the data, skip the chunk if it can not be read
+    try:
+        with timer("fetch chunk") as fetch_timer:
+            tweets_by_user_dict = fetch_chunk_arrays(mongo_connection, chunk_id=chunk_id, user_ids=user_ids)
+            fetch_timer.items = len(tweets_by_user_dict)
+    except OperationFailure as error:
+        if raise_errors:
+            raise
+        print("* * * * * * * Chunk skipped, could not be read: %04d %s" % (chunk_id, repr(error)))
+        if return_csv:
+            return []
+        return (0, []) if memory_budget is not None else 0
 
     if debug_user >= 0:
         tweets_by_user_dict = {debug_user: tweets_by_user_dict[debug_user]}
 
-    # initialise update holder
+    # initialise update holder, list of users that don't fit into memory and clusters waiting for an address
     mongo_updates = []
+    clustered_users = []
+    deferred_users = []
+    pending_addresses = []
 
     # cluster each user
     for user_id in tweets_by_user_dict.keys():
@@ -549,7 +2022,16 @@ def cluster_one_chunk(mongo_connection,
                                        tweets_by_user=tweets_by_user_dict,
                                        mongo_address=mongo_address,
                                        debug=debug,
-                                       graph_debug=graph_debug)
+                                       graph_debug=graph_debug,
+                                       neighbour_method=neighbour_method,
+                                       memory_budget=memory_budget,
+                                       pending_addresses=pending_addresses)
+
+        # leave users that don't fit into memory for later
+        if new_updates is None:
+            print("* * * * * * * User deferred: ", user_id)
+            deferred_users.append(user_id)
+            continue
 
         # check for robots and if user has too many tweets then keep track of them
         if type(new_updates) == bool:
@@ -560,27 +2042,43 @@ def cluster_one_chunk(mongo_connection,
                 continue
 
         mongo_updates.append(new_updates)
+        clustered_users.append(user_id)
 
-    print("***Starting updates %04d %s %s " % (chunk_id, datetime.now(), mongo_connection))
+    # look up addresses of all clusters in the chunk at once
+    p5_time = datetime.now()
+    number_of_lookups = resolve_cluster_addresses(pending_addresses, mongo_address)
+    print("***Addresses for %04d: %d clusters, %d distinct centroids in %s" % (chunk_id,
+                                                                              len(pending_addresses),
+                                                                              number_of_lookups,
+                                                                              datetime.now() - p5_time))
+    add_time("address lookup", (datetime.now() - p5_time).total_seconds(), items=len(pending_addresses))
 
-    p6_time = datetime.now()
+    # flag the most populous residential cluster of each user
+    number_of_dominant = sum(_flag_dominant_clusters(user_updates) for user_updates in mongo_updates)
+    print("***Dominant clusters for %04d: %d" % (chunk_id, number_of_dominant))
 
-    # establish connection with server
-    destination = pymongo.MongoClient(mongo_connection[0], w=0)[mongo_connection[1]][mongo_connection[2]]
+    print("***Starting updates %04d %s %s " % (chunk_id, datetime.now(), mongo_connection))
 
-    # start bulk update object
-    bulk_updates = destination.initialize_ordered_bulk_op()
+    p6_time = datetime.now()
 
-    # add each user to bulk process
-    for user in mongo_updates:
-        for cluster in user:
-            for tweet_info in cluster:
-                bulk_updates.find({"_id": tweet_info[0]}).update({"$set": {"cluster": tweet_info[1],
-                                                                           "total_tweets_for_user": int(tweet_info[3]),
-                                                                           "tweet.distance_from_centroid": float(
-                                                                               tweet_info[2])}})
-    # execute bulk updates
-    bulk_updates.execute()
+    if clusters_collection is None:
+        number_of_updates = write_cluster_updates(mongo_connection, mongo_updates, acknowledged=acknowledged)
+    else:
+        number_of_updates = write_cluster_updates(mongo_connection,
+                                                  mongo_updates,
+                                                  clusters_connection=(mongo_connection[0],
+                                                                       mongo_connection[1],
+                                                                       clusters_collection),
+                                                  remove_clusters={"chunk_id": chunk_id,
+                                                                   "user_id": {"$in": clustered_users}},
+                                                  acknowledged=acknowledged)
+    add_time("bulk write", (datetime.now() - p6_time).total_seconds(), items=number_of_updates)
+
+    # invalidate cached results of the chunk, only after the updates have been applied
+    if track_versions:
+        bump_versions(pymongo.MongoClient(mongo_connection[0])[mongo_connection[1]][mongo_connection[2]],
+                      [chunk_id],
+                      "clustering")
 
     print("  *******Finished %4d at: %s in %s, updates took: %s" % (chunk_id,
                                                                     datetime.now(),
@@ -590,37 +2088,465 @@ def cluster_one_chunk(mongo_connection,
     if return_csv:
         return mongo_updates
 
+    # send back deferred users as well if memory is limited
+    if memory_budget is not None:
+        return len(tweets_by_user_dict) - len(deferred_users), deferred_users
+
     # send back number users clustered
     return len(tweets_by_user_dict)
 
 
+def count_user_tweets(mongo_connection,
+                      chunk_range=range(1000)):
+    """
+    Count the tweets of every user in the given chunks with a single aggregation.
+
+    :param mongo_connection:    Mongodb parameters to database of tweets. [ip, database, collection]
+    :param chunk_range:         Chunk ids to count.
+    :return:                    Dictionary of {(chunk_id, user_id): number of tweets}
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type chunk_range           range | list[int]
+    :rtype                      dict[tuple[int, int], int]
+    """
+
+    source = pymongo.MongoClient(mongo_connection[0])[mongo_connection[1]][mongo_connection[2]]
+    pipeline = [{"$match": {"chunk_id": {"$in": list(chunk_range)}}},
+                {"$group": {"_id": {"chunk_id": "$chunk_id", "user_id": "$user_id"},
+                            "count": {"$sum": 1}}}]
+
+    user_counts = {}
+    for user_group in source.aggregate(pipeline, allowDiskUse=True):
+        user_counts[(user_group["_id"]["chunk_id"], user_group["_id"]["user_id"])] = user_group["count"]
+
+    return user_counts
+
+
+def create_work_units(user_counts,
+                      num_workers,
+                      units_per_worker=8):
+    """
+    Split users into work units, heaviest first. Users with more tweets than the target unit size form a unit on
+    their own, the rest of the users of a chunk share a single unit. Every chunk is then read by one query for its
+    light users and one for each of its heavy users.
+
+    :param user_counts:         Dictionary of {(chunk_id, user_id): number of tweets}, see count_user_tweets.
+    :param num_workers:         Number of workers the units are going to be shared between.
+    :param units_per_worker:    Target number of units for each worker, sets the size of heavy users.
+    :return:                    List of (number of tweets, chunk_id, [user_ids]) tuples in decreasing size.
+
+    :type user_counts           dict[tuple[int, int], int]
+    :type num_workers           int
+    :type units_per_worker      int
+    :rtype                      list[tuple[int, int, list[int]]]
+    """
+
+    unit_size = max(sum(user_counts.values()) // (num_workers * units_per_worker), 1)
+
+    work_units = []
+    light_units = {}
+    for (chunk_id, user_id), number_of_tweets in sorted(user_counts.items(), key=lambda x: -x[1]):
+        # heavy users go alone
+        if number_of_tweets >= unit_size:
+            work_units.append((number_of_tweets, chunk_id, [user_id]))
+            continue
+
+        # light users join the unit of their chunk
+        unit_tweets, unit_users = light_units.get(chunk_id, (0, []))
+        unit_users.append(user_id)
+        light_units[chunk_id] = (unit_tweets + number_of_tweets, unit_users)
+
+    for chunk_id, (unit_tweets, unit_users) in light_units.items():
+        work_units.append((unit_tweets, chunk_id, unit_users))
+
+    # longest processing time first
+    work_units.sort(key=lambda x: (-x[0], x[1]))
+
+    return work_units
+
+
+def _cluster_work_unit(mongo_connection,
+                       mongo_address,
+                       work_unit,
+                       debug=False,
+                       neighbour_method="grid",
+                       memory_budget=None,
+                       clusters_collection=None):
+    """
+    Cluster the users of one work unit and measure how long it took. Updates are acknowledged, but the chunk is
+    not stamped here, see cluster_heaviest_first. Errors are reported instead of stopping the other units.
+
+    :return:                    Tuple of process id, number of tweets, seconds taken, result of cluster_one_chunk
+                                and the error of the unit (None if it succeeded).
+    :rtype                      tuple[int, int, float, int | tuple[int, list[int]], str | None]
+    """
+
+    start_time = datetime.now()
+    error = None
+    try:
+        result = cluster_one_chunk(mongo_connection,
+                                   mongo_address,
+                                   work_unit[1],
+                                   debug,
+                                   sleep_for_cores=False,
+                                   neighbour_method=neighbour_method,
+                                   memory_budget=memory_budget,
+                                   user_ids=work_unit[2],
+                                   clusters_collection=clusters_collection,
+                                   acknowledged=True,
+                                   track_versions=False,
+                                   raise_errors=True)
+    except (PyMongoError, MemoryError) as unit_error:
+        print("* * * * * * * Work unit failed: %04d %s" % (work_unit[1], repr(unit_error)))
+        error = repr(unit_error)
+        result = (0, []) if memory_budget is not None else 0
+
+    return os.getpid(), work_unit[0], (datetime.now() - start_time).total_seconds(), result, error
+
+
+def cluster_heaviest_first(mongo_connection,
+                           mongo_address,
+                           chunk_range=range(1000),
+                           debug=False,
+                           num_cores=-1,
+                           neighbour_method="grid",
+                           memory_budget=None,
+                           clusters_collection=None,
+                           metrics=None,
+                           ledger_connection=None,
+                           run_id=None):
+    """
+    Cluster all tweets in chunk_range by dispatching work units of users to the workers in decreasing size
+    (longest processing time first), instead of one chunk per worker. Prints how evenly the workers were loaded.
+    If more than one database or address base is supplied, then the work units are spread across them.
+    Once all units are done, each chunk gets one new version stamp and, with a run ledger, one ledger entry: it is
+    complete if all of its units succeeded and failed otherwise.
+
+    :param mongo_connection:    Mongodb parameters to database(s) of tweets. [ip, database, collection]
+    :param mongo_address:       Mongodb parameters to address_base(s). [ip, database, collection]
+    :param chunk_range:         Optional range for chunk ids to cluster.
+    :param debug:               Boolean for debugging.
+    :param num_cores:           Number of workers, as in joblib.
+    :param neighbour_method:    Neighbour search used for clustering, see cluster_one_user.
+    :param memory_budget:       Memory available for clustering one user in bytes, see cluster_one_chunk.
+    :param clusters_collection: Name of the clusters collection for normalised output, see cluster_one_chunk.
+    :param metrics:             If a Metrics object is given, then the metrics of all workers are merged into it.
+    :param ledger_connection:   Optional mongodb parameters to the run ledger, see cluster_all.
+    :param run_id:              Name of the clustering run, if ledger_connection is given.
+    :return:                    List of cluster_one_chunk results for each work unit.
+
+    :type mongo_connection      list | tuple
+    :type mongo_address         list | tuple
+    :type chunk_range           range | list[int]
+    :type debug                 bool
+    :type num_cores             int
+    :type neighbour_method      str
+    :type memory_budget         int | float | None
+    :type clusters_collection   str | None
+    :type metrics               Metrics | None
+    :type ledger_connection     list[str] | tuple[str] | None
+    :type run_id                str | None
+    :rtype                      list[int | tuple[int, list[int]]]
+    """
+
+    # accept single or multiple databases and address bases
+    if type(mongo_connection[0]) is str:
+        mongo_connection = [mongo_connection]
+    if type(mongo_address[0]) is str:
+        mongo_address = [mongo_address]
+
+    # units read the tweets of their users only
+    for one_connection in mongo_connection:
+        pymongo.MongoClient(one_connection[0])[one_connection[1]][one_connection[2]].create_index(
+            [("chunk_id", pymongo.ASCENDING), ("user_id", pymongo.ASCENDING)])
+
+    # build work units from tweet counts
+    start_time = datetime.now()
+    num_workers = num_cores if num_cores > 0 else max(cpu_count() + 1 + num_cores, 1)
+    work_units = create_work_units(count_user_tweets(mongo_connection[0], chunk_range), num_workers)
+    print("\nScheduling %d work units on %d workers, largest: %d tweets, counting took: %s" %
+          (len(work_units), num_workers, work_units[0][0] if len(work_units) > 0 else 0, datetime.now() - start_time))
+
+    chunk_ids = sorted(set(work_unit[1] for work_unit in work_units))
+    if ledger_connection is not None:
+        for chunk_id in chunk_ids:
+            run_ledger.start_chunk(ledger_connection, run_id, chunk_id)
+
+    # free workers always take the next largest unit
+    unit_function = _cluster_work_unit if metrics is None else Instrumented(_cluster_work_unit)
+    unit_results = Parallel(n_jobs=num_cores, batch_size=1)(
+        delayed(unit_function)(mongo_connection[i % len(mongo_connection)],
+                               mongo_address[i % len(mongo_address)],
+                               work_unit,
+                               debug,
+                               neighbour_method=neighbour_method,
+                               memory_budget=memory_budget,
+                               clusters_collection=clusters_collection)
+        for i, work_unit in enumerate(work_units))
+
+    if metrics is not None:
+        unit_results, unit_metrics = split_results(unit_results)
+        metrics.merge(unit_metrics)
+
+    # stamp each chunk once, after all of its units have been acknowledged
+    bump_versions(pymongo.MongoClient(mongo_connection[0][0])[mongo_connection[0][1]][mongo_connection[0][2]],
+                  chunk_ids,
+                  "clustering")
+
+    # record each chunk once in the ledger
+    if ledger_connection is not None:
+        chunk_outcomes = dict((chunk_id, [0, [], 0.0, []]) for chunk_id in chunk_ids)
+        for work_unit, (process_id, number_of_tweets, seconds, result, error) in zip(work_units, unit_results):
+            users, deferred_users = result if type(result) is tuple else (result, [])
+            outcome = chunk_outcomes[work_unit[1]]
+            outcome[0] += users
+            outcome[1] += deferred_users
+            outcome[2] += seconds
+            if error is not None:
+                outcome[3].append(error)
+
+        for chunk_id, (users, deferred_users, seconds, errors) in sorted(chunk_outcomes.items()):
+            if len(errors) > 0:
+                run_ledger.fail_chunk(ledger_connection, run_id, chunk_id, "; ".join(errors))
+            else:
+                run_ledger.complete_chunk(ledger_connection, run_id, chunk_id, users, seconds, deferred_users)
+
+    # report load of each worker
+    worker_load = {}
+    for process_id, number_of_tweets, seconds, result, error in unit_results:
+        load = worker_load.setdefault(process_id, [0, 0, 0.0])
+        load[0] += 1
+        load[1] += number_of_tweets
+        load[2] += seconds
+
+    print("\nWorker load (units, tweets, seconds):")
+    for process_id, load in sorted(worker_load.items()):
+        print("   %8d: %6d %10d %10.1f" % (process_id, load[0], load[1], load[2]))
+    if len(worker_load) > 0:
+        busy_seconds = [load[2] for load in worker_load.values()]
+        print("   max/mean busy time: %.2f" % (max(busy_seconds) / max(np.mean(busy_seconds), 1e-9)))
+
+    return [unit_result[3] for unit_result in unit_results]
+
+
+def _cluster_chunk_with_ledger(ledger_connection,
+                               run_id,
+                               mongo_connection,
+                               mongo_address,
+                               chunk_id,
+                               debug=False,
+                               **kwargs):
+    """
+    Run cluster_one_chunk with acknowledged writes and record it in the run ledger. Errors are recorded in the
+    ledger instead of stopping the whole run, the chunk then counts as 0 users.
+
+    :param ledger_connection:   Mongodb parameters to the ledger collection. [ip, database, collection]
+    :param run_id:              Name of the clustering run.
+    :return:                    Result of cluster_one_chunk.
+    :rtype                      int | tuple[int, list[int]]
+    """
+
+    start_time = datetime.now()
+    run_ledger.start_chunk(ledger_connection, run_id, chunk_id)
+
+    try:
+        result = cluster_one_chunk(mongo_connection,
+                                   mongo_address,
+                                   chunk_id,
+                                   debug,
+                                   acknowledged=True,
+                                   raise_errors=True,
+                                   **kwargs)
+    except (PyMongoError, MemoryError) as error:
+        print("* * * * * * * Chunk failed: %04d %s" % (chunk_id, repr(error)))
+        run_ledger.fail_chunk(ledger_connection, run_id, chunk_id, repr(error))
+        return (0, []) if kwargs.get("memory_budget") is not None else 0
+
+    users, deferred_users = result if type(result) is tuple else (result, [])
+    run_ledger.complete_chunk(ledger_connection, run_id, chunk_id, users,
+                              (datetime.now() - start_time).total_seconds(), deferred_users)
+
+    return result
+
+
+def _cluster_deferred_with_ledger(ledger_connection,
+                                  run_id,
+                                  mongo_connection,
+                                  mongo_address,
+                                  chunk_id,
+                                  debug=False,
+                                  **kwargs):
+    """
+    Cluster the deferred users of a chunk and record it in the run ledger, see _cluster_chunk_with_ledger.
+
+    :return:                    Number of users clustered.
+    :rtype                      int
+    """
+
+    start_time = datetime.now()
+
+    try:
+        users = cluster_one_chunk(mongo_connection,
+                                  mongo_address,
+                                  chunk_id,
+                                  debug,
+                                  acknowledged=True,
+                                  raise_errors=True,
+                                  **kwargs)
+    except (PyMongoError, MemoryError) as error:
+        print("* * * * * * * Deferred users failed: %04d %s" % (chunk_id, repr(error)))
+        run_ledger.fail_chunk(ledger_connection, run_id, chunk_id, repr(error), deferred=True)
+        return 0
+
+    run_ledger.complete_deferred(ledger_connection, run_id, chunk_id, users,
+                                 (datetime.now() - start_time).total_seconds())
+
+    return users
+
+
 def cluster_all(mongo_connection,
                 mongo_address,
                 chunk_range=range(1000),
                 parallel=True,
                 debug=False,
-                num_cores=-1):
+                num_cores=-1,
+                neighbour_method="grid",
+                memory_budget=None,
+                deferred_cores=1,
+                incremental=False,
+                schedule="chunk",
+                clusters_collection=None,
+                run_id=None,
+                retry_chunks=None,
+                ledger_collection="cluster_runs",
+                metrics_file=None):
     """
     Cluster all tweets found in collection.
 
     :param mongo_connection:    List of mongo parameters to database of tweets. [ip, database, collection]
     :param mongo_address:       List of mongo parameters to address_base(s). [ip, database, collection]
     :param chunk_range:         Optional range for chunk ids to cluster.
+    :param neighbour_method:    Neighbour search used for clustering, see cluster_one_user.
+    :param memory_budget:       Memory available to each worker for clustering one user in bytes.
+                                Users that don't fit are deferred and clustered at the end with no
+                                memory limit, using only deferred_cores workers.
+    :param deferred_cores:      Number of workers for clustering deferred users.
+    :param incremental:         If true then only tweets without a cluster are clustered into the existing
+                                clusters, see cluster_new_tweets. Only the first database and address base are used.
+    :param schedule:            "chunk" to give each worker one chunk at a time, or "heaviest_first" to dispatch
+                                work units of users in decreasing size, see cluster_heaviest_first.
+    :param clusters_collection: Name of the clusters collection for normalised output: clusters are written once
+                                to this collection and tweets only get their cluster_id and distance.
+                                See write_cluster_updates, summaries and cluster_queries for analytics on it.
+    :param run_id:              Optional name of the run. If given, then every chunk is recorded in the run ledger
+                                (see run_ledger) and only marked complete once its updates are acknowledged.
+                                Rerunning with the same run_id skips the completed chunks and finishes the
+                                deferred users that are still pending. With the heaviest_first schedule a chunk
+                                is complete once all of its work units are, see cluster_heaviest_first.
+    :param retry_chunks:        Optional list of chunk ids to rerun in the run, e.g. run_ledger.failed_chunks.
+                                Replaces chunk_range.
+    :param ledger_collection:   Name of the ledger collection, in the first database of tweets.
+    :param metrics_file:        If given then timings of the fetch chunk, build neighbours, label, cluster info,
+                                address lookup and bulk write stages are collected from all workers and written
+                                to this json file, see metrics.py.
     :return:                    Number of users clustered.
 
     :type mongo_address         list | tuple
     :type mongo_connection      list | tuple
+    :type neighbour_method      str
+    :type memory_budget         int | float | None
+    :type deferred_cores        int
+    :type incremental           bool
+    :type schedule              str
+    :type clusters_collection   str | None
+    :type run_id                str | None
+    :type retry_chunks          list[int] | None
+    :type ledger_collection     str
+    :type metrics_file          str | None
     :rtype                      int
     """
 
+    start_time = datetime.now()
+    run_metrics = None if metrics_file is None else Metrics()
+
+    # add new tweets to existing clusters
+    if incremental:
+        if type(mongo_address[0]) is not str:
+            mongo_address = mongo_address[0]
+        if type(mongo_connection[0]) is not str:
+            mongo_connection = mongo_connection[0]
+
+        new_tweets_function = cluster_new_tweets if run_metrics is None else Instrumented(cluster_new_tweets)
+        all_users = Parallel(n_jobs=num_cores if parallel else 1)(delayed(new_tweets_function)(
+            mongo_connection,
+            mongo_address,
+            index_num,
+            debug=debug,
+            neighbour_method=neighbour_method,
+            clusters_collection=clusters_collection)
+            for index_num in chunk_range)
+
+        if run_metrics is not None:
+            all_users, run_metrics = split_results(all_users)
+            write_report(run_metrics, metrics_file, "incremental clustering", start_time)
+
+        return sum(all_users)
+
+    assert schedule in ("chunk", "heaviest_first"), "schedule must be chunk or heaviest_first"
+
+    # index cluster documents by user for replacing them
+    if clusters_collection is not None:
+        for one_connection in ([mongo_connection] if type(mongo_connection[0]) is str else mongo_connection):
+            pymongo.MongoClient(one_connection[0])[one_connection[1]][clusters_collection].create_index(
+                [("chunk_id", pymongo.ASCENDING), ("user_id", pymongo.ASCENDING)])
+
+    # keep track of finished chunks in the run ledger
+    chunk_function = cluster_one_chunk
+    deferred_function = cluster_one_chunk
+    ledger_connection = None
+    if run_id is not None:
+        first_connection = mongo_connection if type(mongo_connection[0]) is str else mongo_connection[0]
+        ledger_connection = (first_connection[0], first_connection[1], ledger_collection)
+        chunk_function = partial(_cluster_chunk_with_ledger, ledger_connection, run_id)
+        deferred_function = partial(_cluster_deferred_with_ledger, ledger_connection, run_id)
+
+        # skip completed chunks
+        if retry_chunks is not None:
+            chunk_range = list(retry_chunks)
+        else:
+            finished_chunks = run_ledger.completed_chunks(ledger_connection, run_id)
+            chunk_range = [chunk_id for chunk_id in chunk_range if chunk_id not in finished_chunks]
+            print("\nRun %s: skipping %d completed chunks" % (run_id, len(finished_chunks)))
+
+    # workers send back their metrics with their results
+    heaviest_first = parallel and schedule == "heaviest_first"
+    if run_metrics is not None:
+        chunk_function = Instrumented(chunk_function)
+        deferred_function = Instrumented(deferred_function)
+
     # decide on parallel mongodb lookup
-    if parallel:
+    if heaviest_first:
+        all_users = cluster_heaviest_first(mongo_connection,
+                                           mongo_address,
+                                           chunk_range,
+                                           debug,
+                                           num_cores=num_cores,
+                                           neighbour_method=neighbour_method,
+                                           memory_budget=memory_budget,
+                                           clusters_collection=clusters_collection,
+                                           metrics=run_metrics,
+                                           ledger_connection=ledger_connection,
+                                           run_id=run_id)
+    elif parallel:
         # check whether more than one address base is supplied
         if type(mongo_address[0]) is str:
-            all_users = Parallel(n_jobs=num_cores)(delayed(cluster_one_chunk)(mongo_connection,
-                                                                              mongo_address,
-                                                                              index_num,
-                                                                              debug)
+            all_users = Parallel(n_jobs=num_cores)(delayed(chunk_function)(mongo_connection,
+                                                                           mongo_address,
+                                                                           index_num,
+                                                                           debug,
+                                                                           neighbour_method=neighbour_method,
+                                                                           memory_budget=memory_budget,
+                                                                           clusters_collection=clusters_collection)
                                                    for index_num in chunk_range)
         else:
             # verbose
@@ -645,15 +2571,18 @@ def cluster_all(mongo_connection,
                 i += 1
 
             # call parallel clustering with multiple address bases
-            all_users = Parallel(n_jobs=num_cores)(delayed(cluster_one_chunk)(param_collection[0],
-                                                                              param_collection[1],
-                                                                              param_collection[2],
-                                                                              debug)
+            all_users = Parallel(n_jobs=num_cores)(delayed(chunk_function)(param_collection[0],
+                                                                           param_collection[1],
+                                                                           param_collection[2],
+                                                                           debug,
+                                                                           neighbour_method=neighbour_method,
+                                                                           memory_budget=memory_budget,
+                                                                           clusters_collection=clusters_collection)
                                                    for param_collection in mongo_chunk_iter)
     # if clustering is not to be run in parallel then do a simple clustering
     else:
         print("doing it in serial")
-        all_users = 0
+        all_users = []
 
         # warn user that only first address base will be used
         if type(mongo_address[0]) is not str:
@@ -662,12 +2591,276 @@ def cluster_all(mongo_connection,
 
         # cluster all the chunks
         for index_num in chunk_range:
-            all_users += cluster_one_chunk(mongo_connection,
-                                           mongo_address,
-                                           index_num,
-                                           debug)
+            all_users.append(chunk_function(mongo_connection,
+                                            mongo_address,
+                                            index_num,
+                                            debug,
+                                            neighbour_method=neighbour_method,
+                                            memory_budget=memory_budget,
+                                            clusters_collection=clusters_collection))
+
+    if run_metrics is not None and not heaviest_first:
+        all_users, chunk_metrics = split_results(all_users)
+        run_metrics.merge(chunk_metrics)
+
+    # cluster deferred users with no memory limit on a few workers only
+    if memory_budget is not None or ledger_connection is not None:
+        deferred_by_chunk = {}
+        if memory_budget is not None:
+            for chunk_result in all_users:
+                for user_id in chunk_result[1]:
+                    deferred_by_chunk.setdefault(user_id % 1000, []).append(user_id)
+
+            all_users = [chunk_result[0] for chunk_result in all_users]
+
+        # the ledger also knows about deferred users of earlier attempts
+        if ledger_connection is not None:
+            deferred_by_chunk = run_ledger.pending_deferred_users(ledger_connection, run_id)
+
+        if len(deferred_by_chunk) > 0:
+            print("\nClustering %d deferred users on %d cores: %s" % (sum(len(x) for x in deferred_by_chunk.values()),
+                                                                      deferred_cores,
+                                                                      datetime.now()))
+
+            # deferred users use the first database and address base
+            if type(mongo_address[0]) is not str:
+                mongo_address = mongo_address[0]
+            if type(mongo_connection[0]) is not str:
+                mongo_connection = mongo_connection[0]
+
+            deferred_users = Parallel(n_jobs=deferred_cores)(delayed(deferred_function)(
+                mongo_connection,
+                mongo_address,
+                chunk_id,
+                debug,
+                sleep_for_cores=False,
+                neighbour_method="grid",
+                user_ids=user_ids,
+                clusters_collection=clusters_collection)
+                for chunk_id, user_ids in sorted(deferred_by_chunk.items()))
+
+            if run_metrics is not None:
+                deferred_users, deferred_metrics = split_results(deferred_users)
+                run_metrics.merge(deferred_metrics)
+            all_users += deferred_users
 
-            # create list so that sum will work
-            all_users = [0, all_users]
+    if ledger_connection is not None:
+        run_ledger.run_report(ledger_connection, run_id)
+
+    if run_metrics is not None:
+        write_report(run_metrics, metrics_file, "clustering", start_time)
 
     return sum(all_users)
+
+
+def _size_quantile(size_distribution,
+                   quantile):
+    """
+    Quantile of cluster sizes from a {size: number of clusters} distribution.
+
+    :rtype  int
+    """
+
+    if len(size_distribution) == 0:
+        return 0
+
+    sizes = sorted(size_distribution.keys())
+    cumulative_clusters = np.cumsum([size_distribution[size] for size in sizes])
+    position = np.searchsorted(cumulative_clusters, quantile * cumulative_clusters[-1])
+
+    return sizes[min(position, len(sizes) - 1)]
+
+
+def _empty_sweep_summary():
+    # summary statistics of one setting before any user is added, see sweep_one_chunk
+    return {"users": 0, "tweets": 0, "users_with_clusters": 0, "clusters": 0, "noise_clusters": 0,
+            "clustered_tweets": 0, "dominant_users": 0, "size_distribution": {}}
+
+
+def sweep_one_chunk(mongo_connection,
+                    mongo_address,
+                    chunk_id,
+                    eps_values,
+                    min_points_values,
+                    robot_threshold=30000,
+                    neighbour_method="grid",
+                    lookup_addresses=True):
+    """
+    Cluster one chunk with every combination of eps and min_points and return summary statistics for each setting,
+    without updating the tweets. The neighbours of each user are searched only once, see cluster_labels_sweep.
+    A user counts as having a dominant cluster if at least one of their clusters has a residential address.
+    Addresses of identical centroids are only looked up once across all settings.
+
+    :param mongo_connection:    Mongodb parameters to database of tweets. [ip, database, collection]
+    :param mongo_address:       Mongodb parameters to address_base. [ip, database, collection]
+    :param chunk_id:            Chunk number.
+    :param eps_values:          Distance parameters to try.
+    :param min_points_values:   Minimum number of points in a valid cluster to try.
+    :param robot_threshold:     Users with more tweets than this are skipped, as in cluster_one_user.
+    :param neighbour_method:    Neighbour search method, see neighbour_pairs.
+    :param lookup_addresses:    If false then addresses are not looked up and dominant_users are all 0.
+    :return:                    Dictionary of {(eps, min_points): summary dictionary}, see sweep_all.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type mongo_address         list[str] | tuple[str]
+    :type chunk_id              int
+    :type eps_values            list[int | float]
+    :type min_points_values     list[int]
+    :type robot_threshold       int
+    :type neighbour_method      str
+    :type lookup_addresses      bool
+    :rtype                      dict[tuple, dict]
+    """
+
+    start_time = datetime.now()
+    tweets_by_user = fetch_chunk_arrays(mongo_connection, chunk_id=chunk_id)
+    smallest_cluster = min(min_points_values)
+
+    # cluster sizes and centroids of possible real clusters of every user for each eps
+    user_clusters = []
+    for user_id in tweets_by_user.keys():
+        all_tweets = tweets_by_user[user_id]
+        if len(all_tweets) > robot_threshold:
+            continue
+
+        coordinates = _tweet_coordinates(all_tweets)
+        clusters_by_eps = {}
+        for eps, labels in cluster_labels_sweep(all_tweets, eps_values, method=neighbour_method).items():
+            statistics = cluster_statistics(coordinates, labels)
+            possible_clusters = statistics["count"] >= smallest_cluster
+            clusters_by_eps[eps] = (statistics["count"],
+                                    [(float(centroid[0]), float(centroid[1]))
+                                     for centroid in statistics["centroid"][possible_clusters]])
+        user_clusters.append(clusters_by_eps)
+
+    # look up residential status of distinct centroids
+    residential = {}
+    if lookup_addresses:
+        for clusters_by_eps in user_clusters:
+            for counts, centroids in clusters_by_eps.values():
+                for centroid in centroids:
+                    residential[centroid] = False
+
+        address_base = _connect_address_base(mongo_address)
+        for centroid in residential.keys():
+            residential[centroid] = _is_residential(_find_cluster_address(centroid, address_base, mongo_address)[0])
+
+    # summarise each setting
+    summaries = {}
+    for eps in eps_values:
+        for min_points in min_points_values:
+            summary = _empty_sweep_summary()
+
+            for clusters_by_eps in user_clusters:
+                counts, centroids = clusters_by_eps[eps]
+                real_counts = counts[counts >= min_points]
+                real_centroids = [centroid for centroid, count in zip(centroids, counts[counts >= smallest_cluster])
+                                  if count >= min_points]
+
+                summary["users"] += 1
+                summary["tweets"] += int(counts.sum())
+                summary["users_with_clusters"] += int(len(real_counts) > 0)
+                summary["clusters"] += len(real_counts)
+                summary["noise_clusters"] += len(counts) - len(real_counts)
+                summary["clustered_tweets"] += int(real_counts.sum())
+                summary["dominant_users"] += int(any(residential.get(centroid, False) for centroid in real_centroids))
+                for size in real_counts.tolist():
+                    summary["size_distribution"][size] = summary["size_distribution"].get(size, 0) + 1
+
+            summaries[(eps, min_points)] = summary
+
+    print("  *******Finished sweep of %4d at: %s in %s, users: %d, centroids looked up: %d" %
+          (chunk_id, datetime.now(), datetime.now() - start_time, len(user_clusters), len(residential)))
+
+    return summaries
+
+
+def sweep_all(mongo_connection,
+              mongo_address,
+              eps_values,
+              min_points_values,
+              chunk_range=range(1000),
+              num_cores=-1,
+              output_file="data/output/cluster_sweep.csv",
+              distribution_file=None,
+              neighbour_method="grid",
+              lookup_addresses=True):
+    """
+    Sweep over combinations of eps and min_points on all chunks without updating the tweets. Writes one row of
+    summary statistics per setting to output_file: number of users, clusters, noise clusters, share of tweets in
+    clusters, cluster size quantiles and the rate of users with a dominant (residential) cluster.
+
+    :param mongo_connection:    Mongodb parameters to database of tweets. [ip, database, collection]
+    :param mongo_address:       Mongodb parameters to address_base. [ip, database, collection]
+    :param eps_values:          Distance parameters to try.
+    :param min_points_values:   Minimum number of points in a valid cluster to try.
+    :param chunk_range:         Optional range for chunk ids to sweep.
+    :param num_cores:           Number of workers, as in joblib.
+    :param output_file:         Csv file for the summary of each setting.
+    :param distribution_file:   Optional csv file for the full cluster size distribution of each setting.
+    :param neighbour_method:    Neighbour search method, see neighbour_pairs.
+    :param lookup_addresses:    If false then addresses are not looked up, see sweep_one_chunk.
+    :return:                    Dictionary of {(eps, min_points): summary dictionary} for all chunks.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type mongo_address         list[str] | tuple[str]
+    :type eps_values            list[int | float]
+    :type min_points_values     list[int]
+    :type chunk_range           range | list[int]
+    :type num_cores             int
+    :type output_file           str
+    :type distribution_file     str | None
+    :type neighbour_method      str
+    :type lookup_addresses      bool
+    :rtype                      dict[tuple, dict]
+    """
+
+    chunk_summaries = Parallel(n_jobs=num_cores)(delayed(sweep_one_chunk)(mongo_connection,
+                                                                          mongo_address,
+                                                                          chunk_id,
+                                                                          eps_values,
+                                                                          min_points_values,
+                                                                          neighbour_method=neighbour_method,
+                                                                          lookup_addresses=lookup_addresses)
+                                                 for chunk_id in chunk_range)
+
+    # add up chunks, every setting gets a row even if there are no chunks
+    summaries = dict(((eps, min_points), _empty_sweep_summary()) for eps in eps_values
+                     for min_points in min_points_values)
+    for one_chunk in chunk_summaries:
+        for setting, summary in one_chunk.items():
+            for key, value in summary.items():
+                if key == "size_distribution":
+                    for size, clusters in value.items():
+                        summaries[setting][key][size] = summaries[setting][key].get(size, 0) + clusters
+                else:
+                    summaries[setting][key] += value
+
+    # one row per setting
+    with open(output_file, 'w', newline="\n") as outfile:
+        writer = csv.writer(outfile, delimiter=",")
+        writer.writerow(["eps", "min_points", "users", "users_with_clusters", "clusters", "noise_clusters",
+                         "clustered_tweets_rate", "mean_cluster_size", "median_cluster_size", "p90_cluster_size",
+                         "max_cluster_size", "dominant_users", "dominant_rate"])
+        for (eps, min_points), summary in sorted(summaries.items()):
+            writer.writerow([eps, min_points, summary["users"], summary["users_with_clusters"], summary["clusters"],
+                             summary["noise_clusters"],
+                             "%.4f" % (summary["clustered_tweets"] / max(summary["tweets"], 1)),
+                             "%.2f" % (summary["clustered_tweets"] / max(summary["clusters"], 1)),
+                             _size_quantile(summary["size_distribution"], 0.5),
+                             _size_quantile(summary["size_distribution"], 0.9),
+                             max(summary["size_distribution"].keys()) if summary["clusters"] > 0 else 0,
+                             summary["dominant_users"],
+                             "%.4f" % (summary["dominant_users"] / max(summary["users"], 1))])
+
+    if distribution_file is not None:
+        with open(distribution_file, 'w', newline="\n") as outfile:
+            writer = csv.writer(outfile, delimiter=",")
+            writer.writerow(["eps", "min_points", "cluster_size", "clusters"])
+            for (eps, min_points), summary in sorted(summaries.items()):
+                for size, clusters in sorted(summary["size_distribution"].items()):
+                    writer.writerow([eps, min_points, size, clusters])
+
+    print("\nSweep finished at: %s, results written to: %s" % (datetime.now(), output_file))
+
+    return summaries
@@ -0,0 +1,54 @@
+"""
+Description:    Analytics queries for the normalised output of the clustering, where every cluster is stored once
+                in a clusters collection and tweets only keep their cluster_id and distance from the centroid.
+                Counts of clusters by size and address type are shared with the summary tables, see
+                summaries.cluster_size_distribution and summaries.address_type_counts with a chunk_id.
+                Statistics by user and month come from summaries.summarise_all with clusters_connection.
+                dominant_languages needs tweet fields that the summaries do not keep, so it reads the cluster ids
+                from the clusters collection first and then aggregates only the matching tweets.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+from ons_twitter.summaries import _collection
+
+
+def dominant_languages(clusters_connection,
+                       tweets_connection,
+                       chunk_id):
+    """
+    Languages used by each user with a dominant cluster and the local authority of that cluster,
+    as in in_development/languages.py.
+
+    :param clusters_connection: Mongodb parameters to the clusters collection. [ip, database, collection]
+    :param tweets_connection:   Mongodb parameters to the tweets collection. [ip, database, collection]
+    :param chunk_id:            Chunk number.
+    :return:                    List of dictionaries with cluster_id, user_id, oslaua and the sorted
+                                languages joined by "_".
+
+    :type clusters_connection   list[str] | tuple[str]
+    :type tweets_connection     list[str] | tuple[str]
+    :type chunk_id              int
+    :rtype                      list[dict]
+    """
+
+    # dominant clusters from the small collection
+    dominant_clusters = dict((cluster["_id"], cluster) for cluster in _collection(clusters_connection).find(
+        {"chunk_id": chunk_id, "dominant": 1}, {"user_id": 1, "address.levels.oslaua": 1}))
+
+    if len(dominant_clusters) == 0:
+        return []
+
+    languages = _collection(tweets_connection).aggregate(
+        [{"$match": {"chunk_id": chunk_id, "cluster_id": {"$in": list(dominant_clusters.keys())}}},
+         {"$group": {"_id": "$cluster_id", "languages": {"$addToSet": "$tweet.language"}}}])
+
+    results = []
+    for one_cluster in languages:
+        cluster = dominant_clusters[one_cluster["_id"]]
+        results.append({"cluster_id": one_cluster["_id"],
+                        "user_id": cluster["user_id"],
+                        "oslaua": cluster["address"]["levels"]["oslaua"],
+                        "languages": "_".join(sorted(one_cluster["languages"]))})
+
+    return results
@@ -524,6 +524,10 @@ class AddressBase(object):
         return self.file_names
 
 
+# transformation from WGS84 to OSGB, built on first use by lat_long_to_osgb
+_osgb_transform = None
+
+
 def lat_long_to_osgb(lat_long):
     """
     Convert latitude, longitude coordinates to UK easting, northing coordinates.
@@ -535,26 +539,29 @@ def lat_long_to_osgb(lat_long):
     :rtype              list
     """
 
+    global _osgb_transform
+
     lat = lat_long[0]
     lng = lat_long[1]
 
-    # Source is WSG84 (lat, lng) i.e. EPSG 4326:
-    source = osr.SpatialReference()
-    source.ImportFromEPSG(4326)
+    # Prepare transformer once for each process, building it takes much longer than transforming one point
+    if _osgb_transform is None:
+        # Source is WSG84 (lat, lng) i.e. EPSG 4326:
+        source = osr.SpatialReference()
+        source.ImportFromEPSG(4326)
 
-    # Target is osgb i.e. EPSG 27700:
-    target = osr.SpatialReference()
-    target.ImportFromEPSG(27700)
+        # Target is osgb i.e. EPSG 27700:
+        target = osr.SpatialReference()
+        target.ImportFromEPSG(27700)
 
-    # Prepare transformer
-    transform = osr.CoordinateTransformation(source, target)
+        _osgb_transform = osr.CoordinateTransformation(source, target)
 
     # Create source point - coords are X, Y i.e. lng, lat:
     point = ogr.Geometry(ogr.wkbPoint)
     point.AddPoint(lng, lat)
 
     # Now transform coordinates to target coord system:
-    point.Transform(transform)
+    point.Transform(_osgb_transform)
 
     # Return point as an (X, Y) tuple i.e. (easting, northing):
     return [int(point.GetX()), int(point.GetY())]
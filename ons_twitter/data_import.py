@@ -10,13 +10,17 @@ from os import listdir, system
 from csv import reader, writer, QUOTE_NONNUMERIC
 from datetime import datetime
 from json import dump, loads
+from time import perf_counter
 
 from pymongo.errors import DuplicateKeyError
 import pymongo
 import numpy as np
 from joblib import Parallel, delayed
 
+from ons_twitter.chunk_versions import bump_versions
 from ons_twitter.data_formats import Tweet
+from ons_twitter.metrics import Instrumented, add_time, split_results, write_report
+from ons_twitter.robots import RobotSketch, merge_sketches, write_candidates
 from ons_twitter.supporting_functions import *
 
 
@@ -25,7 +29,11 @@ def import_files(source,
                  mongo_address,
                  header=False,
                  debug=False,
-                 print_progress=0):
+                 print_progress=0,
+                 detect_robots=False,
+                 robots_file="data/output/robot_candidates.csv",
+                 robot_registry=None,
+                 metrics_file=None):
     """
     Function imports a list of csv files containing tweets into mongodb database. For each tweet, the function finds
     its closest address point (within 300m) and then creates a dictionary of tweet information. This information is
@@ -41,8 +49,15 @@ def import_files(source,
     :param header:              True if csv files have header rows that need to be ignored.
     :param debug:               True for debug statements . Will only import first 5 tweets from each file.
     :param print_progress:      Integer specifying intensity of verbosity. (Print at this many lines.)
+    :param detect_robots:       If true then every file keeps a sketch of user activity. These are merged at the end
+                                and users that look like robots are written to robots_file, see robots.py.
+    :param robots_file:         Location of csv file for ranked robot candidates.
+    :param robot_registry:      Set of user_ids of known robots, see robots.load_robot_registry. Their tweets are
+                                not imported but dumped to "output/errors/robots".
+    :param metrics_file:        If given then timings of the parse, address lookup and insert stages are
+                                collected from all workers and written to this json file, see metrics.py.
     :return:                    Aggregated results from all files imported.
-                                Imported/Non_Geo/Non_GB/Failed/converted/no address/mongo_errors
+                                Imported/Non_Geo/Non_GB/Failed/converted/no address/duplicates/mongo_errors/robots
 
     :type source                str
     :type mongo_connection      list or tuple
@@ -50,12 +65,19 @@ def import_files(source,
     :type header                bool
     :type debug                 bool
     :type print_progress        int
+    :type detect_robots         bool
+    :type robots_file           str
+    :type robot_registry        None | set[int] | frozenset[int]
+    :type metrics_file          None | str
     :rtype                      np.ndarray
     """
 
     # capture start_time
     start_time = datetime.now()
 
+    # workers send back their metrics with their results
+    import_function = import_one_file if metrics_file is None else Instrumented(import_one_file)
+
     # check if source is a directory or file
     file_list_end = []
     try:
@@ -72,12 +94,14 @@ def import_files(source,
             print("more than one address database is supplied for a single file!\nUsing only the first.")
             mongo_address = mongo_address[1]
 
-        aggregated_results = import_one_file(source,
-                                             mongo_connection=mongo_connection,
-                                             mongo_address=mongo_address,
-                                             header=header,
-                                             debug=debug,
-                                             print_progress=print_progress)
+        results = [import_function(source,
+                                   mongo_connection=mongo_connection,
+                                   mongo_address=mongo_address,
+                                   header=header,
+                                   debug=debug,
+                                   print_progress=print_progress,
+                                   detect_robots=detect_robots,
+                                   robot_registry=robot_registry)]
     else:
         # process contents of folder using joblib in parallel
 
@@ -86,13 +110,15 @@ def import_files(source,
 
         # decide on parallel mongodb lookup
         if type(mongo_address[0]) is str:
-            results = Parallel(n_jobs=-1)(delayed(import_one_file)(filename,
+            results = Parallel(n_jobs=-1)(delayed(import_function)(filename,
                                                                    mongo_connection,
                                                                    mongo_address,
                                                                    header,
                                                                    debug,
                                                                    None,
-                                                                   print_progress) for filename in file_list)
+                                                                   print_progress,
+                                                                   detect_robots,
+                                                                   robot_registry) for filename in file_list)
         else:
             # verbose
             print("\nMore than one address base were supplied!",
@@ -113,16 +139,28 @@ def import_files(source,
                 i += 1
 
             # call parallel
-            results = Parallel(n_jobs=-1)(delayed(import_one_file)(param[0],
+            results = Parallel(n_jobs=-1)(delayed(import_function)(param[0],
                                                                    mongo_connection,
                                                                    param[1],
                                                                    header,
                                                                    debug,
                                                                    None,
-                                                                   print_progress) for param in mongo_chunk_iter)
+                                                                   print_progress,
+                                                                   detect_robots,
+                                                                   robot_registry) for param in mongo_chunk_iter)
+
+    # separate metrics from results
+    if metrics_file is not None:
+        results, run_metrics = split_results(results)
+        write_report(run_metrics, metrics_file, "import", start_time)
+
+    # separate robot sketches from statistics
+    if detect_robots:
+        sketches = [one_result[1] for one_result in results]
+        results = [one_result[0] for one_result in results]
 
-        # count up all the results
-        aggregated_results = np.sum(results, axis=0)
+    # count up all the results
+    aggregated_results = np.sum(results, axis=0)
 
     # print stats
     print("\n **** \nImporting finished!", datetime.now(), "\n * Imported tweets: ", str(aggregated_results[0]),
@@ -133,9 +171,16 @@ def import_files(source,
           "\n * No address found: ", str(aggregated_results[5]),
           "\n * Duplicates: ", str(aggregated_results[6]),
           "\n * Mongo Errors: ", str(aggregated_results[7]),
+          "\n * Robot tweets: ", str(aggregated_results[8]),
           "\n\n Total time: ", datetime.now() - start_time,
           "\n *****")
 
+    # rank robot candidates from all files
+    if detect_robots:
+        candidates = merge_sketches(sketches).candidates()
+        write_candidates(candidates, robots_file)
+        print("\n * Robot candidates: %d written to %s" % (len(candidates), robots_file))
+
     return aggregated_results
 
 
@@ -145,7 +190,9 @@ def import_one_file(file_name,
                     header=False,
                     debug=False,
                     debug_rows=None,
-                    print_progress=0):
+                    print_progress=0,
+                    detect_robots=False,
+                    robot_registry=None):
     """
     Wrapper function for import_one_csv and import_one_json. Picks up file extension and decides
     which function to use. For parameters see any of the two functions.
@@ -157,7 +204,9 @@ def import_one_file(file_name,
     :type debug                 bool
     :type debug_rows            None or int
     :type print_progress        int
-    :rtype                      np.ndarray
+    :type detect_robots         bool
+    :type robot_registry        None | set[int] | frozenset[int]
+    :rtype                      np.ndarray | tuple
     """
 
     # grab file extension
@@ -170,7 +219,9 @@ def import_one_file(file_name,
                                mongo_address,
                                debug=debug,
                                debug_rows=debug_rows,
-                               print_progress=print_progress)
+                               print_progress=print_progress,
+                               detect_robots=detect_robots,
+                               robot_registry=robot_registry)
     elif file_end == ".csv":
         return import_one_csv(file_name,
                               mongo_connection,
@@ -178,10 +229,14 @@ def import_one_file(file_name,
                               header=header,
                               debug=debug,
                               debug_rows=debug_rows,
-                              print_progress=print_progress)
+                              print_progress=print_progress,
+                              detect_robots=detect_robots,
+                              robot_registry=robot_registry)
     else:
         print("File extension is invalid, skipping %s" % file_name)
-        return np.zeros(8, dtype="int")
+        if detect_robots:
+            return np.zeros(9, dtype="int"), None
+        return np.zeros(9, dtype="int")
 
 
 def import_one_csv(csv_file_name,
@@ -190,7 +245,9 @@ def import_one_csv(csv_file_name,
                    header=False,
                    debug=False,
                    debug_rows=None,
-                   print_progress=0):
+                   print_progress=0,
+                   detect_robots=False,
+                   robot_registry=None):
     """
     Import one csv file of tweets into a mongodb database while looking up addresses from a mongodb address base.
     Invalid tweets will be filtered into a separate folder under "output/errors"
@@ -205,8 +262,11 @@ def import_one_csv(csv_file_name,
     :param debug_rows:          How many rows it shall do for debugging purposes. If not specified and debug is True
                                 then will be set to 5
     :param print_progress:      Number of reads at which diagnostics should be printed. 0 will print no diagnostics.
-    :return:                    numpy array with number of
-                                inserted, no_geo, non_GB, failed, converted, no_address, duplicate, mongo_error tweets
+    :param detect_robots:       If true then also return a RobotSketch of the inserted tweets.
+    :param robot_registry:      Set of user_ids of known robots. Their tweets are dumped before any processing.
+    :return:                    numpy array with number of inserted, no_geo, non_GB, failed, converted, no_address,
+                                duplicate, mongo_error and robot tweets
+                                and the RobotSketch if detect_robots is true
 
     :type csv_file_name         str
     :type mongo_connection      list or tuple
@@ -215,7 +275,9 @@ def import_one_csv(csv_file_name,
     :type debug                 bool
     :type debug_rows            None or int
     :type print_progress        int
-    :rtype                      np.ndarray
+    :type detect_robots         bool
+    :type robot_registry        None | set[int] | frozenset[int]
+    :rtype                      np.ndarray | tuple
     """
 
     # set up debug_rows if specified
@@ -239,6 +301,11 @@ def import_one_csv(csv_file_name,
         non_gb = []
         no_address = []
         mongo_error = []
+        robot_tweets = []
+
+        # time spent parsing and looking up addresses, added to the metrics once per file
+        parse_seconds = 0.0
+        lookup_seconds = 0.0
 
         # iterate over each row of input csv
         for row in input_rows:
@@ -255,7 +322,15 @@ def import_one_csv(csv_file_name,
 
             # read file row by row
             index += 1
+
+            # skip known robots before parsing the tweet
+            if robot_registry is not None and csv_user_id(row) in robot_registry:
+                robot_tweets.append(row)
+                continue
+
+            start_time = perf_counter()
             new_tweet = Tweet(row, method="csv")
+            parse_seconds += perf_counter() - start_time
 
             if debug:
                 # print tweet before finding address
@@ -279,7 +354,9 @@ def import_one_csv(csv_file_name,
                 non_gb.append(row)
             else:
                 # if all is good then find closest address
+                start_time = perf_counter()
                 found_address = new_tweet.find_tweet_address(mongo_address)
+                lookup_seconds += perf_counter() - start_time
 
                 # if there are no address then keep track of raw input
                 if found_address == 1:
@@ -306,6 +383,9 @@ def import_one_csv(csv_file_name,
                 if index % print_progress == 0:
                     print(index, datetime.now())
 
+    add_time("parse", parse_seconds, items=index - len(robot_tweets))
+    add_time("address lookup", lookup_seconds, items=len(read_tweets) + len(mongo_error))
+
     # write failed tweets if any
     dump_errors(failed_tweets, "failed_tweets", csv_file_name)
 
@@ -324,22 +404,49 @@ def import_one_csv(csv_file_name,
     # dump mongo errors, won't be in database
     dump_errors(mongo_error, "mongo_error", csv_file_name)
 
+    # dump tweets of known robots, won't be in database
+    dump_errors(robot_tweets, "robots", csv_file_name)
+
     # put correct tweets into specified mongo_db database
     duplicates = []
+    inserted_chunks = set()
+    robot_sketch = RobotSketch() if detect_robots else None
+    insert_seconds = 0.0
     for tweet in read_tweets:
+        start_time = perf_counter()
         try:
             mongo_connection.insert(tweet.dictionary)
         except DuplicateKeyError:
             duplicates.append(tweet.get_csv_format())
+            continue
+        finally:
+            insert_seconds += perf_counter() - start_time
+        inserted_chunks.add(tweet.dictionary["chunk_id"])
+
+        # keep track of user activity for finding robots
+        if detect_robots:
+            robot_sketch.add(tweet.dictionary["user_id"],
+                             tweet.dictionary["unix_time"],
+                             tweet.dictionary["tweet"]["coordinates"])
+
+    add_time("insert", insert_seconds, items=len(read_tweets))
+
+    # invalidate cached results of the chunks written
+    bump_versions(mongo_connection, inserted_chunks, "import")
 
     # dump all duplicate tweets
     dump_errors(duplicates, "duplicates", csv_file_name)
     print("Finished", csv_file_name, datetime.now())
 
     # return insert statistics
-    return np.array([len(read_tweets) - len(duplicates), len(no_geo),
-                     len(non_gb), len(failed_tweets),
-                     len(converted_no_geo), len(no_address), len(duplicates), len(mongo_error)], dtype="int32")
+    statistics = np.array([len(read_tweets) - len(duplicates), len(no_geo),
+                           len(non_gb), len(failed_tweets),
+                           len(converted_no_geo), len(no_address), len(duplicates), len(mongo_error),
+                           len(robot_tweets)], dtype="int32")
+
+    if detect_robots:
+        return statistics, robot_sketch
+    return statistics
 
 
 def import_one_json(json_file_name,
@@ -347,7 +454,9 @@ def import_one_json(json_file_name,
                     mongo_address=None,
                     debug=False,
                     debug_rows=None,
-                    print_progress=0):
+                    print_progress=0,
+                    detect_robots=False,
+                    robot_registry=None):
     """
     Import one csv file of tweets into a mongodb database while looking up addresses from a mongodb address base.
     Invalid tweets will be filtered into a separate folder under "output/errors"
@@ -362,8 +471,11 @@ def import_one_json(json_file_name,
     :param debug_rows:          How many rows it shall do for debugging purposes. If not specified and debug is True
                                 then will be set to 5
     :param print_progress:      Number of reads at which diagnostics should be printed. 0 will print no diagnostics.
-    :return:                    numpy array with number of
-                                inserted, no_geo, non_GB, failed, converted, no_address, duplicate, mongo_error tweets
+    :param detect_robots:       If true then also return a RobotSketch of the inserted tweets.
+    :param robot_registry:      Set of user_ids of known robots. Their tweets are dumped before any processing.
+    :return:                    numpy array with number of inserted, no_geo, non_GB, failed, converted, no_address,
+                                duplicate, mongo_error and robot tweets
+                                and the RobotSketch if detect_robots is true
 
     :type json_file_name        str
     :type mongo_connection      list or tuple
@@ -371,7 +483,9 @@ def import_one_json(json_file_name,
     :type debug                 bool
     :type debug_rows            None or int
     :type print_progress        int
-    :rtype                      np.ndarray
+    :type detect_robots         bool
+    :type robot_registry        None | set[int] | frozenset[int]
+    :rtype                      np.ndarray | tuple
     """
 
     # set up debug_rows if specified
@@ -394,6 +508,11 @@ def import_one_json(json_file_name,
         non_gb = []
         no_address = []
         mongo_error = []
+        robot_tweets = []
+
+        # time spent parsing and looking up addresses, added to the metrics once per file
+        parse_seconds = 0.0
+        lookup_seconds = 0.0
         end_of_file = []
 
         for one_row in in_tweets:
@@ -405,7 +524,15 @@ def import_one_json(json_file_name,
 
             # read file row by row
             index += 1
+
+            # skip known robots before parsing the tweet
+            if robot_registry is not None and json_user_id(row) in robot_registry:
+                robot_tweets.append(row)
+                continue
+
+            start_time = perf_counter()
             new_tweet = Tweet(row, method="json")
+            parse_seconds += perf_counter() - start_time
 
             if debug:
                 # print tweet before finding address
@@ -433,7 +560,9 @@ def import_one_json(json_file_name,
                 non_gb.append(row)
             else:
                 # if all is good then find closest address
+                start_time = perf_counter()
                 found_address = new_tweet.find_tweet_address(mongo_address)
+                lookup_seconds += perf_counter() - start_time
 
                 # if there are no address then keep track of raw input
                 if found_address == 1:
@@ -460,6 +589,9 @@ def import_one_json(json_file_name,
                 if index % print_progress == 0:
                     print(index, datetime.now())
 
+    add_time("parse", parse_seconds, items=index - len(robot_tweets))
+    add_time("address lookup", lookup_seconds, items=len(read_tweets) + len(mongo_error))
+
     # write failed tweets if any
     dump_errors(failed_tweets, "failed_tweets", json_file_name)
 
@@ -481,22 +613,83 @@ def import_one_json(json_file_name,
     # dump mongo errors, won't be in database
     dump_errors(mongo_error, "mongo_error", json_file_name)
 
+    # dump tweets of known robots, won't be in database
+    dump_errors(robot_tweets, "robots", json_file_name)
+
     # put correct tweets into specified mongo_db database
     duplicates = []
+    inserted_chunks = set()
+    robot_sketch = RobotSketch() if detect_robots else None
+    insert_seconds = 0.0
     for tweet in read_tweets:
+        start_time = perf_counter()
         try:
             mongo_connection.insert(tweet.dictionary)
         except DuplicateKeyError:
             duplicates.append(tweet.dictionary)
+            continue
+        finally:
+            insert_seconds += perf_counter() - start_time
+        inserted_chunks.add(tweet.dictionary["chunk_id"])
+
+        # keep track of user activity for finding robots
+        if detect_robots:
+            robot_sketch.add(tweet.dictionary["user_id"],
+                             tweet.dictionary["unix_time"],
+                             tweet.dictionary["tweet"]["coordinates"])
+
+    add_time("insert", insert_seconds, items=len(read_tweets))
+
+    # invalidate cached results of the chunks written
+    bump_versions(mongo_connection, inserted_chunks, "import")
 
     # dump all duplicate tweets
     dump_errors(duplicates, "duplicates", json_file_name)
     print("Finished", json_file_name, datetime.now())
 
     # return insert statistics
-    return np.array([len(read_tweets) - len(duplicates), len(no_geo),
-                     len(non_gb), len(failed_tweets),
-                     len(converted_no_geo), len(no_address), len(duplicates), len(mongo_error)], dtype="int32")
+    statistics = np.array([len(read_tweets) - len(duplicates), len(no_geo),
+                           len(non_gb), len(failed_tweets),
+                           len(converted_no_geo), len(no_address), len(duplicates), len(mongo_error),
+                           len(robot_tweets)], dtype="int32")
+
+    if detect_robots:
+        return statistics, robot_sketch
+    return statistics
+
+
+def csv_user_id(row):
+    """
+    Read the user_id of a raw csv row without parsing the whole tweet, as in Tweet.
+
+    :param row:     One row of the csv file.
+    :return:        User_id, or None if it cannot be read.
+
+    :type row       list[str]
+    :rtype          int | None
+    """
+
+    try:
+        return int(float(row[1]))
+    except (ValueError, IndexError):
+        return None
+
+
+def json_user_id(row):
+    """
+    Read the user_id of a raw json tweet without parsing the whole tweet, as in Tweet.
+
+    :param row:     One tweet as loaded from the json file.
+    :return:        User_id, or None if it cannot be read.
+
+    :type row       dict
+    :rtype          int | None
+    """
+
+    try:
+        return int(float(row["user"]["id"]))
+    except (KeyError, TypeError, ValueError):
+        return None
 
 
 def create_partition_csv(input_csv,
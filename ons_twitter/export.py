@@ -0,0 +1,360 @@
+"""
+Description:    Export the clustered tweets to partitioned parquet files for offline analysis, so ad-hoc questions
+                do not need to query the production mongodb. Files are partitioned by chunk_id or by month in the
+                hive layout (chunk_id=7/, month=Apr/), so pandas.read_parquet can load the folder, or a single
+                partition, and only the columns it needs. Repeated strings are dictionary encoded and numbers are
+                typed. A manifest in the output folder records the exported chunks, so only chunks that changed
+                since the last export are written again.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import json
+import os
+from datetime import datetime
+from glob import glob
+
+import pymongo
+from joblib import Parallel, delayed
+
+from ons_twitter.analytics import chunk_clusters, get_field
+from ons_twitter.supporting_functions import create_folder
+
+# pyarrow is optional, only needed for the export
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# exported columns as (column name, field in tweet document, type). Category columns are dictionary encoded.
+EXPORT_COLUMNS = (("tweet_id", "_id", "string"),
+                  ("user_id", "user_id", "int64"),
+                  ("chunk_id", "chunk_id", "int16"),
+                  ("unix_time", "unix_time", "int64"),
+                  ("date", "time.date", "category"),
+                  ("month", "time.month", "category"),
+                  ("dow", "time.dow", "category"),
+                  ("tod", "time.tod", "string"),
+                  ("language", "tweet.language", "category"),
+                  ("place", "tweet.place", "category"),
+                  ("country", "tweet.country", "category"),
+                  ("latitude", "tweet.lat_long.0", "float64"),
+                  ("longitude", "tweet.lat_long.1", "float64"),
+                  ("easting", "tweet.coordinates.0", "float64"),
+                  ("northing", "tweet.coordinates.1", "float64"),
+                  ("address_class", "tweet.address.classification.abbreviated", "category"),
+                  ("address_distance", "tweet.address.distance", "float64"),
+                  ("oslaua", "tweet.address.levels.oslaua", "category"),
+                  ("msoa11", "tweet.address.levels.msoa11", "category"),
+                  ("cluster_id", "cluster.cluster_id", "category"),
+                  ("cluster_type", "cluster.type", "category"),
+                  ("cluster_count", "cluster.count", "int32"),
+                  ("cluster_dominant", "cluster.dominant", "int8"),
+                  ("cluster_address_class", "cluster.address.classification.abbreviated", "category"),
+                  ("cluster_oslaua", "cluster.address.levels.oslaua", "category"),
+                  ("distance_from_centroid", "tweet.distance_from_centroid", "float64"),
+                  ("total_tweets_for_user", "total_tweets_for_user", "int32"))
+
+# tweet text is large, only exported if asked for
+TEXT_COLUMN = ("text", "tweet.text", "string")
+
+MANIFEST_FILE = "_manifest.json"
+
+
+def _arrow_type(type_name):
+    """
+    :return:    Pyarrow type of a column type in EXPORT_COLUMNS.
+    """
+    if type_name == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    return getattr(pa, type_name)()
+
+
+def _column_value(value,
+                  type_name):
+    # "NA" and other strings stand for missing numbers in the tweets collection
+    if value is None:
+        return None
+    if type_name in ("string", "category"):
+        return str(value)
+    try:
+        return float(value) if type_name == "float64" else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def export_columns(include_text=False):
+    """
+    :return:    Exported columns, see EXPORT_COLUMNS.
+    :rtype      tuple[tuple[str]]
+    """
+    return EXPORT_COLUMNS + (TEXT_COLUMN,) if include_text else EXPORT_COLUMNS
+
+
+def chunk_table(tweets,
+                columns=EXPORT_COLUMNS,
+                clusters=None):
+    """
+    Convert the tweets of one chunk into a pyarrow table.
+
+    :param tweets:      Iterable of tweet documents.
+    :param columns:     Columns to export, see EXPORT_COLUMNS.
+    :param clusters:    Dictionary of {cluster_id: cluster} if clusters were written in normalised form,
+                        see analytics.chunk_clusters.
+    :return:            Table with one row per tweet.
+
+    :type tweets        pymongo.cursor.Cursor | list[dict]
+    :type columns       tuple[tuple[str]]
+    :type clusters      None | dict[str, dict]
+    :rtype              pyarrow.Table
+    """
+
+    values = dict((column[0], []) for column in columns)
+    for tweet in tweets:
+        if clusters is not None and "cluster_id" in tweet:
+            tweet["cluster"] = clusters.get(tweet["cluster_id"])
+        for name, field, type_name in columns:
+            values[name].append(_column_value(get_field(tweet, field), type_name))
+
+    schema = pa.schema([(name, _arrow_type(type_name)) for name, field, type_name in columns])
+
+    return pa.Table.from_pydict(values, schema=schema)
+
+
+def _chunk_files(output_folder,
+                 chunk_id,
+                 partition_by):
+    """
+    :return:    Existing parquet files of a chunk.
+    :rtype      list[str]
+    """
+    if partition_by == "chunk_id":
+        return glob(os.path.join(output_folder, "chunk_id=%d" % chunk_id, "*.parquet"))
+    return glob(os.path.join(output_folder, "month=*", "chunk_%04d.parquet" % chunk_id))
+
+
+def _remove_files(file_names):
+    for file_name in file_names:
+        os.remove(file_name)
+
+
+def _remove_empty_partitions(output_folder):
+    """
+    Remove partition folders left empty after their files were removed.
+    """
+    for folder in glob(os.path.join(output_folder, "*=*")):
+        if os.path.isdir(folder) and len(os.listdir(folder)) == 0:
+            os.rmdir(folder)
+
+
+def _write_file(table,
+                file_name):
+    """
+    Write a table through a temporary file, so readers never see half written files.
+    """
+    folder, name = os.path.split(file_name)
+    create_folder(folder + "/")
+
+    # readers skip files starting with a dot
+    temporary_file = os.path.join(folder, "." + name + ".tmp")
+    pq.write_table(table, temporary_file, compression="snappy")
+    os.replace(temporary_file, file_name)
+
+
+def export_one_chunk(mongo_connection,
+                     output_folder,
+                     chunk_id,
+                     partition_by="chunk_id",
+                     include_text=False,
+                     clusters_connection=None):
+    """
+    Export one chunk, replacing its files from earlier exports. For parameters see export_all.
+
+    :return:    Tuple of (chunk_id, number of tweets exported)
+    :rtype      tuple[int]
+    """
+
+    start_time = datetime.now()
+    columns = export_columns(include_text)
+
+    tweets = pymongo.MongoClient(mongo_connection[0])[mongo_connection[1]][mongo_connection[2]]
+    clusters = None
+    if clusters_connection is not None:
+        clusters = chunk_clusters(pymongo.MongoClient(clusters_connection[0])[clusters_connection[1]][
+            clusters_connection[2]], chunk_id)
+
+    table = chunk_table(tweets.find({"chunk_id": chunk_id}), columns=columns, clusters=clusters)
+
+    old_files = set(_chunk_files(output_folder, chunk_id, partition_by))
+    new_files = set()
+
+    # the partition column is in the folder name instead of the file
+    if partition_by == "chunk_id":
+        file_name = os.path.join(output_folder, "chunk_id=%d" % chunk_id, "part.parquet")
+        _write_file(table.drop(["chunk_id"]), file_name)
+        new_files.add(file_name)
+    else:
+        months = table.column("month").to_pylist()
+        for month in sorted(set(months), key=str):
+            file_name = os.path.join(output_folder, "month=%s" % month, "chunk_%04d.parquet" % chunk_id)
+            rows = [index for index, one_month in enumerate(months) if one_month == month]
+            _write_file(table.take(rows).drop(["month"]), file_name)
+            new_files.add(file_name)
+
+    # remove files of months that are no longer in the chunk
+    _remove_files(old_files - new_files)
+
+    print("Exported chunk %04d: %8d tweets in %s" % (chunk_id, table.num_rows, datetime.now() - start_time))
+
+    return chunk_id, table.num_rows
+
+
+def read_manifest(output_folder):
+    """
+    :return:    Manifest of an export folder: {"partition_by": str, "chunks": {chunk_id: {"tweets", "exported"}}}
+    :rtype      dict
+    """
+    try:
+        with open(os.path.join(output_folder, MANIFEST_FILE), 'r') as in_file:
+            manifest = json.load(in_file)
+    except (IOError, ValueError):
+        return {"partition_by": None, "include_text": False, "chunks": {}}
+
+    manifest["chunks"] = dict((int(chunk_id), info) for chunk_id, info in manifest["chunks"].items())
+    return manifest
+
+
+def _write_manifest(output_folder,
+                    manifest):
+    file_name = os.path.join(output_folder, MANIFEST_FILE)
+    with open(file_name + ".tmp", 'w') as out_file:
+        json.dump(manifest, out_file, indent=1, sort_keys=True)
+    os.replace(file_name + ".tmp", file_name)
+
+
+def changed_chunks(mongo_connection,
+                   manifest,
+                   chunk_range=range(1000),
+                   ledger_connection=None,
+                   run_id=None):
+    """
+    Chunks that need to be exported again: chunks not in the manifest, chunks whose number of tweets changed
+    and, if a clustering run is given, chunks that run finished after they were exported.
+
+    :param mongo_connection:    Mongodb parameters to the clustered tweets. [ip, database, collection]
+    :param manifest:            Output of read_manifest.
+    :param chunk_range:         Chunks to check.
+    :param ledger_connection:   Mongodb parameters to the ledger of clustering runs, see run_ledger.
+    :param run_id:              Name of the clustering run.
+    :return:                    Sorted list of chunk ids.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type manifest              dict
+    :type chunk_range           range | list[int]
+    :type ledger_connection     None | list[str] | tuple[str]
+    :type run_id                None | str
+    :rtype                      list[int]
+    """
+
+    tweets = pymongo.MongoClient(mongo_connection[0])[mongo_connection[1]][mongo_connection[2]]
+
+    # chunks reclustered since the export
+    finished = {}
+    if ledger_connection is not None and run_id is not None:
+        ledger = pymongo.MongoClient(ledger_connection[0])[ledger_connection[1]][ledger_connection[2]]
+        for chunk in ledger.find({"run_id": run_id, "status": "complete"}, {"chunk_id": 1, "finished": 1}):
+            finished[chunk["chunk_id"]] = chunk["finished"].strftime("%Y-%m-%d %H:%M:%S")
+
+    changed = []
+    for chunk_id in chunk_range:
+        exported = manifest["chunks"].get(chunk_id)
+        if exported is None or finished.get(chunk_id, "") > exported["exported"] or \
+                tweets.count_documents({"chunk_id": chunk_id}) != exported["tweets"]:
+            changed.append(chunk_id)
+
+    return changed
+
+
+def export_all(mongo_connection,
+               output_folder="data/output/parquet/",
+               chunk_range=range(1000),
+               partition_by="chunk_id",
+               include_text=False,
+               clusters_connection=None,
+               incremental=True,
+               ledger_connection=None,
+               run_id=None,
+               n_jobs=-1):
+    """
+    Export the clustered tweets to parquet files, one chunk per job. Load the result with pandas, eg:
+    pandas.read_parquet("data/output/parquet/", columns=["user_id", "cluster_type"])
+
+    :param mongo_connection:    Mongodb parameters to the clustered tweets. [ip, database, collection]
+    :param output_folder:       Folder of the parquet files and the manifest.
+    :param chunk_range:         Chunks to export.
+    :param partition_by:        "chunk_id" for one folder per chunk, or "month" for one folder per month with
+                                one file per chunk.
+    :param include_text:        If true then the text of tweets is exported too.
+    :param clusters_connection: Mongodb parameters to the clusters collection if clusters were written in
+                                normalised form, see cluster_all.
+    :param incremental:         If true then only chunks that changed since the last export are written,
+                                see changed_chunks.
+    :param ledger_connection:   Mongodb parameters to the ledger of clustering runs, for incremental exports.
+    :param run_id:              Name of the clustering run, for incremental exports.
+    :param n_jobs:              Number of chunks exported in parallel.
+    :return:                    Number of tweets exported.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type output_folder         str
+    :type chunk_range           range | list[int]
+    :type partition_by          str
+    :type include_text          bool
+    :type clusters_connection   None | list[str] | tuple[str]
+    :type incremental           bool
+    :type ledger_connection     None | list[str] | tuple[str]
+    :type run_id                None | str
+    :type n_jobs                int
+    :rtype                      int
+    """
+
+    assert pa is not None, "pyarrow is needed for exporting to parquet"
+    assert partition_by in ("chunk_id", "month"), "partition_by must be chunk_id or month"
+
+    start_time = datetime.now()
+    create_folder(output_folder)
+
+    # a different layout means exporting everything again
+    manifest = read_manifest(output_folder)
+    if manifest["partition_by"] != partition_by or manifest.get("include_text") != include_text:
+        if len(manifest["chunks"]):
+            print("Export settings changed, exporting all chunks")
+        for chunk_id in manifest["chunks"]:
+            _remove_files(_chunk_files(output_folder, chunk_id, manifest["partition_by"] or partition_by))
+        manifest = {"partition_by": partition_by, "include_text": include_text, "chunks": {}}
+
+    if incremental:
+        chunk_ids = changed_chunks(mongo_connection, manifest, chunk_range, ledger_connection, run_id)
+        print("%d of %d chunks changed since the last export" % (len(chunk_ids), len(chunk_range)))
+    else:
+        chunk_ids = list(chunk_range)
+
+    exported = Parallel(n_jobs=n_jobs)(delayed(export_one_chunk)(mongo_connection,
+                                                                 output_folder,
+                                                                 chunk_id,
+                                                                 partition_by,
+                                                                 include_text,
+                                                                 clusters_connection) for chunk_id in chunk_ids)
+
+    # record exported chunks
+    export_time = start_time.strftime("%Y-%m-%d %H:%M:%S")
+    for chunk_id, number_of_tweets in exported:
+        manifest["chunks"][chunk_id] = {"tweets": number_of_tweets, "exported": export_time}
+    _write_manifest(output_folder, manifest)
+    _remove_empty_partitions(output_folder)
+
+    total_tweets = sum(x[1] for x in exported)
+    print("\nExported %d tweets from %d chunks in %s" % (total_tweets, len(exported), datetime.now() - start_time))
+
+    return total_tweets
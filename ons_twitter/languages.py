@@ -0,0 +1,141 @@
+"""
+Description:    Language by geography matrix of users with a dominant cluster, as in in_development/languages.py and
+                languages_reformat.py. Every user is split equally between the languages they tweeted in, and
+                these weights are added up by the local authority (oslaua) of their dominant cluster. Languages and
+                oslaua codes are mapped to integer ids, so the matrix is built with one numpy bincount.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import numpy as np
+import pandas as pd
+
+from ons_twitter.analytics import LanguagesByLA, run_analytics
+
+
+def language_matrix(oslaua_codes,
+                    language_sets,
+                    users=None,
+                    drop_languages=("und",)):
+    """
+    Build the language by geography matrix. Each row of the input is a group of users with the same oslaua and
+    set of languages. Their weight is split equally between their languages.
+    Rows with no languages left after dropping drop_languages are ignored.
+
+    :param oslaua_codes:    Oslaua code of each row.
+    :param language_sets:   Languages of each row, either a list or a string joined by "_".
+    :param users:           Number of users in each row, 1 if None.
+    :param drop_languages:  Languages to ignore, "und" is undetermined.
+    :return:                Tuple of (matrix with one row per oslaua and one column per language,
+                                      sorted oslaua codes, sorted languages)
+
+    :type oslaua_codes      list[str]
+    :type language_sets     list[str] | list[list[str]]
+    :type users             None | list[int] | np.ndarray
+    :type drop_languages    tuple[str]
+    :rtype                  tuple
+    """
+
+    if users is None:
+        users = np.ones(len(oslaua_codes))
+
+    # one entry per user group and language
+    entry_geographies = []
+    entry_languages = []
+    entry_weights = []
+    for oslaua, languages, weight in zip(oslaua_codes, language_sets, users):
+        if isinstance(languages, str):
+            languages = languages.split("_")
+        languages = [language for language in set(languages) if language not in drop_languages]
+        if len(languages) == 0:
+            continue
+        entry_geographies.extend([str(oslaua)] * len(languages))
+        entry_languages.extend(languages)
+        entry_weights.extend([weight / len(languages)] * len(languages))
+
+    if len(entry_weights) == 0:
+        return np.zeros((0, 0)), [], []
+
+    # map codes to integer ids
+    geographies, geography_ids = np.unique(entry_geographies, return_inverse=True)
+    languages, language_ids = np.unique(entry_languages, return_inverse=True)
+
+    matrix = np.bincount(geography_ids * len(languages) + language_ids,
+                         weights=np.array(entry_weights, dtype="float64"),
+                         minlength=len(geographies) * len(languages))
+
+    return matrix.reshape((len(geographies), len(languages))), geographies.tolist(), languages.tolist()
+
+
+def language_matrix_from_counts(counts,
+                                drop_languages=("und",)):
+    """
+    Build the language by geography matrix from the result of the LanguagesByLA accumulator.
+
+    :param counts:          Dictionary of {(oslaua, languages joined by "_"): number of users}
+    :param drop_languages:  Languages to ignore.
+    :return:                See language_matrix.
+
+    :type counts            dict[tuple, int]
+    :type drop_languages    tuple[str]
+    :rtype                  tuple
+    """
+
+    keys = list(counts.keys())
+
+    return language_matrix([key[0] for key in keys],
+                           [key[1] for key in keys],
+                           users=np.array([counts[key] for key in keys], dtype="float64"),
+                           drop_languages=drop_languages)
+
+
+def write_language_matrix(matrix,
+                          oslaua_codes,
+                          languages,
+                          output_file="language_matrix.csv"):
+    """
+    Write the matrix in the layout of in_development/languages_reformat.py: one row per oslaua and one column per
+    language.
+
+    :param matrix:          Output of language_matrix.
+    :param oslaua_codes:    Row labels.
+    :param languages:       Column labels.
+    :param output_file:     Location of csv file.
+    :return:                Data frame that was written.
+
+    :type matrix            np.ndarray
+    :type oslaua_codes      list[str]
+    :type languages         list[str]
+    :type output_file       str
+    :rtype                  pd.DataFrame
+    """
+
+    data_frame = pd.DataFrame(matrix, index=pd.Index(oslaua_codes, name="oslaua"), columns=languages)
+    data_frame.to_csv(output_file)
+
+    return data_frame
+
+
+def build_language_matrix(mongo_connection,
+                          chunk_range=range(1000),
+                          clusters_connection=None,
+                          output_file="language_matrix.csv",
+                          n_jobs=-1):
+    """
+    Collect the languages of users with a dominant cluster in one pass over the tweets and write the language
+    by geography matrix. For parameters see analytics.run_analytics.
+
+    :return:    See language_matrix.
+    :rtype      tuple
+    """
+
+    counts = run_analytics(mongo_connection,
+                           [LanguagesByLA()],
+                           chunk_range=chunk_range,
+                           clusters_connection=clusters_connection,
+                           n_jobs=n_jobs)["languages_by_la"]
+
+    matrix, oslaua_codes, languages = language_matrix_from_counts(counts)
+    write_language_matrix(matrix, oslaua_codes, languages, output_file=output_file)
+
+    return matrix, oslaua_codes, languages
@@ -0,0 +1,321 @@
+"""
+Description:    Lightweight timers and counters for the stages of import and clustering. Every process records into
+                its own Metrics object, which is switched off unless the worker function is wrapped in Instrumented.
+                Instrumented workers hand their metrics back to the main process with their result, where they are
+                merged and written to one json report per run. Durations are kept in log-scale histograms, so
+                metrics of millions of calls stay small and can be added up across workers.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import json
+import os
+from datetime import datetime
+from math import log10
+from time import perf_counter
+
+import numpy as np
+
+from ons_twitter.supporting_functions import create_folder
+
+# histogram of durations from 1 microsecond to 10000 seconds
+SMALLEST_DURATION = 1e-6
+BINS_PER_DECADE = 20
+NUMBER_OF_BINS = 10 * BINS_PER_DECADE + 1
+
+
+def _duration_bin(seconds):
+    if seconds <= SMALLEST_DURATION:
+        return 0
+    return min(int(log10(seconds / SMALLEST_DURATION) * BINS_PER_DECADE) + 1, NUMBER_OF_BINS - 1)
+
+
+def _bin_duration(duration_bin):
+    # geometric middle of a bin
+    if duration_bin == 0:
+        return SMALLEST_DURATION
+    return SMALLEST_DURATION * 10 ** ((duration_bin - 0.5) / BINS_PER_DECADE)
+
+
+class Stage(object):
+    """
+    Timings of one named stage: number of calls, items processed, total time and a histogram of durations.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.longest = 0.0
+        self.histogram = np.zeros(NUMBER_OF_BINS, dtype="int64")
+
+    def add(self,
+            seconds,
+            items=0):
+        self.calls += 1
+        self.items += items
+        self.seconds += seconds
+        self.longest = max(self.longest, seconds)
+        self.histogram[_duration_bin(seconds)] += 1
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.items += other.items
+        self.seconds += other.seconds
+        self.longest = max(self.longest, other.longest)
+        self.histogram += other.histogram
+
+    def percentile(self, percent):
+        """
+        Approximate percentile of durations, within half a histogram bin (about 6%).
+
+        :param percent:     Percentile between 0 and 100.
+        :return:            Duration in seconds.
+        :rtype              float
+        """
+
+        if self.calls == 0:
+            return 0.0
+        rank = max(int(np.ceil(self.calls * percent / 100)), 1)
+        duration_bin = int(np.searchsorted(np.cumsum(self.histogram), rank))
+        return min(_bin_duration(duration_bin), self.longest)
+
+    def summary(self):
+        summary = {"calls": self.calls,
+                   "items": self.items,
+                   "total_seconds": self.seconds,
+                   "mean_seconds": self.seconds / self.calls if self.calls > 0 else 0.0,
+                   "max_seconds": self.longest,
+                   "items_per_second": self.items / self.seconds if self.seconds > 0 else 0.0}
+        for percent in (50, 90, 99):
+            summary["p%d_seconds" % percent] = self.percentile(percent)
+        return summary
+
+
+class Timer(object):
+    """
+    Context manager that adds the time spent inside it to a stage of metrics. Time spent in timers nested inside
+    it is left out, as it is counted in their own stages, so the stages of a run add up to the time measured.
+    """
+
+    def __init__(self,
+                 metrics,
+                 name,
+                 items=0):
+        self.metrics = metrics
+        self.name = name
+        self.items = items
+        self.nested = 0.0
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.metrics.active_timers.append(self)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        seconds = perf_counter() - self.start
+        self.metrics.active_timers.pop()
+        if len(self.metrics.active_timers) > 0:
+            self.metrics.active_timers[-1].nested += seconds
+        if self.metrics.enabled:
+            self.metrics.add_time(self.name, seconds - self.nested, self.items)
+        return False
+
+
+class Metrics(object):
+    """
+    Named stages and counters of one process, or the merged metrics of many.
+
+    :param enabled:     If false then nothing is recorded.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}
+        self.workers = {}
+        self.active_timers = []
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self.workers = {}
+
+    def timer(self,
+              name,
+              items=0):
+        """
+        Time a block of code as one call of stage name, without the time of timers nested inside it.
+
+        Example:
+            with METRICS.timer("insert", items=len(tweets)):
+                collection.insert_many(tweets)
+
+        :param name:    Name of the stage.
+        :param items:   Number of items processed in the block, for throughput.
+        :rtype          Timer
+        """
+
+        return Timer(self, name, items)
+
+    def add_time(self,
+                 name,
+                 seconds,
+                 items=0):
+        if not self.enabled:
+            return
+        if name not in self.stages:
+            self.stages[name] = Stage()
+        self.stages[name].add(seconds, items)
+
+    def count(self,
+              name,
+              number=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def merge(self, other):
+        """
+        Add the metrics of another process or task.
+
+        :type other     Metrics
+        :rtype          Metrics
+        """
+
+        for name, stage in other.stages.items():
+            if name not in self.stages:
+                self.stages[name] = Stage()
+            self.stages[name].merge(stage)
+        for name, number in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + number
+        for process_id, load in other.workers.items():
+            worker = self.workers.setdefault(process_id, {"tasks": 0, "seconds": 0.0})
+            worker["tasks"] += load["tasks"]
+            worker["seconds"] += load["seconds"]
+        return self
+
+    def report(self):
+        """
+        :return:    Summary of all stages, counters and workers as a json serialisable dictionary.
+        :rtype      dict
+        """
+
+        return {"stages": dict((name, stage.summary()) for name, stage in sorted(self.stages.items())),
+                "counters": dict(sorted(self.counters.items())),
+                "workers": dict((str(process_id), load) for process_id, load in sorted(self.workers.items()))}
+
+
+# metrics of this process
+METRICS = Metrics()
+
+
+def timer(name,
+          items=0):
+    """
+    Time a block of code in the metrics of this process, see Metrics.timer.
+    """
+
+    return METRICS.timer(name, items)
+
+
+def add_time(name,
+             seconds,
+             items=0):
+    """
+    Add one call of stage name measured elsewhere to the metrics of this process.
+    """
+
+    METRICS.add_time(name, seconds, items)
+
+
+def count(name,
+          number=1):
+    """
+    Add to a counter in the metrics of this process.
+    """
+
+    METRICS.count(name, number)
+
+
+class Instrumented(object):
+    """
+    Wrap a worker function, so that it records metrics while it runs and returns (result, Metrics of the call).
+    Use split_results on the output of joblib.Parallel.
+
+    :param function:    Worker function, must be picklable.
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        METRICS.reset()
+        METRICS.enabled = True
+        start_time = perf_counter()
+        try:
+            result = self.function(*args, **kwargs)
+        finally:
+            METRICS.enabled = False
+
+        collected = Metrics()
+        collected.merge(METRICS)
+        collected.workers = {os.getpid(): {"tasks": 1, "seconds": perf_counter() - start_time}}
+        METRICS.reset()
+
+        return result, collected
+
+
+def split_results(results):
+    """
+    Separate the results of Instrumented workers from their metrics.
+
+    :param results:     List of (result, Metrics) tuples.
+    :return:            Tuple of (list of results, merged Metrics)
+    :rtype              tuple[list, Metrics]
+    """
+
+    merged = Metrics()
+    for one_result in results:
+        merged.merge(one_result[1])
+
+    return [one_result[0] for one_result in results], merged
+
+
+def write_report(metrics,
+                 output_file,
+                 run_name,
+                 start_time):
+    """
+    Write the metrics of a run to a json file.
+
+    :param metrics:     Merged metrics of the run.
+    :param output_file: Location of json file.
+    :param run_name:    Name of the run, eg: import
+    :param start_time:  Start of the run.
+    :return:            The report that was written.
+
+    :type metrics       Metrics
+    :type output_file   str
+    :type run_name      str
+    :type start_time    datetime
+    :rtype              dict
+    """
+
+    finish_time = datetime.now()
+    report = {"run": run_name,
+              "started": start_time.isoformat(),
+              "finished": finish_time.isoformat(),
+              "wall_seconds": (finish_time - start_time).total_seconds()}
+    report.update(metrics.report())
+
+    folder = os.path.dirname(output_file)
+    if folder != "":
+        create_folder(folder)
+    with open(output_file, 'w') as out_file:
+        json.dump(report, out_file, indent=2, sort_keys=True)
+
+    print("\nMetrics of %s written to %s" % (run_name, output_file))
+
+    return report
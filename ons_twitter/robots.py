@@ -0,0 +1,413 @@
+"""
+Description:    Robot detection during import. Every import worker keeps a RobotSketch of the tweets it inserted:
+                a Misra-Gries summary of tweets per user, the distinct coordinates of the heaviest users and
+                the peak number of tweets users sent within one minute. Sketches from all workers are merged at
+                the end of the import and the users that look automated are written to a ranked csv, so they are
+                known before clustering starts. Known robots are kept in the registry of special_csv, which is
+                used to skip them during import, and moved out of the tweets collection chunk by chunk with
+                quarantine_robots.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+from csv import reader, writer
+from datetime import datetime
+
+import numpy as np
+import pymongo
+from joblib import Parallel, delayed
+
+from ons_twitter.chunk_versions import bump_versions
+from ons_twitter.supporting_functions import create_folder, find_file_name
+
+
+# csv files of known robots with the column of their user_ids
+ROBOT_REGISTRY = (("special_csv/robots.csv", 0),
+                  ("special_csv/manual_robots.csv", 0),
+                  ("special_csv/found_robots_1000.csv", 1))
+
+
+class HeavyHitters(object):
+    """
+    Misra-Gries summary of item frequencies. Counts are underestimated by at most n / (size + 1), where n is the
+    total count added, so every item more frequent than that is kept. Counters are decremented in batches: new items
+    are added until there are 2 * size counters, then the summary shrinks back to at most size counters in one pass.
+    Two summaries can be merged without losing this guarantee, a merged summary has at most size counters.
+    """
+
+    def __init__(self, size=10000):
+        assert size > 0, "Size of summary must be positive!"
+        self.size = size
+        self.counts = {}
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def update(self, item, count=1):
+        """
+        Add count occurrences of item.
+        """
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        self.counts[item] = count
+        if len(self.counts) > 2 * self.size:
+            self._shrink()
+
+    def merge(self, other):
+        """
+        Add all counts of another summary to this one.
+
+        :type other     HeavyHitters
+        :rtype          HeavyHitters
+        """
+        self.total += other.total
+        for item, count in other.counts.items():
+            self.counts[item] = self.counts.get(item, 0) + count
+        if len(self.counts) > self.size:
+            self._shrink()
+        return self
+
+    def _shrink(self):
+        # subtract the (size + 1)th largest count from every counter and drop the ones that reach zero, at least
+        # size + 1 counters lose the full cut so the error bound holds, and at most size counters are left
+        counts = np.fromiter(self.counts.values(), dtype="int64", count=len(self.counts))
+        cut = int(np.partition(counts, len(counts) - self.size - 1)[len(counts) - self.size - 1])
+        self.counts = dict((item, count - cut) for item, count in self.counts.items() if count > cut)
+
+    def most_common(self, number=None):
+        """
+        :return:    List of (item, count) tuples in decreasing order of count.
+        :rtype      list[tuple]
+        """
+        ranked = sorted(self.counts.items(), key=lambda x: -x[1])
+        return ranked if number is None else ranked[:number]
+
+
+class RobotSketch(object):
+    """
+    Mergeable summary of user activity for finding robots during import.
+
+    :param size:            Number of users tracked in the tweet summary.
+    :param max_coordinates: Distinct coordinates are counted up to this number for each tracked user.
+    :param min_burst:       Peaks of tweets per minute are only kept for users reaching this number.
+                            Like coordinates, peaks are only kept for users tracked in the tweet summary.
+    """
+
+    def __init__(self,
+                 size=10000,
+                 max_coordinates=20,
+                 min_burst=5):
+        self.tweets = HeavyHitters(size)
+        self.max_coordinates = max_coordinates
+        self.min_burst = min_burst
+        self.coordinates = {}
+        self.peaks = {}
+        self._minutes = {}
+        self._latest_minute = None
+        self._flush_size = size
+
+    def add(self,
+            user_id,
+            unix_time,
+            coordinates):
+        """
+        Add one tweet to the sketch.
+
+        :param user_id:     Twitter user id.
+        :param unix_time:   Time of tweet.
+        :param coordinates: OSGB coordinates of the tweet.
+
+        :type user_id       int
+        :type unix_time     int
+        :type coordinates   list | tuple
+        """
+        self.tweets.update(user_id)
+
+        # keep distinct coordinates of tracked users only
+        if user_id in self.tweets:
+            user_coordinates = self.coordinates.setdefault(user_id, set())
+            if len(user_coordinates) < self.max_coordinates:
+                user_coordinates.add(tuple(coordinates))
+
+        minute = unix_time // 60
+        minute_key = (user_id, minute)
+        self._minutes[minute_key] = self._minutes.get(minute_key, 0) + 1
+        if self._latest_minute is None or minute > self._latest_minute:
+            self._latest_minute = minute
+
+        # input is roughly ordered by time so past minutes can be folded into peaks once the buffer is full,
+        # the current minute is kept so its burst is not split in two
+        if len(self._minutes) > self._flush_size:
+            self.flush(before_minute=self._latest_minute)
+            self._flush_size = max(self.tweets.size, 2 * len(self._minutes))
+
+    def flush(self,
+              before_minute=None):
+        """
+        Fold the tweets per minute collected so far into the peaks of each user.
+
+        :param before_minute:   If given then only minutes before this one are folded, the rest stay in the buffer.
+        :type before_minute     int | None
+        """
+        remaining = {}
+        for (user_id, minute), count in self._minutes.items():
+            if before_minute is not None and minute >= before_minute:
+                remaining[(user_id, minute)] = count
+            elif count >= self.min_burst and count > self.peaks.get(user_id, 0) and user_id in self.tweets:
+                self.peaks[user_id] = count
+        self._minutes = remaining
+
+        # forget coordinates and peaks of users that dropped out of the summary
+        if len(self.coordinates) > len(self.tweets):
+            self.coordinates = dict((user_id, user_coordinates)
+                                    for user_id, user_coordinates in self.coordinates.items()
+                                    if user_id in self.tweets)
+        self.peaks = dict((user_id, peak) for user_id, peak in self.peaks.items() if user_id in self.tweets)
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one.
+
+        :type other     RobotSketch
+        :rtype          RobotSketch
+        """
+        self.flush()
+        other.flush()
+        self.tweets.merge(other.tweets)
+
+        for user_id, count in other.peaks.items():
+            if count > self.peaks.get(user_id, 0):
+                self.peaks[user_id] = count
+
+        for user_id, user_coordinates in other.coordinates.items():
+            merged = self.coordinates.setdefault(user_id, set())
+            merged.update(list(user_coordinates)[:max(self.max_coordinates - len(merged), 0)])
+
+        self.coordinates = dict((user_id, user_coordinates) for user_id, user_coordinates in self.coordinates.items()
+                                if user_id in self.tweets)
+        self.peaks = dict((user_id, peak) for user_id, peak in self.peaks.items() if user_id in self.tweets)
+        return self
+
+    def candidates(self,
+                   tweet_threshold=30000,
+                   burst_threshold=10,
+                   static_threshold=1000):
+        """
+        Rank the users that look automated. A user is a candidate if they sent at least tweet_threshold tweets,
+        at least burst_threshold tweets within one minute, or at least static_threshold tweets from a single
+        coordinate.
+
+        :param tweet_threshold:     Tweets above which a user is a robot, as robot_threshold in cluster.py.
+        :param burst_threshold:     Tweets within a minute above which a user is a robot.
+        :param static_threshold:    Tweets above which a user tweeting from one coordinate is a robot.
+        :return:                    List of dictionaries with user_id, tweets, peak_per_minute,
+                                    distinct_coordinates and reason, in decreasing order of tweets.
+
+        :type tweet_threshold       int
+        :type burst_threshold       int
+        :type static_threshold      int
+        :rtype                      list[dict]
+        """
+        self.flush()
+
+        found = []
+        for user_id in set(self.tweets.counts.keys()) | set(self.peaks.keys()):
+            tweets = self.tweets.counts.get(user_id, 0)
+            peak = self.peaks.get(user_id, 0)
+            distinct = len(self.coordinates.get(user_id, ()))
+
+            reasons = []
+            if tweets >= tweet_threshold:
+                reasons.append("volume")
+            if peak >= burst_threshold:
+                reasons.append("burst")
+            if tweets >= static_threshold and distinct == 1:
+                reasons.append("static")
+
+            if len(reasons):
+                found.append({"user_id": user_id,
+                              "tweets": tweets,
+                              "peak_per_minute": peak,
+                              "distinct_coordinates": distinct,
+                              "reason": "_".join(reasons)})
+
+        return sorted(found, key=lambda x: (-x["tweets"], -x["peak_per_minute"], x["user_id"]))
+
+
+def merge_sketches(sketches):
+    """
+    Merge sketches from all import workers into one.
+
+    :param sketches:    List of RobotSketch objects, None values are skipped.
+    :return:            Merged sketch.
+
+    :type sketches      list[RobotSketch]
+    :rtype              RobotSketch
+    """
+
+    merged = None
+    for sketch in sketches:
+        if sketch is None:
+            continue
+        if merged is None:
+            merged = sketch
+        else:
+            merged.merge(sketch)
+
+    return merged if merged is not None else RobotSketch()
+
+
+def write_candidates(candidates,
+                     output_file="data/output/robot_candidates.csv"):
+    """
+    Write ranked robot candidates to csv, one user per row. The user_id is in the first column,
+    as in special_csv/robots.csv.
+
+    :param candidates:  Output of RobotSketch.candidates.
+    :param output_file: Location of csv file.
+    :return:            Number of candidates written.
+
+    :type candidates    list[dict]
+    :type output_file   str
+    :rtype              int
+    """
+
+    output_folder = find_file_name(output_file)[0]
+    if len(output_folder):
+        create_folder(output_folder)
+
+    with open(output_file, 'w', newline="\n") as out_file:
+        out_csv = writer(out_file, delimiter=",")
+        out_csv.writerow(["user_id", "chunk_id", "tweets", "peak_per_minute", "distinct_coordinates", "reason"])
+        for candidate in candidates:
+            out_csv.writerow([candidate["user_id"], candidate["user_id"] % 1000, candidate["tweets"],
+                              candidate["peak_per_minute"], candidate["distinct_coordinates"], candidate["reason"]])
+
+    return len(candidates)
+
+
+def load_robot_registry(registry_files=ROBOT_REGISTRY):
+    """
+    Read the user_ids of known robots from csv files. Rows without a user_id, such as headers, are skipped,
+    so robot_candidates.csv can be used as well.
+
+    :param registry_files:  Iterable of (file path, index of user_id column).
+    :return:                Set of robot user_ids.
+
+    :type registry_files    list[tuple] | tuple[tuple]
+    :rtype                  frozenset[int]
+    """
+
+    robot_ids = set()
+    for file_path, user_col in registry_files:
+        with open(file_path, 'r') as in_file:
+            for row in reader(in_file):
+                try:
+                    robot_ids.add(int(row[user_col]))
+                except (ValueError, IndexError):
+                    continue
+
+    return frozenset(robot_ids)
+
+
+def quarantine_chunk(mongo_connection,
+                     robots_connection,
+                     chunk_id,
+                     user_ids):
+    """
+    Move all tweets of robots in one chunk to the robots collection on the server. The tweets are copied with one
+    aggregation using $merge, and only deleted from the tweets collection once the robots collection holds at least
+    as many tweets of these users in the chunk. Tweets already in the robots collection are kept as they are.
+    The _ids of the tweets never leave the server, robots can have hundreds of thousands of tweets.
+
+    :param mongo_connection:    Mongodb parameters to the tweets collection. [ip, database, collection]
+    :param robots_connection:   Mongodb parameters to the robots collection on the same server.
+    :param chunk_id:            Chunk number.
+    :param user_ids:            Robot user_ids in the chunk.
+    :return:                    Number of tweets moved.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type robots_connection     list[str] | tuple[str]
+    :type chunk_id              int
+    :type user_ids              list[int]
+    :rtype                      int
+    """
+
+    start_time = datetime.now()
+
+    client = pymongo.MongoClient(mongo_connection[0], w=1)
+    source = client[mongo_connection[1]][mongo_connection[2]]
+    robots = client[robots_connection[1]][robots_connection[2]]
+
+    query = {"chunk_id": chunk_id, "user_id": {"$in": [int(user_id) for user_id in user_ids]}}
+    remaining = source.count_documents(query)
+
+    # if no tweets left then skip chunk
+    if remaining == 0:
+        return 0
+
+    # copy tweets on the server
+    source.aggregate([{"$match": query},
+                      {"$merge": {"into": {"db": robots_connection[1], "coll": robots_connection[2]},
+                                  "on": "_id",
+                                  "whenMatched": "keepExisting",
+                                  "whenNotMatched": "insert"}}])
+
+    # verify copies before removing any tweets, $merge on _id leaves every copied tweet in the robots collection
+    copied = robots.count_documents(query)
+    if copied < remaining:
+        print("Chunk %04d: only %d of %d robot tweets copied, not deleting!" % (chunk_id, copied, remaining))
+        return 0
+
+    deleted = source.delete_many(query).deleted_count
+    bump_versions(source, [chunk_id], "robot removal")
+
+    print("*** Chunk %04d: %3d robots, %8d tweets moved in: %s" % (chunk_id, len(user_ids), deleted,
+                                                                    datetime.now() - start_time))
+
+    return deleted
+
+
+def quarantine_robots(mongo_connection,
+                      robots_connection,
+                      user_ids,
+                      n_jobs=-1):
+    """
+    Move all tweets of robots to the robots collection. Robots are grouped by chunk_id and every chunk is
+    moved with one server side operation, see quarantine_chunk.
+
+    :param mongo_connection:    Mongodb parameters to the tweets collection. [ip, database, collection]
+    :param robots_connection:   Mongodb parameters to the robots collection on the same server.
+    :param user_ids:            Robot user_ids.
+    :param n_jobs:              Number of chunks moved in parallel.
+    :return:                    Number of tweets moved.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type robots_connection     list[str] | tuple[str]
+    :type user_ids              list[int] | set[int]
+    :type n_jobs                int
+    :rtype                      int
+    """
+
+    assert len(mongo_connection) == 3 and len(robots_connection) == 3, "Connections must be of form" \
+                                                                        "(ip:host, database, collection)"
+    assert mongo_connection[0] == robots_connection[0], "$merge needs the robots collection on the same server"
+    assert tuple(mongo_connection) != tuple(robots_connection), "Source and destination must be distinct"
+
+    # group robots by chunk
+    by_chunk = {}
+    for user_id in user_ids:
+        by_chunk.setdefault(int(user_id) % 1000, []).append(int(user_id))
+
+    moved = Parallel(n_jobs=n_jobs)(delayed(quarantine_chunk)(mongo_connection,
+                                                              robots_connection,
+                                                              chunk_id,
+                                                              by_chunk[chunk_id]) for chunk_id in sorted(by_chunk))
+
+    return sum(moved)
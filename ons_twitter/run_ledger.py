@@ -0,0 +1,217 @@
+"""
+Description:    Ledger of clustering runs kept in mongodb. Every chunk of a run has one document that is only
+                marked complete after the cluster updates of the chunk have been acknowledged by the server.
+                Used by cluster_all to skip completed chunks when a run is restarted and to rerun failed chunks.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+from datetime import datetime
+
+import pymongo
+
+
+def _ledger(ledger_connection):
+    """
+    Open the ledger collection with acknowledged writes.
+
+    :param ledger_connection:   Mongodb parameters to the ledger collection. [ip, database, collection]
+    :return:                    Pymongo collection.
+
+    :type ledger_connection     list[str] | tuple[str]
+    :rtype                      pymongo.collection.Collection
+    """
+
+    return pymongo.MongoClient(ledger_connection[0], w=1)[ledger_connection[1]][ledger_connection[2]]
+
+
+def _chunk_key(run_id,
+               chunk_id):
+    return "%s_%04d" % (run_id, chunk_id)
+
+
+def start_chunk(ledger_connection,
+                run_id,
+                chunk_id):
+    """
+    Record the start of a chunk. Restarting a chunk counts as a new attempt.
+
+    :param ledger_connection:   Mongodb parameters to the ledger collection. [ip, database, collection]
+    :param run_id:              Name of the clustering run.
+    :param chunk_id:            Chunk number.
+
+    :type ledger_connection     list[str] | tuple[str]
+    :type run_id                str
+    :type chunk_id              int
+    """
+
+    _ledger(ledger_connection).update_one({"_id": _chunk_key(run_id, chunk_id)},
+                                          {"$set": {"run_id": run_id,
+                                                    "chunk_id": chunk_id,
+                                                    "status": "started",
+                                                    "started": datetime.now()},
+                                           "$inc": {"attempts": 1}},
+                                          upsert=True)
+
+
+def complete_chunk(ledger_connection,
+                   run_id,
+                   chunk_id,
+                   users,
+                   seconds,
+                   deferred_users=()):
+    """
+    Mark a chunk complete, once all its updates were acknowledged.
+
+    :param ledger_connection:   Mongodb parameters to the ledger collection. [ip, database, collection]
+    :param run_id:              Name of the clustering run.
+    :param chunk_id:            Chunk number.
+    :param users:               Number of users clustered.
+    :param seconds:             Time taken.
+    :param deferred_users:      Users left for clustering later, see cluster_one_chunk.
+
+    :type ledger_connection     list[str] | tuple[str]
+    :type run_id                str
+    :type chunk_id              int
+    :type users                 int
+    :type seconds               float
+    :type deferred_users        list[int] | tuple[int]
+    """
+
+    _ledger(ledger_connection).update_one({"_id": _chunk_key(run_id, chunk_id)},
+                                          {"$set": {"status": "complete",
+                                                    "finished": datetime.now(),
+                                                    "seconds": seconds,
+                                                    "users": users,
+                                                    "deferred_users": [int(x) for x in deferred_users],
+                                                    "deferred_status": "pending" if len(deferred_users) else "none"},
+                                           "$unset": {"error": ""}})
+
+
+def fail_chunk(ledger_connection,
+               run_id,
+               chunk_id,
+               error,
+               deferred=False):
+    """
+    Record the failure of a chunk, or of its deferred users.
+
+    :param ledger_connection:   Mongodb parameters to the ledger collection. [ip, database, collection]
+    :param run_id:              Name of the clustering run.
+    :param chunk_id:            Chunk number.
+    :param error:               Description of the error.
+    :param deferred:            True if clustering the deferred users failed.
+
+    :type ledger_connection     list[str] | tuple[str]
+    :type run_id                str
+    :type chunk_id              int
+    :type error                 str
+    :type deferred              bool
+    """
+
+    status_field = "deferred_status" if deferred else "status"
+    _ledger(ledger_connection).update_one({"_id": _chunk_key(run_id, chunk_id)},
+                                          {"$set": {status_field: "failed",
+                                                    "finished": datetime.now(),
+                                                    "error": error}})
+
+
+def complete_deferred(ledger_connection,
+                      run_id,
+                      chunk_id,
+                      users,
+                      seconds):
+    """
+    Mark the deferred users of a chunk complete.
+
+    :param ledger_connection:   Mongodb parameters to the ledger collection. [ip, database, collection]
+    :param run_id:              Name of the clustering run.
+    :param chunk_id:            Chunk number.
+    :param users:               Number of deferred users clustered.
+    :param seconds:             Time taken.
+
+    :type ledger_connection     list[str] | tuple[str]
+    :type run_id                str
+    :type chunk_id              int
+    :type users                 int
+    :type seconds               float
+    """
+
+    _ledger(ledger_connection).update_one({"_id": _chunk_key(run_id, chunk_id)},
+                                          {"$set": {"deferred_status": "complete",
+                                                    "deferred_seconds": seconds},
+                                           "$inc": {"users": users},
+                                           "$unset": {"error": ""}})
+
+
+def completed_chunks(ledger_connection,
+                     run_id):
+    """
+    :return:    Set of chunk ids that are complete in the run.
+    :rtype      set[int]
+    """
+
+    return set(_ledger(ledger_connection).distinct("chunk_id", {"run_id": run_id, "status": "complete"}))
+
+
+def failed_chunks(ledger_connection,
+                  run_id):
+    """
+    Chunks of the run that failed or never finished.
+
+    :return:    Sorted list of chunk ids.
+    :rtype      list[int]
+    """
+
+    return sorted(_ledger(ledger_connection).distinct("chunk_id", {"run_id": run_id,
+                                                                   "status": {"$in": ["started", "failed"]}}))
+
+
+def pending_deferred_users(ledger_connection,
+                           run_id):
+    """
+    Deferred users of complete chunks that have not been clustered yet.
+
+    :return:    Dictionary of {chunk_id: [user_ids]}
+    :rtype      dict[int, list[int]]
+    """
+
+    pending = _ledger(ledger_connection).find({"run_id": run_id,
+                                                "status": "complete",
+                                                "deferred_status": {"$in": ["pending", "failed"]}},
+                                               {"chunk_id": 1, "deferred_users": 1})
+
+    return dict((chunk["chunk_id"], chunk["deferred_users"]) for chunk in pending)
+
+
+def run_report(ledger_connection,
+               run_id,
+               slowest=10):
+    """
+    Print the progress of a run: number of chunks by status, users clustered and the slowest chunks.
+
+    :param ledger_connection:   Mongodb parameters to the ledger collection. [ip, database, collection]
+    :param run_id:              Name of the clustering run.
+    :param slowest:             Number of slowest chunks to print.
+    :return:                    Dictionary of {status: number of chunks}
+
+    :type ledger_connection     list[str] | tuple[str]
+    :type run_id                str
+    :type slowest               int
+    :rtype                      dict[str, int]
+    """
+
+    chunks = list(_ledger(ledger_connection).find({"run_id": run_id}))
+
+    by_status = {}
+    for chunk in chunks:
+        by_status[chunk["status"]] = by_status.get(chunk["status"], 0) + 1
+
+    print("\nRun %s: %s" % (run_id, ", ".join("%s: %d" % x for x in sorted(by_status.items()))))
+    print(" * Users clustered: %d" % sum(chunk.get("users", 0) for chunk in chunks))
+
+    finished = sorted((chunk for chunk in chunks if "seconds" in chunk), key=lambda x: -x["seconds"])
+    for chunk in finished[:slowest]:
+        print("   chunk %04d: %8.1f sec, %6d users" % (chunk["chunk_id"], chunk["seconds"], chunk.get("users", 0)))
+
+    return by_status
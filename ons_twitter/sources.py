@@ -0,0 +1,238 @@
+"""
+Description:    Daily tweet counts by device or application (the source field) from GNIP archives, as in
+                in_development/iphone_android.py and sources_demo.py. Files are streamed line by line, every distinct
+                source string is classified once with a precompiled pattern table, and counts go into an integer
+                array indexed by (day, source class). Arrays of all files are merged at the end.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import gzip
+import re
+from datetime import date, timedelta
+from json import loads
+from os import listdir
+
+import numpy as np
+from joblib import Parallel, delayed
+
+# source classes in order of priority, a source belongs to the first class found in it
+SOURCE_CLASSES = ("iPhone", "iPad", "iOS", "Android", "Windows Phone", "BlackBerry", "Virtual Jukebox",
+                  "Twitter Web", "Instagram", "Tweetbot", "Mac")
+
+MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+          "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+
+
+class SourceClassifier(object):
+    """
+    Classify source strings into SOURCE_CLASSES. Column len(classes) is other, the last column is the total.
+
+    :param classes:         Class names in order of priority.
+    :param ignore_case:     If true then names match regardless of case, as in iphone_android.py.
+    """
+
+    def __init__(self,
+                 classes=SOURCE_CLASSES,
+                 ignore_case=True):
+        flags = re.IGNORECASE if ignore_case else 0
+        self.classes = tuple(classes)
+        self.ignore_case = ignore_case
+        self.columns = self.classes + ("other", "total")
+        self.patterns = [re.compile(re.escape(name), flags) for name in self.classes]
+        self._cache = {}
+
+    def classify(self, source):
+        """
+        :return:    Column index of the class of source.
+        :rtype      int
+        """
+        try:
+            return self._cache[source]
+        except KeyError:
+            pass
+
+        class_id = len(self.classes)
+        for index, pattern in enumerate(self.patterns):
+            if pattern.search(source) is not None:
+                class_id = index
+                break
+
+        self._cache[source] = class_id
+        return class_id
+
+
+class SourceCounts(object):
+    """
+    Integer counts by day and source class. Rows are days from first_day, grown as needed.
+
+    :param number_of_columns:   Number of source classes plus other and total.
+    """
+
+    def __init__(self, number_of_columns):
+        self.first_day = None
+        self.counts = np.zeros((0, number_of_columns), dtype="int64")
+
+    def _row(self, day):
+        # grow the array to include day
+        if self.first_day is None:
+            self.first_day = day
+        if day < self.first_day:
+            self.counts = np.vstack((np.zeros((self.first_day - day, self.counts.shape[1]), dtype="int64"),
+                                     self.counts))
+            self.first_day = day
+        row = day - self.first_day
+        if row >= len(self.counts):
+            self.counts = np.vstack((self.counts,
+                                     np.zeros((row + 1 - len(self.counts), self.counts.shape[1]), dtype="int64")))
+        return row
+
+    def add(self,
+            day,
+            class_id,
+            count=1):
+        row = self._row(day)
+        self.counts[row, class_id] += count
+        self.counts[row, -1] += count
+
+    def merge(self, other):
+        """
+        Add the counts of another SourceCounts.
+
+        :type other     SourceCounts
+        :rtype          SourceCounts
+        """
+        if other.first_day is None:
+            return self
+        self._row(other.first_day)
+        self._row(other.first_day + len(other.counts) - 1)
+        start = other.first_day - self.first_day
+        self.counts[start:start + len(other.counts)] += other.counts
+        return self
+
+    def days(self):
+        """
+        :return:    Dates of the rows.
+        :rtype      list[date]
+        """
+        if self.first_day is None:
+            return []
+        return [date.fromordinal(self.first_day) + timedelta(days=row) for row in range(len(self.counts))]
+
+
+def created_at_day(created_at,
+                   _cache={}):
+    """
+    Day ordinal of a Twitter created_at string, eg: Wed Aug 27 13:08:45 +0000 2014, without strptime.
+
+    :param created_at:  Twitter time stamp.
+    :return:            Ordinal of the date, see date.toordinal.
+
+    :type created_at    str
+    :rtype              int
+    """
+
+    key = created_at[4:10] + created_at[-4:]
+    try:
+        return _cache[key]
+    except KeyError:
+        day = date(int(created_at[-4:]), MONTHS[created_at[4:7]], int(created_at[8:10])).toordinal()
+        _cache[key] = day
+        return day
+
+
+def count_sources_one_file(file_path,
+                           classifier=None):
+    """
+    Stream one GNIP file (gzipped or plain json, one tweet per line) and count tweets by day and source class.
+    Lines that cannot be parsed and activity info lines are skipped.
+
+    :param file_path:   Location of file.
+    :param classifier:  SourceClassifier, a new one with the default classes if None.
+    :return:            Counts of the file.
+
+    :type file_path     str
+    :type classifier    None | SourceClassifier
+    :rtype              SourceCounts
+    """
+
+    if classifier is None:
+        classifier = SourceClassifier()
+
+    counts = SourceCounts(len(classifier.columns))
+    open_function = gzip.open if file_path.endswith(".gz") else open
+
+    with open_function(file_path, "rt", encoding="utf-8") as in_file:
+        for line in in_file:
+            # skip empty rows
+            if len(line) <= 3:
+                continue
+            try:
+                tweet = loads(line)
+                counts.add(created_at_day(tweet["created_at"]), classifier.classify(tweet["source"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    return counts
+
+
+def count_sources(source,
+                  output_file=None,
+                  classes=SOURCE_CLASSES,
+                  ignore_case=True,
+                  n_jobs=-1):
+    """
+    Count tweets by day and source class for a folder of GNIP files, in parallel.
+
+    :param source:          Folder of GNIP files, or a list of files.
+    :param output_file:     If given then counts are written to this csv, in the layout of
+                            in_development/sources.csv.
+    :param classes:         Source classes in order of priority.
+    :param ignore_case:     If true then class names match regardless of case.
+    :param n_jobs:          Number of files read in parallel.
+    :return:                Merged counts.
+
+    :type source            str | list[str]
+    :type output_file       None | str
+    :type classes           tuple[str]
+    :type ignore_case       bool
+    :type n_jobs            int
+    :rtype                  SourceCounts
+    """
+
+    if isinstance(source, str):
+        file_names = sorted([(source + "/" + file_name) for file_name in listdir(source)])
+    else:
+        file_names = list(source)
+
+    classifier = SourceClassifier(classes=classes, ignore_case=ignore_case)
+
+    results = Parallel(n_jobs=n_jobs)(delayed(count_sources_one_file)(file_path,
+                                                                      classifier) for file_path in file_names)
+
+    counts = SourceCounts(len(classifier.columns))
+    for one_result in results:
+        counts.merge(one_result)
+
+    if output_file is not None:
+        write_source_counts(counts, classifier, output_file)
+
+    return counts
+
+
+def write_source_counts(counts,
+                        classifier,
+                        output_file):
+    """
+    Write counts to csv with one row per day and one column per source class, then other and total.
+
+    :type counts        SourceCounts
+    :type classifier    SourceClassifier
+    :type output_file   str
+    """
+
+    with open(output_file, 'w', newline="\n") as out_file:
+        columns = [name.lower() for name in classifier.columns] if classifier.ignore_case else classifier.columns
+        out_file.write("," + ",".join(columns) + "\n")
+        for day, row in zip(counts.days(), counts.counts):
+            out_file.write(day.isoformat() + "," + ",".join(str(value) for value in row) + "\n")
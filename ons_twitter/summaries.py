@@ -0,0 +1,363 @@
+"""
+Description:    Materialised summary tables of the clustered tweets. After clustering, every chunk is read once with
+                a single aggregation and written into two small collections: cluster_summary with one document per
+                cluster and user_summary with one document per user. The analyses of in_development
+                (summary_stats.py, summary_stats_2.py, cluster_sizes.py and query_test.py) are reproduced on these
+                tables, so they do not need to group the full tweets collection again.
+                address_type_counts and cluster_size_distribution also work on one chunk of the normalised
+                clusters collection (see cluster_all), which has the same type, count and dominant fields.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+from datetime import datetime
+
+import pymongo
+from joblib import Parallel, delayed
+
+
+def _collection(mongo_connection,
+                write_concern=None):
+    """
+    Open a collection from mongodb parameters.
+
+    :param mongo_connection:    Mongodb parameters to a collection. [ip, database, collection]
+    :param write_concern:       Write concern of the client, server default if None.
+    :return:                    Pymongo collection.
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type write_concern         None | int
+    :rtype                      pymongo.collection.Collection
+    """
+
+    if write_concern is None:
+        client = pymongo.MongoClient(mongo_connection[0])
+    else:
+        client = pymongo.MongoClient(mongo_connection[0], w=write_concern)
+
+    return client[mongo_connection[1]][mongo_connection[2]]
+
+
+def summarise_chunk(mongo_connection,
+                    chunk_id,
+                    clusters_connection=None):
+    """
+    Build the summary documents of one chunk from one aggregation over its tweets. Tweets are grouped by user,
+    cluster and month, so the size of the result is the number of clusters times the months they were used.
+
+    :param mongo_connection:    Mongodb parameters to the clustered tweets. [ip, database, collection]
+    :param chunk_id:            Chunk number.
+    :param clusters_connection: Mongodb parameters to the clusters collection if clusters were written in
+                                normalised form, see cluster_all. If None then clusters are read from the tweets.
+    :return:                    Tuple of (user summaries, cluster summaries)
+
+    :type mongo_connection      list[str] | tuple[str]
+    :type chunk_id              int
+    :type clusters_connection   None | list[str] | tuple[str]
+    :rtype                      tuple[list[dict]]
+    """
+
+    tweets = _collection(mongo_connection)
+
+    # cluster fields are either embedded in the tweets or in the clusters collection
+    if clusters_connection is None:
+        group_fields = {"type": {"$first": "$cluster.type"},
+                        "count": {"$first": "$cluster.count"},
+                        "address_class": {"$first": "$cluster.address.classification.abbreviated"},
+                        "dominant": {"$max": "$cluster.dominant"}}
+        cluster_id_field = "$cluster.cluster_id"
+    else:
+        group_fields = {}
+        cluster_id_field = "$cluster_id"
+
+    group_fields["_id"] = {"user_id": "$user_id", "cluster_id": cluster_id_field, "month": "$time.month"}
+    group_fields["tweets"] = {"$sum": 1}
+
+    by_month = tweets.aggregate([{"$match": {"chunk_id": chunk_id}},
+                                 {"$group": group_fields}],
+                                allowDiskUse=True)
+
+    clusters = {}
+    users = {}
+    for group in by_month:
+        # fields missing from the tweet are left out of the group key
+        user_id = group["_id"]["user_id"]
+        cluster_id = group["_id"].get("cluster_id")
+        month = group["_id"].get("month")
+
+        # one document per user
+        if user_id not in users:
+            users[user_id] = {"_id": user_id,
+                              "chunk_id": chunk_id,
+                              "tweets": 0,
+                              "clusters": 0,
+                              "noise_clusters": 0,
+                              "clusters_by_class": {},
+                              "months_active": set(),
+                              "dominant_cluster_id": None,
+                              "dominant_count": 0}
+        users[user_id]["tweets"] += group["tweets"]
+        if month is not None:
+            users[user_id]["months_active"].add(month)
+
+        # unclustered tweets only count for the user
+        if cluster_id is None:
+            continue
+
+        # one document per cluster
+        if cluster_id not in clusters:
+            clusters[cluster_id] = {"_id": cluster_id,
+                                    "chunk_id": chunk_id,
+                                    "user_id": user_id,
+                                    "type": group.get("type"),
+                                    "count": group.get("count"),
+                                    "address_class": group.get("address_class"),
+                                    "dominant": group.get("dominant") or 0,
+                                    "tweets": 0,
+                                    "months": []}
+        clusters[cluster_id]["tweets"] += group["tweets"]
+        clusters[cluster_id]["months"].append({"month": month, "tweets": group["tweets"]})
+
+    # complete clusters from the normalised collection
+    if clusters_connection is not None and len(clusters):
+        cluster_documents = _collection(clusters_connection).find(
+            {"chunk_id": chunk_id},
+            {"type": 1, "count": 1, "address.classification.abbreviated": 1, "dominant": 1})
+
+        for cluster_document in cluster_documents:
+            if cluster_document["_id"] not in clusters:
+                continue
+            address = cluster_document.get("address")
+            one_cluster = clusters[cluster_document["_id"]]
+            one_cluster["type"] = cluster_document["type"]
+            one_cluster["count"] = cluster_document["count"]
+            one_cluster["address_class"] = address["classification"]["abbreviated"] \
+                if isinstance(address, dict) else None
+            one_cluster["dominant"] = cluster_document.get("dominant", 0)
+
+    # fold clusters into their users
+    for one_cluster in clusters.values():
+        one_user = users[one_cluster["user_id"]]
+        if one_cluster["type"] == "noise":
+            one_user["noise_clusters"] += 1
+            continue
+
+        one_user["clusters"] += 1
+        address_class = one_cluster["address_class"] if one_cluster["address_class"] is not None else "NoAddress"
+        one_user["clusters_by_class"][address_class] = one_user["clusters_by_class"].get(address_class, 0) + 1
+
+        if one_cluster["dominant"] == 1:
+            one_user["dominant_cluster_id"] = one_cluster["_id"]
+            one_user["dominant_count"] = one_cluster["count"]
+
+    for one_user in users.values():
+        one_user["months_active"] = sorted(one_user["months_active"])
+
+    return list(users.values()), list(clusters.values())
+
+
+def summarise_one_chunk(mongo_connection,
+                        user_summary_connection,
+                        cluster_summary_connection,
+                        chunk_id,
+                        clusters_connection=None):
+    """
+    Replace the summaries of one chunk. For parameters see summarise_all.
+
+    :return:    Tuple of (number of users, number of clusters)
+    :rtype      tuple[int]
+    """
+
+    start_time = datetime.now()
+
+    users, clusters = summarise_chunk(mongo_connection, chunk_id, clusters_connection=clusters_connection)
+
+    for summary_connection, documents in ((user_summary_connection, users),
+                                          (cluster_summary_connection, clusters)):
+        summary = _collection(summary_connection, write_concern=1)
+        summary.delete_many({"chunk_id": chunk_id})
+        if len(documents):
+            summary.insert_many(documents, ordered=False)
+
+    print("Summarised chunk %04d: %6d users, %7d clusters in %s" % (chunk_id, len(users), len(clusters),
+                                                                     datetime.now() - start_time))
+
+    return len(users), len(clusters)
+
+
+def summarise_all(mongo_connection,
+                  user_summary_connection,
+                  cluster_summary_connection,
+                  chunk_range=range(1000),
+                  clusters_connection=None,
+                  n_jobs=-1):
+    """
+    Write the user_summary and cluster_summary collections for all chunks, in parallel.
+    Rerunning a chunk replaces its summaries.
+
+    :param mongo_connection:            Mongodb parameters to the clustered tweets. [ip, database, collection]
+    :param user_summary_connection:     Mongodb parameters to the user_summary collection.
+    :param cluster_summary_connection:  Mongodb parameters to the cluster_summary collection.
+    :param chunk_range:                 Chunks to summarise.
+    :param clusters_connection:         Mongodb parameters to the clusters collection, if clusters were written in
+                                        normalised form.
+    :param n_jobs:                      Number of chunks summarised in parallel.
+    :return:                            Tuple of (number of users, number of clusters)
+
+    :type mongo_connection              list[str] | tuple[str]
+    :type user_summary_connection       list[str] | tuple[str]
+    :type cluster_summary_connection    list[str] | tuple[str]
+    :type chunk_range                   range | list[int]
+    :type clusters_connection           None | list[str] | tuple[str]
+    :type n_jobs                        int
+    :rtype                              tuple[int]
+    """
+
+    start_time = datetime.now()
+
+    # index summaries for replacing chunks and for the analyses
+    _collection(user_summary_connection).create_index("chunk_id")
+    _collection(cluster_summary_connection).create_index([("chunk_id", pymongo.ASCENDING),
+                                                          ("type", pymongo.ASCENDING)])
+
+    counts = Parallel(n_jobs=n_jobs)(delayed(summarise_one_chunk)(mongo_connection,
+                                                                  user_summary_connection,
+                                                                  cluster_summary_connection,
+                                                                  chunk_id,
+                                                                  clusters_connection) for chunk_id in chunk_range)
+
+    total_users = sum(x[0] for x in counts)
+    total_clusters = sum(x[1] for x in counts)
+    print("\nSummaries finished: %d users, %d clusters in %s" % (total_users, total_clusters,
+                                                                datetime.now() - start_time))
+
+    return total_users, total_clusters
+
+
+def _cluster_query(chunk_id):
+    # real clusters, of one chunk if chunk_id is given
+    query = {"type": "cluster"}
+    if chunk_id is not None:
+        query["chunk_id"] = chunk_id
+    return query
+
+
+def address_type_counts(cluster_summary_connection,
+                        chunk_id=None,
+                        address_field="address_class"):
+    """
+    Number of clusters by address classification, as in in_development/summary_stats.py.
+    Clusters without an address are counted under NoAddress.
+
+    :param cluster_summary_connection:  Mongodb parameters to the cluster_summary collection, or to the clusters
+                                        collection with address_field="address.classification.abbreviated".
+    :param chunk_id:                    Only count clusters of this chunk if given.
+    :param address_field:               Field with the address classification.
+    :return:                            Dictionary of {address class: number of clusters}
+
+    :type cluster_summary_connection    list[str] | tuple[str]
+    :type chunk_id                      None | int
+    :type address_field                 str
+    :rtype                              dict[str, int]
+    """
+
+    counts = _collection(cluster_summary_connection).aggregate(
+        [{"$match": _cluster_query(chunk_id)},
+         {"$group": {"_id": "$" + address_field, "count_by_group": {"$sum": 1}}}])
+
+    return dict((count["_id"] if count["_id"] is not None else "NoAddress", count["count_by_group"])
+                for count in counts)
+
+
+def cluster_size_distribution(cluster_summary_connection,
+                              dominant_only=False,
+                              chunk_id=None):
+    """
+    Distribution of cluster sizes, as in in_development/cluster_sizes.py.
+
+    :param cluster_summary_connection:  Mongodb parameters to the cluster_summary or the clusters collection.
+    :param dominant_only:               If true then only dominant clusters are counted, as in summary_stats_2.py.
+    :param chunk_id:                    Only count clusters of this chunk if given.
+    :return:                            Dictionary of {cluster size: number of clusters}
+
+    :type cluster_summary_connection    list[str] | tuple[str]
+    :type dominant_only                 bool
+    :type chunk_id                      None | int
+    :rtype                              dict[int, int]
+    """
+
+    query = _cluster_query(chunk_id)
+    if dominant_only:
+        query["dominant"] = 1
+
+    sizes = _collection(cluster_summary_connection).aggregate(
+        [{"$match": query},
+         {"$group": {"_id": "$count", "clusters": {"$sum": 1}}}])
+
+    return dict((size["_id"], size["clusters"]) for size in sizes)
+
+
+def user_cluster_types(user_summary_connection):
+    """
+    Number of users with only noise, only real clusters or both, as in in_development/summary_stats_2.py.
+    Also counts users with both residential and commercial clusters and users with a dominant cluster.
+
+    :param user_summary_connection: Mongodb parameters to the user_summary collection.
+    :return:                        Dictionary with only_noise, only_cluster, both, users_with_RC and
+                                    users_with_dominant_clusters counts.
+
+    :type user_summary_connection   list[str] | tuple[str]
+    :rtype                          dict[str, int]
+    """
+
+    users = _collection(user_summary_connection)
+
+    return {"only_noise": users.count_documents({"clusters": 0, "noise_clusters": {"$gt": 0}}),
+            "only_cluster": users.count_documents({"clusters": {"$gt": 0}, "noise_clusters": 0}),
+            "both": users.count_documents({"clusters": {"$gt": 0}, "noise_clusters": {"$gt": 0}}),
+            "users_with_RC": users.count_documents({"clusters_by_class.R": {"$gt": 0},
+                                                    "clusters_by_class.C": {"$gt": 0}}),
+            "users_with_dominant_clusters": users.count_documents({"dominant_cluster_id": {"$ne": None}})}
+
+
+def residential_months_distribution(cluster_summary_connection,
+                                    min_tweets=3):
+    """
+    Distribution of the number of months users tweeted from a residential cluster, as in
+    in_development/summary_stats_2.py. A month counts if the user has at least min_tweets in that cluster.
+
+    :param cluster_summary_connection:  Mongodb parameters to the cluster_summary collection.
+    :param min_tweets:                  Minimum number of tweets in a cluster in a month.
+    :return:                            Dictionary of {number of months: number of users}
+
+    :type cluster_summary_connection    list[str] | tuple[str]
+    :type min_tweets                    int
+    :rtype                              dict[int, int]
+    """
+
+    months = _collection(cluster_summary_connection).aggregate(
+        [{"$match": {"type": "cluster", "address_class": "R"}},
+         {"$unwind": "$months"},
+         {"$match": {"months.tweets": {"$gte": min_tweets}}},
+         {"$group": {"_id": "$user_id", "months": {"$addToSet": "$months.month"}}},
+         {"$group": {"_id": {"$size": "$months"}, "users": {"$sum": 1}}}])
+
+    return dict((one_size["_id"], one_size["users"]) for one_size in months)
+
+
+def residential_cluster_counts(user_summary_connection):
+    """
+    Distribution of the number of residential clusters of users, as in in_development/query_test.py.
+
+    :param user_summary_connection: Mongodb parameters to the user_summary collection.
+    :return:                        Dictionary of {number of residential clusters: number of users}
+
+    :type user_summary_connection   list[str] | tuple[str]
+    :rtype                          dict[int, int]
+    """
+
+    counts = _collection(user_summary_connection).aggregate(
+        [{"$match": {"clusters_by_class.R": {"$gt": 0}}},
+         {"$group": {"_id": "$clusters_by_class.R", "number": {"$sum": 1}}}])
+
+    return dict((count["_id"], count["number"]) for count in counts)
@@ -0,0 +1,110 @@
+"""
+Description:    Shared fixtures of the tests: mongomock clients and factories of fake tweets.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import numpy as np
+import pymongo
+import pytest
+
+from ons_twitter.cluster import ChunkArrays
+
+
+@pytest.fixture
+def mongo_clients(monkeypatch):
+    """
+    Replace pymongo.MongoClient with mongomock, one in-memory server per host. Returns the dictionary of
+    {host: client}, tests can put their own fake clients into it before they are used.
+    """
+
+    mongomock = pytest.importorskip("mongomock")
+    clients = {}
+    monkeypatch.setattr(pymongo, "MongoClient", lambda host, **kwargs: clients.setdefault(host,
+                                                                                           mongomock.MongoClient()))
+
+    return clients
+
+
+@pytest.fixture
+def make_user():
+    """
+    Factory of fake tweets of one user around 3 sites, in the format of create_dictionary_for_chunk.
+    """
+
+    def make(number_of_tweets, seed=0, user_id=1):
+        random_state = np.random.RandomState(seed)
+        sites = random_state.randint(0, 2000, (3, 2))
+        points = sites[random_state.randint(0, 3, number_of_tweets)] + \
+            random_state.normal(0, 30, (number_of_tweets, 2)).astype("int64")
+
+        return [["%d_%d" % (user_id, i), user_id, [int(point[0]), int(point[1])]] for i, point in enumerate(points)]
+
+    return make
+
+
+@pytest.fixture
+def make_chunk_arrays():
+    """
+    Factory of the columnar ChunkArrays of a list of fake tweets, as fetch_chunk_arrays returns them.
+    """
+
+    def make(tweets):
+        return ChunkArrays(np.array([tweet[0] for tweet in tweets], dtype=object),
+                           np.array([tweet[1] for tweet in tweets], dtype="int64"),
+                           np.array([tweet[2] for tweet in tweets], dtype="int32"))
+
+    return make
+
+
+@pytest.fixture
+def make_stream():
+    """
+    Factory of (user_id, time, coordinates) tweets: heavy tailed normal users, plus a fast robot 7 at one
+    coordinate and a slow robot 9 moving around.
+    """
+
+    def make(number_of_tweets, seed=0):
+        random_state = np.random.RandomState(seed)
+        users = (random_state.pareto(1.2, number_of_tweets) * 10).astype("int64") + 1000
+        times = np.sort(random_state.randint(0, 10 ** 7, number_of_tweets))
+        tweets = [(int(user), int(time), [int(user) % 500, int(time) % 300]) for user, time in zip(users, times)]
+
+        tweets += [(7, 5000000 + i, [100, 100]) for i in range(2000)]
+        tweets += [(9, 3000 * i, [i, i]) for i in range(3000)]
+        return tweets
+
+    return make
+
+
+@pytest.fixture
+def make_chunks():
+    """
+    Factory of clustered tweets of a few users per chunk, in the format of the tweets collection.
+    """
+
+    def make(number_of_chunks, seed=0):
+        random_state = np.random.RandomState(seed)
+        months = ["Apr", "May", "Jun"]
+        chunks = []
+        for chunk_id in range(number_of_chunks):
+            tweets = []
+            for user_id in range(chunk_id, chunk_id + 5000, 1000):
+                for cluster_number in range(random_state.randint(1, 4)):
+                    count = int(random_state.randint(1, 9))
+                    cluster = {"cluster_id": "%d_%d" % (user_id, cluster_number),
+                               "count": count,
+                               "type": "cluster" if count >= 3 else "noise",
+                               "dominant": int(cluster_number == 0 and count >= 3),
+                               "address": {"classification": {"abbreviated": "RC"[cluster_number % 2]},
+                                           "levels": {"oslaua": "E0600000%d" % (user_id % 3)}}}
+                    for i in range(count):
+                        month = months[random_state.randint(0, 3)]
+                        tweets.append({"user_id": user_id,
+                                       "cluster": cluster,
+                                       "time": {"month": month, "date": "2015-%s-01" % month},
+                                       "tweet": {"language": "en" if i % 3 else "cy"}})
+            chunks.append(tweets)
+        return chunks
+
+    return make
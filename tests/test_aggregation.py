@@ -0,0 +1,67 @@
+"""
+Description:    Tests for filling the aggregation pipelines per chunk and merging their partial results.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+from functools import partial
+
+import numpy as np
+
+from ons_twitter.aggregation import CHUNK_ID, ArrayPartial, CountPartial, cache_key, fill_pipeline, load_cached, \
+    save_cached, tree_merge
+
+
+def test_fill_pipeline_and_tree_merge():
+    template = [{"$match": {"chunk_id": CHUNK_ID, "cluster.type": "cluster"}},
+                {"$group": {"_id": {"size": "$cluster.count", "chunk": CHUNK_ID}, "count": {"$sum": 1}}}]
+    pipeline = fill_pipeline(template, 12)
+    assert pipeline[0]["$match"] == {"chunk_id": 12, "cluster.type": "cluster"}
+    assert pipeline[1]["$group"]["_id"]["chunk"] == 12
+    assert template[0]["$match"]["chunk_id"] == CHUNK_ID
+
+    random_state = np.random.RandomState(0)
+    outputs = [[{"_id": int(size), "count": int(count)} for size, count in zip(random_state.randint(0, 30, 10),
+                                                                                 random_state.randint(1, 5, 10))]
+               for chunk_id in range(7)]
+
+    # expected totals, summed one document at a time
+    expected = {}
+    for documents in outputs:
+        for document in documents:
+            expected[document["_id"]] = expected.get(document["_id"], 0) + document["count"]
+
+    counts = tree_merge([CountPartial()(documents, chunk_id) for chunk_id, documents in enumerate(outputs)])
+    array = tree_merge([ArrayPartial(30)(documents, chunk_id) for chunk_id, documents in enumerate(outputs)])
+
+    assert counts == expected
+    assert array.sum() == sum(expected.values())
+    for size, count in expected.items():
+        assert array[size] == count
+    assert tree_merge([]) is None
+
+
+def test_cache_keeps_latest_version(tmpdir):
+    cache_folder = str(tmpdir)
+    save_cached(cache_folder, 12, "initial", {5: 1})
+    save_cached(cache_folder, 12, "stamp_2", {5: 2})
+    save_cached(cache_folder, 13, "initial", {5: 3})
+
+    assert load_cached(cache_folder, 12, "initial") == (False, None)
+    assert load_cached(cache_folder, 12, "stamp_2") == (True, {5: 2})
+    assert load_cached(cache_folder, 13, "initial") == (True, {5: 3})
+
+    template = [{"$match": {"chunk_id": CHUNK_ID}}]
+    key = cache_key(("localhost", "twitter", "tweets"), template, CountPartial())
+    assert key == cache_key(("localhost", "twitter", "tweets"), template, CountPartial())
+    assert key != cache_key(("localhost", "twitter", "tweets"), template, CountPartial("size"))
+    assert key != cache_key(("localhost", "twitter", "robots"), template, CountPartial())
+
+    # plain functions are told apart by their code, defaults and closure
+    connection = ("localhost", "twitter", "tweets")
+    assert cache_key(connection, template, lambda d, c: 1) != cache_key(connection, template, lambda d, c: 2)
+    assert cache_key(connection, template, lambda d, c: 1) == cache_key(connection, template, lambda d, c: 1)
+    assert cache_key(connection, template, lambda d, c, x=1: x) != cache_key(connection, template, lambda d, c, x=2: x)
+    key = cache_key(connection, template, partial(ArrayPartial.__call__, ArrayPartial(10)))
+    assert key == cache_key(connection, template, partial(ArrayPartial.__call__, ArrayPartial(10)))
+    assert key != cache_key(connection, template, partial(ArrayPartial.__call__, ArrayPartial(20)))
@@ -0,0 +1,41 @@
+"""
+Description:    Tests for the accumulators of the analytics runner, merged across workers and chunks.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+from copy import deepcopy
+
+import ons_twitter.analytics as an
+
+
+def test_merged_workers_match_single_pass(make_chunks):
+    chunks = make_chunks(12)
+    accumulators = [an.DailyVolumes(), an.ClusterSizes(), an.ClusterSizes(dominant_only=True),
+                    an.AddressTypes(), an.LanguagesByLA(), an.ResidentialMonths()]
+
+    single = deepcopy(accumulators)
+    for tweets in chunks:
+        an.feed_chunk(single, tweets)
+
+    partials = []
+    for worker in range(3):
+        worker_accumulators = deepcopy(accumulators)
+        for tweets in chunks[worker::3]:
+            an.feed_chunk(worker_accumulators, tweets)
+        partials.append(worker_accumulators)
+    merged = an.merge_accumulators(partials)
+
+    for expected, found in zip(single, merged):
+        assert expected.result() == found.result()
+
+    assert sum(single[0].result().values()) == sum(len(tweets) for tweets in chunks)
+    assert sum(single[2].result().values()) == sum(single[4].result().values())
+
+
+def test_combined_projection_drops_children():
+    projection = an.combined_projection([an.AddressTypes(), an.LanguagesByLA()])
+    assert "cluster.cluster_id" in projection and "tweet.language" in projection
+
+    normalised = an.combined_projection([an.AddressTypes(), an.DailyVolumes()], normalised=True)
+    assert normalised == {"cluster_id": 1, "time.date": 1, "user_id": 1}
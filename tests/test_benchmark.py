@@ -0,0 +1,29 @@
+"""
+Description:    Tests for the synthetic users and for the labels of the clustering benchmark.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import numpy as np
+
+from benchmarks.cluster_benchmark import run_benchmark
+from benchmarks.synthetic_users import synthetic_users, tweet_counts
+
+
+def test_tweet_counts_are_heavy_tailed():
+    counts = tweet_counts(20000, np.random.RandomState(0))
+
+    assert counts.min() == 1 and counts.max() <= 30000
+    assert np.median(counts) < 10
+    assert counts.max() > 10000
+
+
+def test_benchmark_labels_agree():
+    users = synthetic_users(5, seed=3, max_tweets=400)
+    assert sorted(users.keys()) == list(range(5))
+
+    rows = run_benchmark(number_of_users=25, seed=3, measure_memory=False, max_tweets=400, output_file=None)
+
+    stages = set(row["stage"] for row in rows)
+    assert stages == {"distance_matrix", "create_one_cluster", "cluster_labels", "cluster_one_user"}
+    assert len(set(row["user_id"] for row in rows)) == 25
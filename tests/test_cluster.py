@@ -0,0 +1,476 @@
+"""
+Description:    Tests for the clustering functions of cluster.py, checked against the dense distance matrix
+                and the original one cluster at a time expansion.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pymongo
+import pytest
+
+import ons_twitter.cluster as cl
+from ons_twitter.metrics import Instrumented
+
+
+def dense_pairs(tweets, eps):
+    """
+    Reference neighbour pairs from the full distance matrix.
+    """
+    rows, cols = np.nonzero(cl.distance_matrix(tweets) < eps)
+    return set(zip(rows[rows < cols].tolist(), cols[rows < cols].tolist()))
+
+
+def test_neighbour_pairs_match_distance_matrix(make_user):
+    for number_of_tweets in (2, 10, 300, 1200):
+        tweets = make_user(number_of_tweets, seed=number_of_tweets)
+        for eps in (7, 20, 20.5):
+            expected = dense_pairs(tweets, eps)
+            for method in ("grid", "kdtree"):
+                rows, cols = cl.neighbour_pairs(tweets, eps=eps, method=method, block_size=50)
+                found = set((min(i, j), max(i, j)) for i, j in zip(rows.tolist(), cols.tolist()))
+                assert len(found) == len(rows)
+                assert found == expected
+
+
+def test_neighbour_graph_clusters_match_distance_matrix(make_user):
+    tweets = make_user(500)
+    graph = cl.neighbour_graph(tweets, eps=20)
+    matrix = cl.distance_matrix(tweets)
+
+    mask_graph = [list(range(len(tweets))), np.arange(len(tweets), dtype=np.uint32)]
+    mask_matrix = [list(range(len(tweets))), np.arange(len(tweets), dtype=np.uint32)]
+
+    while True:
+        cluster_graph, mask_graph = cl.create_one_cluster(tweets, mask_graph, graph, eps=20)
+        cluster_matrix, mask_matrix = cl.create_one_cluster(tweets, mask_matrix, matrix, eps=20)
+        assert cluster_graph == cluster_matrix
+        if cluster_graph is None:
+            break
+
+
+def test_cluster_labels_match_create_one_cluster(make_user):
+    tweets = make_user(800, seed=3)
+
+    # add some duplicate coordinates
+    for i in range(0, 800, 7):
+        tweets[i][2] = tweets[0][2]
+
+    for eps in (7, 20, 20.5):
+        # clusters of the original expansion loop, one create_one_cluster call per cluster
+        distance_array = cl.distance_matrix(tweets)
+        mask = [list(range(len(tweets))), np.arange(len(tweets), dtype=np.uint32)]
+        expected = []
+        new_cluster, mask = cl.create_one_cluster(tweets, mask, distance_array, eps=eps)
+        while new_cluster is not None:
+            expected.append(sorted(tweet[0] for tweet in new_cluster))
+            new_cluster, mask = cl.create_one_cluster(tweets, mask, distance_array, eps=eps)
+
+        for method in ("grid", "kdtree", "dense"):
+            labels = cl.cluster_labels(tweets, eps=eps, method=method)
+            found = [sorted(tweets[i][0] for i in np.flatnonzero(labels == label)) for label in range(labels.max() + 1)]
+            assert found == expected
+
+
+def test_cluster_statistics_match_per_cluster_calculation(make_user):
+    tweets = make_user(600, seed=5)
+    labels = cl.cluster_labels(tweets, eps=20)
+    statistics = cl.cluster_statistics([tweet[2] for tweet in tweets], labels)
+
+    for label in range(labels.max() + 1):
+        # the original per cluster calculation
+        coordinate_points = np.array([tweets[i][2] for i in np.flatnonzero(labels == label)])
+        cluster_centroid = coordinate_points.mean(0)
+        complex_coordinates = 1j * coordinate_points[..., 1] + coordinate_points[..., 0]
+        complex_centroid = 1j * cluster_centroid[..., 1] + cluster_centroid[..., 0]
+        distances = cl._euclidean_distances_matrix(complex_coordinates, complex_centroid)
+
+        assert statistics["count"][label] == len(coordinate_points)
+        assert (statistics["centroid"][label] == cluster_centroid).all()
+        assert (statistics["distance"][labels == label] == distances[0]).all()
+        assert statistics["max_distance"][label] == distances.max()
+        assert round(statistics["mean_distance"][label], 3) == round(distances.mean(), 3)
+        assert round(statistics["standard_deviation_distance"][label], 3) == round(distances.std(), 3)
+
+
+def test_update_user_clusters_match_full_recluster(make_user):
+    tweets = make_user(700, seed=7)
+    old_tweets = tweets[:500]
+
+    # cluster old tweets and name them as resolve_cluster_addresses would
+    pending_addresses = []
+    tweet_clusters = {}
+    for cluster in cl.cluster_one_user(1, {1: old_tweets}, None, pending_addresses=pending_addresses):
+        for tweet_info in cluster:
+            tweet_clusters[tweet_info[0]] = tweet_info[1]
+    for cluster_info, centroid, user_id, cluster_name in pending_addresses:
+        cluster_info["cluster_id"] = "%s_place_%s" % (user_id, cluster_name)
+
+    # add the new tweets
+    old_cluster_ids = [tweet_clusters[tweet[0]]["cluster_id"] for tweet in old_tweets] + [None] * 200
+    pending_addresses = []
+    for cluster in cl.update_user_clusters(1, tweets, old_cluster_ids, pending_addresses):
+        for tweet_info in cluster:
+            tweet_clusters[tweet_info[0]] = tweet_info[1]
+    for cluster_info, centroid, user_id, cluster_name in pending_addresses:
+        cluster_info["cluster_id"] = "%s_place_%s" % (user_id, cluster_name)
+
+    found = {}
+    for tweet_id, cluster_info in tweet_clusters.items():
+        found.setdefault(cluster_info["cluster_id"], []).append(tweet_id)
+
+    expected = []
+    for cluster in cl.cluster_one_user(1, {1: tweets}, None, pending_addresses=[]):
+        expected.append(sorted(tweet_info[0] for tweet_info in cluster))
+        for tweet_info in cluster:
+            for field in ("count", "type", "centroid_coordinates", "stats"):
+                assert tweet_clusters[tweet_info[0]][field] == tweet_info[1][field]
+
+    assert sorted(sorted(x) for x in found.values()) == sorted(expected)
+
+
+def residential_addresses(pending_addresses, mongo_address_list):
+    """
+    Stand-in for resolve_cluster_addresses: every cluster gets a residential address.
+    """
+    for cluster_info, centroid, user_id, cluster_name in pending_addresses:
+        cluster_info["address"] = {"classification": {"abbreviated": "R"}}
+        cluster_info["cluster_id"] = "%s_place_%s" % (user_id, cluster_name)
+    return len(pending_addresses)
+
+
+def stored_clusters(database, clusters_collection):
+    """
+    Cluster of each tweet of the tweets collection, from either layout.
+    """
+    if clusters_collection is None:
+        return dict((tweet["_id"], tweet.get("cluster")) for tweet in database["tweets"].find())
+
+    clusters = dict((cluster["_id"], cluster) for cluster in database[clusters_collection].find())
+    return dict((tweet["_id"], clusters.get(tweet.get("cluster_id"), tweet.get("cluster_id", "missing")))
+                for tweet in database["tweets"].find())
+
+
+@pytest.mark.parametrize("clusters_collection", [None, "clusters"])
+def test_cluster_new_tweets_writes_clusters_and_marks_robots(make_user, mongo_clients, monkeypatch,
+                                                             clusters_collection):
+    monkeypatch.setattr(cl, "resolve_cluster_addresses", residential_addresses)
+    mongo_connection = ("localhost", "twitter", "tweets")
+    database = pymongo.MongoClient("localhost")["twitter"]
+
+    # robot user 7 tweets from a single point
+    tweets = make_user(150, seed=3) + [["7_%d" % i, 7, [5000, 5000]] for i in range(300)]
+    database["tweets"].insert_many([{"_id": tweet[0], "chunk_id": 1, "user_id": tweet[1],
+                                     "tweet": {"coordinates": tweet[2]}} for tweet in tweets])
+
+    assert cl.cluster_new_tweets(mongo_connection, None, 1, robot_threshold=260,
+                                 clusters_collection=clusters_collection, track_versions=False) == 1
+
+    found = stored_clusters(database, clusters_collection)
+    first_dominant = set(cluster["cluster_id"] for tweet_id, cluster in found.items()
+                         if tweet_id.startswith("1_") and cluster.get("dominant"))
+    largest = max(cluster["count"] for tweet_id, cluster in found.items()
+                  if tweet_id.startswith("1_") and cluster["type"] == "cluster")
+    assert len(first_dominant) >= 1
+    assert all(found["1_%d" % i]["count"] == largest for i in range(150) if found["1_%d" % i].get("dominant"))
+
+    # robot tweets are marked, so they are not new tweets in the next run
+    robot_tweet = database["tweets"].find_one({"_id": "7_0"})
+    if clusters_collection is None:
+        assert robot_tweet["cluster"] == {"type": "robot"}
+    else:
+        assert robot_tweet["cluster_id"] is None
+
+    # a new, bigger residential cluster takes the dominant flag from an unchanged cluster
+    new_tweets = [["1_%d" % (150 + i), 1, [50000 + i % 10, 50000 + i // 10]] for i in range(100)]
+    database["tweets"].insert_many([{"_id": tweet[0], "chunk_id": 1, "user_id": tweet[1],
+                                     "tweet": {"coordinates": tweet[2]}} for tweet in new_tweets])
+
+    assert cl.cluster_new_tweets(mongo_connection, None, 1, robot_threshold=260,
+                                 clusters_collection=clusters_collection, track_versions=False) == 1
+
+    found = stored_clusters(database, clusters_collection)
+    dominant = set(cluster["cluster_id"] for cluster in found.values() if cluster and cluster.get("dominant"))
+    assert dominant == {found["1_150"]["cluster_id"]}
+    assert found["1_150"]["count"] == 100
+    assert first_dominant.isdisjoint(dominant)
+
+    # the clusters written are the clusters of a full recluster
+    all_tweets = make_user(150, seed=3) + new_tweets
+    written = {}
+    for tweet in all_tweets:
+        written.setdefault(found[tweet[0]]["cluster_id"], []).append(tweet[0])
+    expected = [sorted(tweet_info[0] for tweet_info in cluster)
+                for cluster in cl.cluster_one_user(1, {1: all_tweets}, None, pending_addresses=[])]
+    assert sorted(sorted(x) for x in written.values()) == sorted(expected)
+
+    for tweet in database["tweets"].find({"user_id": 1}):
+        assert "distance_from_centroid" in tweet["tweet"]
+        total_tweets = tweet["total_tweets_for_user"] if clusters_collection is None else \
+            found[tweet["_id"]]["total_tweets_for_user"]
+        assert total_tweets == 250
+
+
+def test_grouped_cluster_updates_match_per_tweet_updates(make_user, mongo_clients):
+    # two users, with duplicate points so that tweets share distances
+    tweets = make_user(200, seed=5, user_id=1) + make_user(60, seed=6, user_id=1001)
+    tweets += [["%s_copy" % tweet[0], tweet[1], tweet[2]] for tweet in tweets[::3]]
+    tweets_by_user = {}
+    for tweet in tweets:
+        tweets_by_user.setdefault(tweet[1], []).append(tweet)
+
+    pending_addresses = []
+    mongo_updates = [cl.cluster_one_user(user_id, tweets_by_user, None, pending_addresses=pending_addresses)
+                     for user_id in tweets_by_user.keys()]
+    residential_addresses(pending_addresses, None)
+
+    client = pymongo.MongoClient("localhost")
+    for database_name in ("grouped", "per_tweet"):
+        client[database_name]["tweets"].insert_many([{"_id": tweet[0], "chunk_id": 1, "user_id": tweet[1],
+                                                      "tweet": {"coordinates": tweet[2]}} for tweet in tweets])
+
+    # the same updates written one tweet at a time
+    for user in mongo_updates:
+        for cluster in user:
+            for tweet_id, cluster_info, distance, total_tweets in cluster:
+                client["per_tweet"]["tweets"].update_one({"_id": tweet_id},
+                                                         {"$set": {"cluster": cluster_info,
+                                                                   "total_tweets_for_user": int(total_tweets),
+                                                                   "tweet.distance_from_centroid": float(distance)}})
+
+    assert cl.write_cluster_updates(("localhost", "grouped", "tweets"), mongo_updates, batch_size=7,
+                                    acknowledged=True) == len(tweets)
+
+    grouped = list(client["grouped"]["tweets"].find(sort=[("_id", 1)]))
+    assert grouped == list(client["per_tweet"]["tweets"].find(sort=[("_id", 1)]))
+    assert len(set(tweet["tweet"]["distance_from_centroid"] for tweet in grouped)) < len(grouped)
+
+
+def test_create_work_units_cover_all_users_heaviest_first():
+    random_state = np.random.RandomState(0)
+    user_counts = dict(((user_id % 1000, user_id), int(count))
+                       for user_id, count in enumerate(random_state.pareto(1.2, 20000) * 10 + 1))
+    work_units = cl.create_work_units(user_counts, num_workers=16)
+
+    unit_sizes = [work_unit[0] for work_unit in work_units]
+    assert unit_sizes == sorted(unit_sizes, reverse=True)
+    assert sum(unit_sizes) == sum(user_counts.values())
+
+    scheduled = [(chunk_id, user_id) for number_of_tweets, chunk_id, user_ids in work_units for user_id in user_ids]
+    assert sorted(scheduled) == sorted(user_counts.keys())
+    for number_of_tweets, chunk_id, user_ids in work_units:
+        assert number_of_tweets == sum(user_counts[(chunk_id, user_id)] for user_id in user_ids)
+
+
+def test_heaviest_first_stamps_and_records_each_chunk_once(make_user, mongo_clients, monkeypatch):
+    monkeypatch.setattr(cl, "resolve_cluster_addresses", residential_addresses)
+    bumps = []
+    monkeypatch.setattr(cl, "bump_versions", lambda collection, chunk_ids, reason: bumps.append(list(chunk_ids)))
+    mongo_connection = ("localhost", "twitter", "tweets")
+    ledger_connection = ("localhost", "twitter", "cluster_runs")
+    database = pymongo.MongoClient("localhost")["twitter"]
+
+    # a heavy user and a few light users in chunks 1 and 2
+    tweets = make_user(300, seed=1, user_id=1) + make_user(20, seed=2, user_id=1001) + \
+        make_user(20, seed=3, user_id=2001) + make_user(30, seed=4, user_id=2)
+    database["tweets"].insert_many([{"_id": tweet[0], "chunk_id": tweet[1] % 1000, "user_id": tweet[1],
+                                     "tweet": {"coordinates": tweet[2]}} for tweet in tweets])
+
+    # chunk 2 can not be read
+    fetch_chunk_arrays = cl.fetch_chunk_arrays
+
+    def fetch_readable_chunks(mongo_connection, chunk_id, user_ids=None):
+        if chunk_id == 2:
+            raise cl.OperationFailure("node is recovering")
+        return fetch_chunk_arrays(mongo_connection, chunk_id, user_ids)
+
+    monkeypatch.setattr(cl, "fetch_chunk_arrays", fetch_readable_chunks)
+
+    results = cl.cluster_heaviest_first(mongo_connection, ("localhost", "address", "address"), [1, 2], num_cores=1,
+                                        ledger_connection=ledger_connection, run_id="run")
+
+    # the heavy user and the light users of chunk 1 are separate units
+    assert sorted(results) == [0, 1, 2]
+    assert bumps == [[1, 2]]
+    assert cl.run_ledger.completed_chunks(ledger_connection, "run") == {1}
+    assert cl.run_ledger.failed_chunks(ledger_connection, "run") == [2]
+    assert database["cluster_runs"].find_one({"_id": "run_0001"})["users"] == 3
+    assert database["tweets"].count_documents({"chunk_id": 1, "cluster": {"$exists": True}}) == 340
+    assert database["tweets"].count_documents({"chunk_id": 2, "cluster": {"$exists": True}}) == 0
+
+
+def test_write_concern_of_cluster_one_chunk_follows_track_versions(make_chunk_arrays, make_user, monkeypatch):
+    monkeypatch.setattr(cl, "resolve_cluster_addresses", residential_addresses)
+    monkeypatch.setattr(cl, "bump_versions", lambda collection, chunk_ids, reason: len(chunk_ids))
+    tweets = make_user(50, seed=1)
+    monkeypatch.setattr(cl, "fetch_chunk_arrays",
+                        lambda mongo_connection, chunk_id, user_ids=None: make_chunk_arrays(tweets))
+    write_concerns = []
+    monkeypatch.setattr(cl, "write_cluster_updates",
+                        lambda mongo_connection, mongo_updates, acknowledged=False: write_concerns.append(acknowledged))
+
+    tweets_connection = ("localhost", "twitter", "tweets")
+    for track_versions in (True, False):
+        cl.cluster_one_chunk(tweets_connection, None, 1, sleep_for_cores=False, track_versions=track_versions)
+    cl.cluster_one_chunk(tweets_connection, None, 1, sleep_for_cores=False, track_versions=False, acknowledged=True)
+    assert write_concerns == [True, False, True]
+
+    # unacknowledged updates can not be stamped
+    with pytest.raises(AssertionError):
+        cl.cluster_one_chunk(tweets_connection, None, 1, sleep_for_cores=False, acknowledged=False)
+
+
+class FoundAddresses(list):
+    """
+    Result of a find, with the limit of a pymongo cursor.
+    """
+
+    def limit(self, number):
+        return self[:number]
+
+
+class SlowAddressBase(object):
+    """
+    Address base with one address for every centroid east of 0, keeping track of concurrent lookups.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.most_active = 0
+        self.lookups = []
+
+    def find(self, query, projection):
+        easting, northing = query["coordinates"]["$near"]
+        with self.lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+            self.lookups.append((easting, northing))
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+
+        if easting < 0:
+            return FoundAddresses()
+        return FoundAddresses([{"coordinates": [easting + 3, northing + 4],
+                                "postcode": "AB%d %dCD" % (easting, northing)}])
+
+
+def test_resolve_cluster_addresses_overlaps_lookups(mongo_clients):
+    address_base = SlowAddressBase()
+    mongo_clients["address_host"] = {"address": {"address": address_base}}
+
+    pending_addresses = []
+    centroids = [(i, i) for i in range(-2, 30)] * 2
+    for cluster_name, centroid in enumerate(centroids):
+        pending_addresses.append(({"type": "cluster"}, np.array(centroid, dtype=float), 1, cluster_name))
+
+    assert cl.resolve_cluster_addresses(pending_addresses, ("address_host", "address", "address")) == 32
+    assert sorted(address_base.lookups) == sorted(set(centroids))
+    assert address_base.most_active > 1
+
+    for cluster_info, centroid, user_id, cluster_name in pending_addresses:
+        if centroid[0] < 0:
+            assert (cluster_info["address"], cluster_info["cluster_id"]) == ("NA", "1_NA_%d" % cluster_name)
+        else:
+            assert cluster_info["address"]["distance"] == 5.0
+            assert cluster_info["cluster_id"] == "1_AB%d_%dCD_%d" % (centroid[0], centroid[1], cluster_name)
+
+    # clusters sharing a centroid do not share the address document
+    assert pending_addresses[2][0]["address"] is not pending_addresses[34][0]["address"]
+
+
+def test_chunk_arrays_cluster_like_dictionary(make_chunk_arrays, make_user):
+    tweets = make_user(400, seed=1, user_id=1) + make_user(50, seed=2, user_id=1001) + \
+        make_user(300, seed=3, user_id=2001)
+    np.random.RandomState(0).shuffle(tweets)
+
+    # dictionary of create_dictionary_for_chunk and the columnar version of the same tweets
+    tweets_by_user = {}
+    for tweet in tweets:
+        tweets_by_user.setdefault(tweet[1], []).append(tweet)
+    chunk_arrays = make_chunk_arrays(tweets)
+
+    assert sorted(chunk_arrays.keys()) == sorted(tweets_by_user.keys())
+    for user_id in tweets_by_user.keys():
+        assert list(chunk_arrays[user_id]) == tweets_by_user[user_id]
+
+        expected = cl.cluster_one_user(user_id, tweets_by_user, None, pending_addresses=[])
+        found = cl.cluster_one_user(user_id, chunk_arrays, None, pending_addresses=[])
+        assert len(found) == len(expected)
+        for found_cluster, expected_cluster in zip(found, expected):
+            assert [x[0] for x in found_cluster] == [x[0] for x in expected_cluster]
+            assert [x[2] for x in found_cluster] == [x[2] for x in expected_cluster]
+            assert found_cluster[0][1] == expected_cluster[0][1]
+
+
+def test_cluster_labels_sweep_match_cluster_labels(make_user):
+    tweets = make_user(900, seed=11)
+    eps_values = [5, 12.5, 20, 40]
+    labels_by_eps = cl.cluster_labels_sweep(tweets, eps_values)
+
+    for eps in eps_values:
+        assert (labels_by_eps[eps] == cl.cluster_labels(tweets, eps=eps)).all()
+
+
+def test_find_dominant_clusters_flags_largest_residential_with_ties():
+    residential = {"classification": {"abbreviated": "R"}}
+    commercial = {"classification": {"abbreviated": "C"}}
+    cluster_infos = [{"type": "cluster", "count": 10, "address": residential},
+                     {"type": "cluster", "count": 50, "address": commercial},
+                     {"type": "cluster", "count": 10, "address": residential},
+                     {"type": "cluster", "count": 4, "address": residential},
+                     {"type": "cluster", "count": 30, "address": "NA"},
+                     {"type": "noise", "count": 2, "address": "NA_noise"}]
+
+    dominant = cl.find_dominant_clusters(cluster_infos)
+    assert [id(x) for x in dominant] == [id(cluster_infos[0]), id(cluster_infos[2])]
+    assert cl.find_dominant_clusters(cluster_infos[4:]) == []
+
+
+def test_memory_strategy_of_every_user_is_counted(make_user, capsys):
+    tweets_by_user = {1: make_user(300, seed=1, user_id=1), 2: make_user(300, seed=2, user_id=2)}
+    cluster_user = Instrumented(cl.cluster_one_user)
+
+    _, dense_metrics = cluster_user(1, tweets_by_user, None, memory_budget=2 ** 30, pending_addresses=[])
+    result, deferred_metrics = cluster_user(2, tweets_by_user, None, memory_budget=1, pending_addresses=[])
+
+    assert dense_metrics.counters["users with strategy dense"] == 1
+    assert deferred_metrics.counters["users with strategy deferred"] == 1
+    assert result is None
+    # only users that do not fit the dense matrix are printed
+    output = capsys.readouterr().out
+    assert "user: 1 tweets" not in output
+    assert "user: 2 tweets: 300 strategy: None" in output
+
+
+def test_memory_estimates_are_on_the_safe_side(make_chunk_arrays, make_user):
+    random_state = np.random.RandomState(0)
+    scattered = [["1_%d" % i, 1, [int(x), int(y)]] for i, (x, y) in enumerate(random_state.randint(0, 10 ** 6,
+                                                                                                    (3000, 2)))]
+    for tweets in (make_user(3000, seed=1), scattered):
+        chunk_arrays = make_chunk_arrays(tweets)
+        estimates = cl.estimate_cluster_memory(tweets)
+        for strategy in ("dense", "grid"):
+            # once untraced, so that lazy imports and first use caches are not counted
+            cl.cluster_one_user(1, make_chunk_arrays(tweets[:50]), None, neighbour_method=strategy,
+                                pending_addresses=[])
+            tracemalloc.start()
+            cl.cluster_one_user(1, chunk_arrays, None, neighbour_method=strategy, pending_addresses=[])
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert peak_memory <= estimates[strategy]
+
+
+def test_sweep_all_of_no_chunks_writes_empty_settings(tmpdir):
+    output_file = str(tmpdir.join("sweep.csv"))
+    summaries = cl.sweep_all(None, None, [10, 20], [3], chunk_range=[], output_file=output_file)
+
+    assert sorted(summaries.keys()) == [(10, 3), (20, 3)]
+    assert all(summary["users"] == 0 and summary["size_distribution"] == {} for summary in summaries.values())
+    with open(output_file) as in_file:
+        assert len(in_file.readlines()) == 3
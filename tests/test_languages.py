@@ -0,0 +1,37 @@
+"""
+Description:    Tests for the matrix of languages by local authority and its csv output.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import numpy as np
+
+from ons_twitter.languages import language_matrix_from_counts, write_language_matrix
+
+
+def test_language_matrix_matches_loop(tmpdir):
+    random_state = np.random.RandomState(0)
+    all_languages = ["en", "cy", "pl", "fr", "und"]
+    counts = {}
+    for i in range(300):
+        languages = sorted(set(random_state.choice(all_languages, random_state.randint(1, 4))))
+        key = ("E0600000%d" % random_state.randint(0, 7), "_".join(languages))
+        counts[key] = counts.get(key, 0) + int(random_state.randint(1, 5))
+
+    # split each user evenly between their languages, undetermined languages are dropped
+    expected = {}
+    for (oslaua, languages), users in counts.items():
+        languages = [language for language in languages.split("_") if language != "und"]
+        for language in languages:
+            expected[(oslaua, language)] = expected.get((oslaua, language), 0) + users / len(languages)
+
+    matrix, oslaua_codes, languages = language_matrix_from_counts(counts)
+
+    assert "und" not in languages
+    for (oslaua, language), value in expected.items():
+        assert abs(matrix[oslaua_codes.index(oslaua), languages.index(language)] - value) < 1e-9
+    assert abs(matrix.sum() - sum(expected.values())) < 1e-9
+
+    data_frame = write_language_matrix(matrix, oslaua_codes, languages, str(tmpdir.join("language_matrix.csv")))
+    assert data_frame.index.name == "oslaua"
+    assert tmpdir.join("language_matrix.csv").read().startswith("oslaua," + ",".join(languages))
@@ -0,0 +1,61 @@
+"""
+Description:    Tests for the stage timers and counters of metrics.py.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import json
+from datetime import datetime
+from time import perf_counter, sleep
+
+import numpy as np
+
+from ons_twitter import metrics
+
+
+def _worker(durations):
+    for seconds in durations:
+        metrics.add_time("insert", seconds, items=2)
+    with metrics.timer("parse", items=len(durations)):
+        metrics.count("files")
+    return len(durations)
+
+
+def test_worker_metrics_merge_into_report(tmpdir):
+    random_state = np.random.RandomState(0)
+    durations = [random_state.lognormal(-6, 1.5, 1000) for i in range(4)]
+
+    results, merged = metrics.split_results([metrics.Instrumented(_worker)(one_worker) for one_worker in durations])
+
+    # nothing is recorded outside instrumented workers
+    metrics.add_time("insert", 1.0)
+    assert len(metrics.METRICS.stages) == 0
+
+    assert results == [1000] * 4
+    insert = merged.stages["insert"]
+    assert insert.calls == 4000 and insert.items == 8000
+    assert abs(insert.seconds - np.sum(durations)) < 1e-9
+    for percent in (50, 90, 99):
+        expected = np.percentile(np.concatenate(durations), percent)
+        assert abs(insert.percentile(percent) / expected - 1) < 0.15
+
+    report = metrics.write_report(merged, str(tmpdir.join("metrics.json")), "import", datetime.now())
+    assert report["counters"] == {"files": 4}
+    assert report["stages"]["parse"]["calls"] == 4
+    assert sum(worker["tasks"] for worker in report["workers"].values()) == 4
+    assert json.loads(tmpdir.join("metrics.json").read())["stages"]["insert"]["calls"] == 4000
+
+
+def test_nested_timers_are_not_counted_twice():
+    recorded = metrics.Metrics(enabled=True)
+    start_time = perf_counter()
+    with recorded.timer("parse"):
+        sleep(0.02)
+        with recorded.timer("reproject"):
+            sleep(0.05)
+    wall_seconds = perf_counter() - start_time
+
+    assert recorded.stages["reproject"].seconds >= 0.05
+    assert 0.02 <= recorded.stages["parse"].seconds < 0.05
+    assert recorded.stages["parse"].seconds + recorded.stages["reproject"].seconds <= wall_seconds
+    assert recorded.active_timers == []
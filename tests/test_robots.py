@@ -0,0 +1,191 @@
+"""
+Description:    Tests for the robot sketches kept during import and for moving robot tweets to quarantine.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import numpy as np
+import pymongo
+import pytest
+
+from ons_twitter import robots
+from ons_twitter.robots import HeavyHitters, RobotSketch, merge_sketches
+
+TWEETS = ("localhost", "twitter", "tweets")
+ROBOTS = ("localhost", "twitter", "robots")
+
+
+def test_heavy_hitters_merge_within_error_bound():
+    stream = [int(x) for x in (np.random.RandomState(1).pareto(1.0, 20000) * 5)]
+    exact = {}
+    for item in stream:
+        exact[item] = exact.get(item, 0) + 1
+
+    parts = [HeavyHitters(50) for _ in range(4)]
+    for i, item in enumerate(stream):
+        parts[i % 4].update(item)
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+
+    bound = len(stream) / 51.0
+    assert merged.total == len(stream)
+    assert len(merged) <= 50
+    for item, count in exact.items():
+        estimate = merged.counts.get(item, 0)
+        assert count - bound <= estimate <= count
+        if count > bound:
+            assert item in merged
+
+
+def test_heavy_hitters_shrink_in_batches():
+    stream = [int(x) for x in (np.random.RandomState(2).pareto(1.0, 20000) * 5)]
+    exact = {}
+    for item in stream:
+        exact[item] = exact.get(item, 0) + 1
+
+    heavy_hitters = HeavyHitters(50)
+    shrinks = [0]
+    shrink = heavy_hitters._shrink
+
+    def counted_shrink():
+        shrinks[0] += 1
+        shrink()
+        assert len(heavy_hitters) <= 50
+
+    heavy_hitters._shrink = counted_shrink
+    new_counters = 0
+    for item in stream:
+        new_counters += item not in heavy_hitters
+        heavy_hitters.update(item)
+        assert len(heavy_hitters) <= 100
+
+    # every shrink is preceded by at least 51 new counters
+    assert 0 < shrinks[0] <= new_counters // 51
+    bound = len(stream) / 51.0
+    for item, count in exact.items():
+        assert count - bound <= heavy_hitters.counts.get(item, 0) <= count
+
+
+def test_merged_sketches_rank_robots(make_stream):
+    tweets = make_stream(30000)
+    sketches = [RobotSketch(size=200) for _ in range(5)]
+    for i, tweet in enumerate(tweets):
+        sketches[i * 5 // len(tweets)].add(*tweet)
+
+    candidates = merge_sketches(sketches).candidates(tweet_threshold=2500, burst_threshold=10, static_threshold=1000)
+    by_user = dict((candidate["user_id"], candidate) for candidate in candidates)
+
+    assert by_user[7]["reason"] == "burst_static"
+    assert by_user[7]["distinct_coordinates"] == 1
+    assert by_user[7]["peak_per_minute"] >= 59
+    assert by_user[9]["reason"] == "volume"
+    assert [x["tweets"] for x in candidates] == sorted([x["tweets"] for x in candidates], reverse=True)
+
+
+def test_steady_burst_survives_buffer_flushes():
+    # a robot sending 9 tweets every minute among 60 one-off users per minute, the buffer fills within each minute
+    sketch = RobotSketch(size=50, min_burst=5)
+    other_user = 1000
+    for minute in range(100):
+        for second in range(60):
+            sketch.add(other_user, minute * 60 + second, [second, minute])
+            other_user += 1
+            if second % 7 == 3:
+                sketch.add(1, minute * 60 + second, [0, 0])
+
+    candidates = sketch.candidates(tweet_threshold=10 ** 6, burst_threshold=9, static_threshold=10 ** 6)
+
+    assert [candidate["user_id"] for candidate in candidates] == [1]
+    assert candidates[0]["peak_per_minute"] == 9
+    assert set(sketch.peaks.keys()) <= set(sketch.tweets.counts.keys())
+    assert len(sketch._minutes) == 0
+
+
+@pytest.fixture
+def quarantine_database(mongo_clients, monkeypatch):
+    """
+    Mongomock database of tweets with robots 7 and 1007 and a normal user 2007 in chunk 7, and robot 9 in chunk 9.
+    Mongomock has no $merge, so it is carried out here as the server does with keepExisting and insert.
+    The returned list collects the version bumps.
+    """
+    mongomock = pytest.importorskip("mongomock")
+    client = pymongo.MongoClient("localhost")
+
+    aggregate = mongomock.collection.Collection.aggregate
+
+    def aggregate_with_merge(collection, pipeline, *args, **kwargs):
+        if "$merge" not in pipeline[-1]:
+            return aggregate(collection, pipeline, *args, **kwargs)
+        into = pipeline[-1]["$merge"]["into"]
+        destination = client[into["db"]][into["coll"]]
+        for document in aggregate(collection, pipeline[:-1], *args, **kwargs):
+            if destination.count_documents({"_id": document["_id"]}) == 0:
+                destination.insert_one(document)
+        return iter([])
+
+    monkeypatch.setattr(mongomock.collection.Collection, "aggregate", aggregate_with_merge)
+
+    bumps = []
+    monkeypatch.setattr(robots, "bump_versions", lambda collection, chunk_ids, reason: bumps.append(list(chunk_ids)))
+
+    tweets = [{"_id": "%d_%d" % (user_id, i), "chunk_id": user_id % 1000, "user_id": user_id, "text": "tweet"}
+              for user_id in (7, 1007, 2007, 9) for i in range(5)]
+    client["twitter"]["tweets"].insert_many(tweets)
+
+    return client["twitter"], bumps
+
+
+def test_quarantine_moves_robot_tweets(quarantine_database, monkeypatch):
+    database, bumps = quarantine_database
+
+    # _ids of robot tweets must stay on the server
+    distinct = type(database["tweets"]).distinct
+
+    def distinct_without_ids(collection, key, *args, **kwargs):
+        assert key != "_id", "tweet _ids were loaded into python"
+        return distinct(collection, key, *args, **kwargs)
+
+    monkeypatch.setattr(type(database["tweets"]), "distinct", distinct_without_ids)
+
+    assert robots.quarantine_robots(TWEETS, ROBOTS, [7, 1007, 9], n_jobs=1) == 15
+
+    assert sorted(database["tweets"].distinct("user_id")) == [2007]
+    assert database["tweets"].count_documents({}) == 5
+    assert database["robots"].count_documents({}) == 15
+    assert sorted(bumps) == [[7], [9]]
+
+    # nothing left to move on a second run
+    assert robots.quarantine_robots(TWEETS, ROBOTS, [7, 1007, 9], n_jobs=1) == 0
+    assert database["robots"].count_documents({}) == 15
+
+
+def test_quarantine_keeps_tweets_if_copies_are_missing(quarantine_database, monkeypatch):
+    database, bumps = quarantine_database
+
+    # copy all but one of the tweets
+    aggregate = database["tweets"].aggregate
+    monkeypatch.setattr(type(database["tweets"]), "aggregate",
+                        lambda collection, pipeline, *args, **kwargs: aggregate([{"$match": {"_id": {"$ne": "7_0"}}}]
+                                                                                + pipeline, *args, **kwargs))
+
+    assert robots.quarantine_chunk(TWEETS, ROBOTS, 7, [7, 1007]) == 0
+
+    assert database["tweets"].count_documents({"chunk_id": 7}) == 15
+    assert database["robots"].count_documents({}) == 9
+    assert bumps == []
+
+
+def test_quarantine_rerun_keeps_existing_copies(quarantine_database):
+    database, bumps = quarantine_database
+
+    # an earlier run copied some tweets of robot 7 but stopped before deleting them
+    database["robots"].insert_many([{"_id": "7_%d" % i, "chunk_id": 7, "user_id": 7, "text": "first copy"}
+                                    for i in range(3)])
+
+    assert robots.quarantine_chunk(TWEETS, ROBOTS, 7, [7, 1007]) == 10
+
+    assert database["tweets"].count_documents({"chunk_id": 7}) == 5
+    assert database["robots"].count_documents({}) == 10
+    assert database["robots"].count_documents({"text": "first copy"}) == 3
+    assert bumps == [[7]]
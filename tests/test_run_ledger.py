@@ -0,0 +1,77 @@
+"""
+Description:    Tests for the ledger of clustering runs and for chunks whose tweets cannot be read.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from ons_twitter import cluster as cl
+from ons_twitter import run_ledger
+
+LEDGER = ("ledger_host", "twitter", "cluster_runs")
+TWEETS = ("tweets_host", "twitter", "tweets")
+
+
+class UnreadableCollection(object):
+    """
+    Tweets collection of a server that fails every query.
+    """
+
+    def count_documents(self, *args, **kwargs):
+        raise OperationFailure("node is recovering")
+
+    def find(self, *args, **kwargs):
+        raise OperationFailure("node is recovering")
+
+
+@pytest.fixture
+def unreadable_tweets(mongo_clients, monkeypatch):
+    mongo_clients["tweets_host"] = {"twitter": {"tweets": UnreadableCollection()}}
+    monkeypatch.setattr(cl.time, "sleep", lambda seconds: None)
+    return mongo_clients
+
+
+def test_ledger_records_chunks_and_deferred_users(mongo_clients):
+    for chunk_id in (1, 2, 3):
+        run_ledger.start_chunk(LEDGER, "run", chunk_id)
+    run_ledger.start_chunk(LEDGER, "run", 3)
+
+    run_ledger.complete_chunk(LEDGER, "run", 1, users=10, seconds=2.0)
+    run_ledger.complete_chunk(LEDGER, "run", 2, users=5, seconds=1.0, deferred_users=[77, 78])
+    run_ledger.fail_chunk(LEDGER, "run", 3, "AutoReconnect()")
+
+    assert run_ledger.completed_chunks(LEDGER, "run") == {1, 2}
+    assert run_ledger.failed_chunks(LEDGER, "run") == [3]
+    assert run_ledger.completed_chunks(LEDGER, "other run") == set()
+    assert run_ledger.pending_deferred_users(LEDGER, "run") == {2: [77, 78]}
+
+    run_ledger.complete_deferred(LEDGER, "run", 2, users=2, seconds=30.0)
+    assert run_ledger.pending_deferred_users(LEDGER, "run") == {}
+
+    chunk_3 = mongo_clients["ledger_host"]["twitter"]["cluster_runs"].find_one({"_id": "run_0003"})
+    assert chunk_3["attempts"] == 2
+    assert chunk_3["error"] == "AutoReconnect()"
+    assert run_ledger.run_report(LEDGER, "run") == {"complete": 2, "failed": 1}
+
+
+def test_unreadable_chunk_is_failed_not_complete(unreadable_tweets):
+    with pytest.raises(OperationFailure):
+        cl.fetch_chunk_arrays(TWEETS, chunk_id=12)
+
+    result = cl._cluster_chunk_with_ledger(LEDGER, "run", TWEETS, None, 12, sleep_for_cores=False)
+
+    assert result == 0
+    assert run_ledger.completed_chunks(LEDGER, "run") == set()
+    assert run_ledger.failed_chunks(LEDGER, "run") == [12]
+    assert "node is recovering" in unreadable_tweets["ledger_host"]["twitter"]["cluster_runs"].find_one()["error"]
+
+
+def test_unreadable_chunk_is_skipped_without_ledger(unreadable_tweets, capsys):
+    assert cl.cluster_one_chunk(TWEETS, None, 12, sleep_for_cores=False) == 0
+    assert cl.cluster_one_chunk(TWEETS, None, 12, sleep_for_cores=False, memory_budget=10 ** 9) == (0, [])
+    assert "Chunk skipped, could not be read: 0012" in capsys.readouterr().out
+
+    # the other chunks of the run are not stopped
+    assert cl.cluster_all(TWEETS, ("address_host", "address", "address"), chunk_range=[12, 13], parallel=False) == 0
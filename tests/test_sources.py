@@ -0,0 +1,54 @@
+"""
+Description:    Tests for counting tweets of each source per day in gzipped GNIP archives.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import gzip
+from datetime import datetime
+from json import dumps
+
+import numpy as np
+
+from ons_twitter.sources import SOURCE_CLASSES, count_sources, count_sources_one_file
+
+
+def test_source_counts_match_loop(tmpdir):
+    random_state = np.random.RandomState(0)
+    sources = ['<a href="http://twitter.com/download/iphone">Twitter for iPhone</a>',
+               '<a href="http://twitter.com/download/android">Twitter for Android</a>',
+               '<a href="http://twitter.com">Twitter Web Client</a>',
+               '<a href="http://instagram.com">Instagram</a>',
+               '<a href="http://example.com">Some Bot</a>']
+    days = ["Wed Aug 27 13:08:45 +0000 2014", "Sun Aug 31 23:59:59 +0000 2014", "Mon Sep 01 00:00:01 +0000 2014"]
+
+    # write the archives and count their sources per day alongside
+    expected = {}
+    for file_number in range(3):
+        with gzip.open(str(tmpdir.join("%d.json.gz" % file_number)), "wt", encoding="utf-8") as out_file:
+            for i in range(200):
+                source = sources[random_state.randint(len(sources))]
+                created_at = days[random_state.randint(len(days))]
+                out_file.write(dumps({"created_at": created_at, "source": source}) + "\n")
+
+                key = datetime.strptime(created_at, "%a %b %d %H:%M:%S +0000 %Y").date()
+                row = expected.setdefault(key, np.zeros(len(SOURCE_CLASSES) + 2, dtype="int64"))
+                for class_id, name in enumerate(SOURCE_CLASSES):
+                    if source.lower().find(name.lower()) > 0:
+                        row[class_id] += 1
+                        break
+                else:
+                    row[-2] += 1
+                row[-1] += 1
+            out_file.write('{"info": {"activity_count": 200}}\n')
+
+    counts = count_sources(str(tmpdir), output_file=str(tmpdir.join("sources.csv")), n_jobs=1)
+
+    assert counts.counts.shape == (6, len(SOURCE_CLASSES) + 2)
+    for day, row in zip(counts.days(), counts.counts):
+        assert np.array_equal(row, expected.get(day, np.zeros_like(row)))
+    assert counts.counts.sum(axis=0)[-1] == 600
+
+    single = count_sources_one_file(str(tmpdir.join("0.json.gz")))
+    assert single.counts[:, -1].sum() == 200
+    assert tmpdir.join("sources.csv").read().startswith(",iphone,ipad,ios,android")
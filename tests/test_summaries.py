@@ -0,0 +1,101 @@
+"""
+Description:    Tests for the summary tables and the queries of the normalised clusters collection, against mongomock.
+Date:           19/10/2026
+Python version: 3.4
+"""
+
+import pytest
+
+from ons_twitter import cluster_queries
+from ons_twitter import summaries
+
+TWEETS = ("localhost", "twitter", "tweets")
+NORMALISED_TWEETS = ("localhost", "twitter", "normalised_tweets")
+CLUSTERS = ("localhost", "twitter", "clusters")
+USER_SUMMARY = ("localhost", "twitter", "user_summary")
+CLUSTER_SUMMARY = ("localhost", "twitter", "cluster_summary")
+
+# cluster_id, user_id, type, address class, dominant, months of its tweets, language of its tweets
+CLUSTERS_OF_USERS = [("1_a", 1, "cluster", "R", 1, [1, 1, 1, 2], "en"),
+                     ("1_b", 1, "cluster", "C", 0, [1, 3, 3], "cy"),
+                     ("1_c", 1, "noise", None, 0, [4], "en"),
+                     ("1001_a", 1001, "cluster", "R", 1, [5, 5, 5, 6, 6, 6], "fr"),
+                     ("2_a", 2, "noise", None, 0, [7], "en"),
+                     ("2_b", 2, "noise", None, 0, [7], "en")]
+
+
+@pytest.fixture
+def clustered_tweets(mongo_clients):
+    """
+    The same clusters written both ways: embedded in the tweets and in the normalised clusters collection.
+    """
+
+    database = summaries._collection(TWEETS).database
+    for cluster_id, user_id, cluster_type, address_class, dominant, months, language in CLUSTERS_OF_USERS:
+        address = "NA" if address_class is None else {"classification": {"abbreviated": address_class},
+                                                      "levels": {"oslaua": "E0%d" % user_id}}
+        cluster = {"cluster_id": cluster_id, "type": cluster_type, "count": len(months), "address": address}
+        if dominant:
+            cluster["dominant"] = 1
+
+        tweets = [{"_id": "%s_%d" % (cluster_id, i), "chunk_id": user_id % 1000, "user_id": user_id,
+                   "time": {"month": month}, "tweet": {"language": language}} for i, month in enumerate(months)]
+        database["tweets"].insert_many([dict(tweet, cluster=cluster) for tweet in tweets])
+        database["normalised_tweets"].insert_many([dict(tweet, cluster_id=cluster_id) for tweet in tweets])
+        database["clusters"].insert_one(dict(cluster, _id=cluster_id, user_id=user_id, chunk_id=user_id % 1000,
+                                             dominant=dominant))
+
+    return database
+
+
+def _by_id(documents):
+    return sorted(documents, key=lambda x: x["_id"])
+
+
+def test_both_layouts_give_the_same_summaries(clustered_tweets):
+    for chunk_id in (1, 2):
+        users, clusters = summaries.summarise_chunk(TWEETS, chunk_id)
+        normalised_users, normalised_clusters = summaries.summarise_chunk(NORMALISED_TWEETS, chunk_id,
+                                                                          clusters_connection=CLUSTERS)
+        assert _by_id(users) == _by_id(normalised_users)
+        assert _by_id(clusters) == _by_id(normalised_clusters)
+
+    users, clusters = summaries.summarise_chunk(TWEETS, 1)
+    user_1 = [user for user in users if user["_id"] == 1][0]
+    assert user_1["tweets"] == 8
+    assert (user_1["clusters"], user_1["noise_clusters"]) == (2, 1)
+    assert user_1["clusters_by_class"] == {"R": 1, "C": 1}
+    assert user_1["months_active"] == [1, 2, 3, 4]
+    assert (user_1["dominant_cluster_id"], user_1["dominant_count"]) == ("1_a", 4)
+
+
+def test_statistics_of_summary_tables(clustered_tweets):
+    assert summaries.summarise_all(TWEETS, USER_SUMMARY, CLUSTER_SUMMARY, chunk_range=[1, 2], n_jobs=1) == (3, 6)
+
+    # rerunning a chunk replaces its summaries
+    summaries.summarise_one_chunk(TWEETS, USER_SUMMARY, CLUSTER_SUMMARY, 1)
+    assert clustered_tweets["cluster_summary"].count_documents({}) == 6
+
+    assert summaries.address_type_counts(CLUSTER_SUMMARY) == {"R": 2, "C": 1}
+    assert summaries.cluster_size_distribution(CLUSTER_SUMMARY) == {4: 1, 3: 1, 6: 1}
+    assert summaries.cluster_size_distribution(CLUSTER_SUMMARY, dominant_only=True) == {4: 1, 6: 1}
+    assert summaries.residential_months_distribution(CLUSTER_SUMMARY) == {1: 1, 2: 1}
+    assert summaries.residential_cluster_counts(USER_SUMMARY) == {1: 2}
+    assert summaries.user_cluster_types(USER_SUMMARY) == {"only_noise": 1, "only_cluster": 1, "both": 1,
+                                                          "users_with_RC": 1, "users_with_dominant_clusters": 2}
+
+
+def test_chunk_queries_of_clusters_collection(clustered_tweets):
+    summaries.summarise_all(TWEETS, USER_SUMMARY, CLUSTER_SUMMARY, chunk_range=[1, 2], n_jobs=1)
+
+    for chunk_id in (1, 2):
+        assert summaries.address_type_counts(CLUSTERS, chunk_id, address_field="address.classification.abbreviated") \
+            == summaries.address_type_counts(CLUSTER_SUMMARY, chunk_id)
+        assert summaries.cluster_size_distribution(CLUSTERS, chunk_id=chunk_id) == \
+            summaries.cluster_size_distribution(CLUSTER_SUMMARY, chunk_id=chunk_id)
+    assert summaries.cluster_size_distribution(CLUSTERS, chunk_id=1) == {4: 1, 3: 1, 6: 1}
+
+    languages = cluster_queries.dominant_languages(CLUSTERS, NORMALISED_TWEETS, 1)
+    assert sorted((x["cluster_id"], x["user_id"], x["oslaua"], x["languages"]) for x in languages) == \
+        [("1001_a", 1001, "E01001", "fr"), ("1_a", 1, "E01", "en")]
+    assert cluster_queries.dominant_languages(CLUSTERS, NORMALISED_TWEETS, 2) == []